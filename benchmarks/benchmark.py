@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reproducible performance benchmarks for dogtail
+
+The benchmarks run against the in-process fake desktop of dogtail.fakeatspi,
+filled with the synthetic trees of trees.py, so they need neither a session
+nor an accessibility bus. Each benchmark records the best wall-clock time
+over several repeats and the number of remote (AT-SPI) calls it made, which
+is exact and independent of the machine.
+
+Results are written as JSON; when a baseline (a previous results file) is
+given, every benchmark is compared against it and the script exits with
+status 1 if any of them got slower than the tolerance allows or makes more
+remote calls than before:
+
+    python benchmarks/benchmark.py --output results.json
+    python benchmarks/benchmark.py --baseline results.json
+"""
+
+import os
+import sys
+import gc
+import atexit
+import json
+import time
+import tempfile
+import argparse
+import platform
+import subprocess
+
+os.environ['DOGTAIL_BACKEND'] = 'fake'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from dogtail.config import config
+config.backend = 'fake'
+config.logDebugToFile = False
+config.logDebugToStdOut = False
+config.searchBackoffDuration = 0
+config.actionDelay = 0
+config.defaultDelay = 0
+config.childrenLimit = 1000000
+
+from dogtail import fakeatspi
+import trees
+
+"""
+The registered benchmarks, as (name, function) pairs in the order they run.
+"""
+benchmarks = []
+
+
+def benchmark(function):
+    """
+    Registers a benchmark. The function gets the scale and returns a callable
+    doing the work to be timed, after whatever setup it needs. The callable
+    may return a Measured instance, for work done outside of this process.
+    """
+    benchmarks.append((function.__name__, function))
+    return function
+
+
+class Skip(Exception):
+
+    """
+    Raised by a benchmark that cannot run here, e.g. for lack of GDK.
+    """
+    pass
+
+
+class Measured(object):
+
+    """
+    The remote calls made and seconds taken by work measured by the benchmark
+    itself.
+    """
+
+    def __init__(self, calls, seconds):
+        self.calls = calls
+        self.seconds = seconds
+
+
+def loadShape(shapeName, scale):
+    """
+    Replaces the applications on the fake desktop with the given tree shape,
+    returning its frame as a dogtail Node.
+    """
+    import dogtail.tree
+    fakeatspi.reset()
+    app = fakeatspi.buildTree(trees.shapes[shapeName](scale))
+    fakeatspi.addApplication(app)
+    return dogtail.tree.root[0][0]
+
+
+def lastNamed(frame, roleName):
+    """
+    The name of the last node with the given role below frame, found without
+    going through dogtail's search code.
+    """
+    name = None
+    for node in frame._iterSubtree():
+        if node._roleName == roleName:
+            name = node._name
+    return name
+
+
+def makeSearchBenchmark(shapeName, roleName, findAll=False):
+    def search(scale):
+        from dogtail.predicate import GenericPredicate
+        frame = loadShape(shapeName, scale)
+        pred = GenericPredicate(name=lastNamed(frame, roleName),
+                                roleName=roleName)
+        if findAll:
+            return lambda: frame.findChildren(pred)
+        return lambda: frame.findChild(pred, retry=False)
+    search.__name__ = '%s_%s' % (findAll and 'findChildren' or 'findChild',
+                                 shapeName)
+    return search
+
+for _shape, _role in (('wideTable', 'table cell'),
+                      ('deepNesting', 'push button'),
+                      ('sameNamedButtons', 'push button'),
+                      ('hypertextDocument', 'paragraph')):
+    benchmark(makeSearchBenchmark(_shape, _role))
+    benchmark(makeSearchBenchmark(_shape, _role, findAll=True))
+
+
+@benchmark
+def documentChildren(scale):
+    document = loadShape('hypertextDocument', scale)[0][0]
+
+    def readChildren():
+        for paragraph in document.children:
+            paragraph.children
+    return readChildren
+
+
+@benchmark
+def documentChildrenWithoutAnchors(scale):
+    document = loadShape('hypertextDocument', scale)[0][0]
+
+    def readChildren():
+        config.includeLinkAnchors = False
+        try:
+            for paragraph in document.children:
+                paragraph.children
+        finally:
+            config.includeLinkAnchors = True
+    return readChildren
+
+
+@benchmark
+def userVisibleStrings(scale):
+    application = loadShape('sameNamedButtons', scale).parent
+    return lambda: list(application.iterUserVisibleStrings())
+
+
+@benchmark
+def spatialIndex(scale):
+    from dogtail.spatial import SpatialIndex
+    frame = loadShape('sameNamedButtons', scale)
+    points = [(x, y) for x in range(0, 200, 5) for y in range(0, 500, 5)]
+
+    def mapPoints():
+        index = SpatialIndex(frame, start=False)
+        return [index.at(x, y) for x, y in points]
+    return mapPoints
+
+
+@benchmark
+def mirrorSearch(scale):
+    from dogtail.mirror import LiveMirror
+    from dogtail.predicate import GenericPredicate
+    frame = loadShape('wideTable', scale)
+    liveMirror = LiveMirror(frame.parent)
+    atexit.register(liveMirror.close)
+    pred = GenericPredicate(name=lastNamed(frame, 'table cell'),
+                            roleName='table cell')
+    return lambda: frame.findChild(pred, retry=False)
+
+
+@benchmark
+def labelledSearch(scale):
+    from dogtail.predicate import IsLabelledAs
+    frame = loadShape('labelledForm', scale)
+    pred = IsLabelledAs(lastNamed(frame, 'label'))
+    return lambda: frame.findChild(pred, retry=False)
+
+
+@benchmark
+def genericPredicate(scale):
+    from dogtail.predicate import GenericPredicate
+    frame = loadShape('sameNamedButtons', scale)
+    nodes = frame.findChildren(GenericPredicate(roleName='push button'))
+    pred = GenericPredicate(name='Apply', roleName='push button')
+
+    def match():
+        for node in nodes:
+            pred.satisfiedByNode(node)
+    return match
+
+
+@benchmark
+def translatableString(scale):
+    from dogtail import i18n
+
+    class DictTranslationDb(i18n.TranslationDb):
+
+        def __init__(self, translations):
+            self.translations = translations
+
+        def getTranslationsOf(self, srcName):
+            return self.translations.get(srcName, [])
+
+    strings = ['String %i' % i for i in range(200)]
+    saved = i18n.translationDbs[:]
+    i18n.translationDbs[:] = [
+        DictTranslationDb(dict((s, ['%s (%i)' % (s, db)]) for s in strings))
+        for db in range(20 * scale)]
+
+    def match():
+        try:
+            for s in strings:
+                i18n.TranslatableString(s).matchedBy('Not %s' % s)
+        finally:
+            i18n.translationDbs[:] = saved
+    return match
+
+
+@benchmark
+def fetchMany(scale):
+    from dogtail.tree import fetchMany
+    frame = loadShape('wideTable', scale)
+    cells = frame[0][0].children[:1000]
+    return lambda: fetchMany(cells, ('name', 'roleName', 'states'))
+
+
+@benchmark
+def tableRowWhere(scale):
+    frame = loadShape('wideTable', scale)
+    table = frame[0][0]
+    lastRow = table.queryTable().nRows - 1
+    return lambda: table.rowWhere('Column 0', 'Cell %i:0' % lastRow)
+
+
+@benchmark
+def dumpPlain(scale):
+    from dogtail import dump
+    frame = loadShape('wideTable', scale)
+    fd, fileName = tempfile.mkstemp(prefix='dogtail-bench-dump-')
+    os.close(fd)
+
+    def dumpToFile():
+        try:
+            dump.plain(frame, fileName)
+        finally:
+            os.remove(fileName)
+    return dumpToFile
+
+
+@benchmark
+def dumpDesktop(scale):
+    from dogtail import dump
+    import dogtail.tree
+    fakeatspi.reset()
+    for i in range(4):
+        spec = trees.sameNamedButtons(scale)
+        spec['name'] = 'same-named-buttons-%i' % i
+        fakeatspi.addApplication(fakeatspi.buildTree(spec))
+    fd, fileName = tempfile.mkstemp(prefix='dogtail-bench-dump-')
+    os.close(fd)
+
+    def dumpToFile():
+        try:
+            dump.desktop('plain', fileName, root=dogtail.tree.root)
+        finally:
+            os.remove(fileName)
+    return dumpToFile
+
+
+@benchmark
+def snapshotWrite(scale):
+    from dogtail import snapshot
+    frame = loadShape('wideTable', scale)
+    fd, fileName = tempfile.mkstemp(prefix='dogtail-bench-snapshot-')
+    os.close(fd)
+
+    def write():
+        try:
+            snapshot.write(frame, fileName)
+        finally:
+            os.remove(fileName)
+    return write
+
+
+@benchmark
+def snapshotSearch(scale):
+    from dogtail import snapshot
+    from dogtail.predicate import GenericPredicate
+    frame = loadShape('wideTable', scale)
+    fd, fileName = tempfile.mkstemp(prefix='dogtail-bench-snapshot-')
+    os.close(fd)
+    snapshot.write(frame, fileName)
+    atexit.register(os.remove, fileName)
+    pred = GenericPredicate(name=lastNamed(frame, 'table cell'),
+                            roleName='table cell')
+
+    def search():
+        snapshot.Snapshot(fileName).root.findChild(pred)
+    return search
+
+
+@benchmark
+def treeDiff(scale):
+    from dogtail import snapshot, diff
+    frame = loadShape('wideTable', scale)
+    fileNames = []
+
+    def record():
+        fd, fileName = tempfile.mkstemp(prefix='dogtail-bench-snapshot-')
+        os.close(fd)
+        snapshot.write(frame, fileName)
+        atexit.register(os.remove, fileName)
+        fileNames.append(fileName)
+
+    record()
+    cells = list(frame._iterSubtree())[-10:]
+    for cell in cells[::2]:
+        cell.setName(cell._name + ' (changed)')
+    cells[-1]._parent.removeChild(cells[-1])
+    record()
+
+    def compare():
+        diff.diff(*fileNames)
+    return compare
+
+
+@benchmark
+def absoluteSearchPath(scale):
+    from dogtail.predicate import GenericPredicate
+    frame = loadShape('deepNesting', scale)
+    buttons = frame.findChildren(GenericPredicate(roleName='push button'))
+
+    def getPaths():
+        for button in buttons:
+            button.getAbsoluteSearchPath()
+    return getPaths
+
+
+@benchmark
+def sharedSearchPaths(scale):
+    from dogtail.predicate import GenericPredicate
+    from dogtail.tree import searchPathScope
+    frame = loadShape('sameNamedButtons', scale)
+    buttons = frame.findChildren(GenericPredicate(roleName='push button'))
+
+    def getPaths():
+        with searchPathScope():
+            for button in buttons:
+                button.getAbsoluteSearchPath()
+    return getPaths
+
+
+@benchmark
+def pathResolver(scale):
+    from dogtail.path import PathResolver
+    from dogtail.predicate import GenericPredicate
+    frame = loadShape('sameNamedButtons', scale)
+    buttons = frame.findChildren(GenericPredicate(roleName='push button'))
+    paths = [button.getAbsoluteSearchPath() for button in buttons[::10]]
+    return lambda: PathResolver().resolve(paths)
+
+
+@benchmark
+def keySymResolution(scale):
+    try:
+        from dogtail import rawinput
+        rawinput.keyNameToKeySym('a')
+    except (ImportError, AttributeError, TypeError):
+        raise Skip("GDK is not available")
+    names = ([chr(c) for c in range(ord(' '), ord('~'))] +
+             list(rawinput.keyNameAliases.keys())) * 10 * scale
+
+    def resolve():
+        for name in names:
+            rawinput.keyNameToKeySym(name)
+    return resolve
+
+
+def _runPython(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [p for p in sys.path if p] + [env.get('PYTHONPATH', '')])
+    return subprocess.check_output([sys.executable, '-c', code], env=env)
+
+
+@benchmark
+def startup(scale):
+    """
+    Importing dogtail.tree in a fresh interpreter, less the interpreter's own
+    startup time.
+    """
+    def importTree():
+        start = time.time()
+        _runPython('pass')
+        bare = time.time() - start
+        start = time.time()
+        calls = _runPython('import dogtail.tree\n'
+                           'from dogtail import fakeatspi\n'
+                           'print(fakeatspi.callCount)')
+        startupTime = time.time() - start - bare
+        return Measured(int(calls.split()[-1]), startupTime)
+    return importTree
+
+
+def runBenchmark(function, scale, repeat):
+    """
+    Times function, returning a results dict, or None if it was skipped.
+    """
+    try:
+        work = function(scale)
+    except Skip as e:
+        print("%-32s skipped: %s" % (function.__name__, e))
+        return None
+    best = None
+    calls = None
+    for i in range(repeat):
+        gc.collect()
+        fakeatspi.resetCallCount()
+        start = time.time()
+        result = work()
+        elapsed = time.time() - start
+        calls = fakeatspi.callCount
+        if isinstance(result, Measured):
+            calls, elapsed = result.calls, result.seconds
+        if best is None or elapsed < best:
+            best = elapsed
+    print("%-32s %10.4fs %10i calls" % (function.__name__, best, calls))
+    return {'seconds': best, 'calls': calls}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results against baseline, printing and returning the names of
+    the benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in sorted(results['benchmarks'].items()):
+        old = baseline['benchmarks'].get(name)
+        if not old:
+            continue
+        ratio = result['seconds'] / max(old['seconds'], 1e-9)
+        slower = ratio > tolerance
+        moreCalls = result['calls'] > old['calls']
+        if slower or moreCalls:
+            regressions.append(name)
+        print("%-32s %6.2fx time, %+i calls%s" %
+              (name, ratio, result['calls'] - old['calls'],
+               (slower or moreCalls) and '  REGRESSION' or ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the dogtail performance benchmarks.")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="multiply the size of the synthetic trees")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs per benchmark; the best one counts")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every remote call")
+    parser.add_argument('--output', help="write the results to this file")
+    parser.add_argument('--baseline',
+                        help="compare against these stored results")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument('names', nargs='*',
+                        help="run only the benchmarks with these names")
+    args = parser.parse_args()
+
+    fakeatspi.setLatency(args.latency)
+    results = {'python': platform.python_version(),
+               'scale': args.scale,
+               'latency': args.latency,
+               'benchmarks': {}}
+    for name, function in benchmarks:
+        if args.names and name not in args.names:
+            continue
+        result = runBenchmark(function, args.scale, args.repeat)
+        if result:
+            results['benchmarks'][name] = result
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        if (baseline.get('scale'), baseline.get('latency')) != \
+                (args.scale, args.latency):
+            print("Warning: the baseline was run with different settings")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic accessible trees for the benchmarks
+
+Each function returns a dogtail.fakeatspi tree specification (see
+fakeatspi.buildTree()) of an application with one frame, shaped after a kind
+of application that is expensive to search or dump. The 'scale' argument
+multiplies the size of the interesting part of the tree.
+"""
+
+
+def _application(name, children):
+    return {'name': name, 'roleName': 'application', 'children': [
+        {'name': name.capitalize(), 'roleName': 'frame',
+         'extents': (0, 0, 1024, 768), 'children': children}]}
+
+
+def wideTable(scale=1, columns=5):
+    """
+    A list view: a tree table with 1000 * scale rows of table cells.
+    """
+    rows = 1000 * scale
+    cells = []
+    for row in range(rows):
+        for column in range(columns):
+            cells.append({'name': 'Cell %i:%i' % (row, column),
+                          'roleName': 'table cell',
+                          'actions': ['activate', 'edit']})
+    return _application('wide-table', [
+        {'roleName': 'scroll pane', 'children': [
+            {'roleName': 'tree table', 'columns': columns,
+             'columnHeaders': ['Column %i' % c for c in range(columns)],
+             'children': cells}]}])
+
+
+def deepNesting(scale=1, depth=200):
+    """
+    Panels nested depth levels deep, scale times, with a button at the bottom
+    of each chain.
+    """
+    chains = []
+    for chain in range(scale):
+        node = {'name': 'Deep %i' % chain, 'roleName': 'push button',
+                'actions': ['click']}
+        for level in range(depth):
+            node = {'roleName': 'panel', 'children': [node]}
+        chains.append(node)
+    return _application('deep-nesting', chains)
+
+
+def sameNamedButtons(scale=1, groups=50, buttonsPerGroup=20):
+    """
+    Many dialogs' worth of panels full of buttons sharing a few names, as in
+    settings applications; only the last one is labelled 'Apply'.
+    """
+    names = ('OK', 'Cancel', 'Help', 'Close')
+    panels = []
+    for group in range(groups * scale):
+        buttons = []
+        for i in range(buttonsPerGroup):
+            buttons.append({'name': names[i % len(names)],
+                            'roleName': 'push button',
+                            'actions': ['click'],
+                            'extents': (i * 10, group * 10, 10, 10)})
+        panels.append({'name': 'Group %i' % group, 'roleName': 'panel',
+                       'children': buttons})
+    panels[-1]['children'].append({'name': 'Apply',
+                                   'roleName': 'push button',
+                                   'actions': ['click']})
+    return _application('same-named-buttons', panels)
+
+
+def hypertextDocument(scale=1, paragraphs=200, linksPerParagraph=10):
+    """
+    A help-viewer-like document whose paragraphs are full of links.
+    """
+    children = []
+    for p in range(paragraphs * scale):
+        links = []
+        for l in range(linksPerParagraph):
+            links.append({'uri': 'help:page-%i-%i' % (p, l),
+                          'anchor': {'name': 'Link %i.%i' % (p, l),
+                                     'roleName': 'link',
+                                     'actions': ['jump']}})
+        children.append({'name': 'Paragraph %i' % p,
+                         'roleName': 'paragraph',
+                         'text': 'Paragraph %i' % p, 'links': links})
+    return _application('hypertext-document', [
+        {'roleName': 'scroll pane', 'children': [
+            {'name': 'Help', 'roleName': 'document web',
+             'children': children}]}])
+
+
+def labelledForm(scale=1, fields=500):
+    """
+    A long settings form: rows of a label and the text entry it labels.
+    """
+    rows = []
+    for field in range(fields * scale):
+        rows.append({'roleName': 'filler', 'children': [
+            {'name': 'Field %i' % field, 'roleName': 'label',
+             'id': 'label%i' % field,
+             'relations': {'label for': ['entry%i' % field]}},
+            {'roleName': 'text', 'id': 'entry%i' % field,
+             'relations': {'labelled by': ['label%i' % field]}}]})
+    return _application('labelled-form', [
+        {'roleName': 'scroll pane', 'children': rows}])
+
+
+"""
+All the shapes, by name.
+"""
+shapes = {
+    'wideTable': wideTable,
+    'deepNesting': deepNesting,
+    'sameNamedButtons': sameNamedButtons,
+    'hypertextDocument': hypertextDocument,
+    'labelledForm': labelledForm,
+}
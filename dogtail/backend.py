@@ -0,0 +1,44 @@
+"""
+Chooses the accessibility bindings the rest of dogtail talks to.
+
+config.backend selects either 'atspi', the real AT-SPI bindings (pyatspi), or
+'fake', the in-process fake desktop of dogtail.fakeatspi, which needs neither
+an accessibility bus nor a session and is meant for benchmarking and testing.
+The choice is made once, when this module is first imported (which happens
+when dogtail.tree is), so set config.backend or the DOGTAIL_BACKEND
+environment variable before that.
+
+Both 'pyatspi' and 'Accessibility' are exported, like the real bindings
+provide them; with the fake backend they are the same module. RemoteError is
+what calls into an application raise when it fails, e.g. when the accessible
+is defunct.
+"""
+
+from config import config
+
+if config.backend == 'fake':
+    import fakeatspi as pyatspi
+    Accessibility = pyatspi
+    RemoteError = pyatspi.GError
+elif config.backend == 'atspi':
+    try:
+        import pyatspi
+        import Accessibility
+        from gi.repository.GLib import GError as RemoteError
+    except ImportError:  # pragma: no cover
+        raise ImportError("Error importing the AT-SPI bindings")
+else:
+    raise ValueError("Unknown backend '%s': use 'atspi' or 'fake'" %
+                     config.backend)
+
+
+def accessibleKey(accessible):
+    """
+    The (bus name, object path) pair identifying an accessible, as held by
+    its proxy, hence known without asking its application; or (None, the
+    id() of the proxy) if the bindings do not tell.
+    """
+    try:
+        return (accessible.app.bus_name, accessible.path)
+    except Exception:
+        return (None, id(accessible))
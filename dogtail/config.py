@@ -50,6 +50,14 @@ class _Config(object):
     searchBackoffDuration (float):
     Time in seconds for which to delay when a search fails.
 
+    waitInterval (float):
+    The interval at which the waits of dogtail.events (e.g. Node.waitFor())
+    check their condition again, besides when an event comes.
+
+    waitTimeout (float):
+    The time in seconds after which the waits of dogtail.events give up, if
+    they are not given a timeout.
+
     searchWarningThreshold (int):
     Number of retries before logging the individual attempts at a search.
 
@@ -63,6 +71,12 @@ class _Config(object):
     When there are a very large number of children of a node, only return
     this many, starting with the first.
 
+    includeLinkAnchors (boolean):
+    Whether Node.children, dumps, snapshots and getUserVisibleStrings count
+    the anchors of the links in the text of a node among its children
+    (default True). Leaving them out saves querying the Hypertext interface
+    of every node walked; they remain available as Node.linkAnchors.
+
     debugSearching (boolean):
     Whether to write info on search backoff and retry to the debug log.
 
@@ -97,14 +111,32 @@ class _Config(object):
     passed to the debug logger.
 
     checkForA11y (boolean):
-    Whether to check if accessibility is enabled. If not, just assume it is
-    (default True).
+    Whether to check if accessibility is enabled, on the first search or
+    action. If not, just assume it is (default True).
+
+    checkForApplications (boolean):
+    Whether to warn when dogtail.tree is imported if no AT-SPI-aware
+    applications are running (default False).
 
     logDebugToFile (boolean):
     Whether to write debug output to a log file.
 
     logDebugToStdOut (boolean):
     Whether to print log output to console or not (default True).
+
+    backend (str):
+    The accessibility bindings to use: 'atspi' for the real AT-SPI bindings,
+    or 'fake' for the in-process fake desktop of dogtail.fakeatspi. Must be
+    set before dogtail.tree is imported. Defaults to the DOGTAIL_BACKEND
+    environment variable, or 'atspi'.
+
+    logSearchReport (boolean):
+    Whether to write a report of the search statistics gathered during the
+    run to the debug log when the script exits (default False).
+
+    dumpTimeout (float):
+    The number of seconds each application gets when dumping the whole
+    desktop (default 30).
     """
     @property
     def scriptName(self):
@@ -132,8 +164,12 @@ class _Config(object):
         'searchBackoffDuration': 0.5,
         'searchWarningThreshold': 3,
         'searchCutoffCount': 20,
+        'waitInterval': 0.5,
+        'waitTimeout': 10,
         'defaultDelay': 0.5,
         'childrenLimit': 100,
+        'includeLinkAnchors': True,
+        'dumpTimeout': 30,
 
         # Debug
         'debugSearching': False,
@@ -146,9 +182,12 @@ class _Config(object):
         'blinkOnActions': False,
         'fatalErrors': False,
         'checkForA11y': True,
+        'checkForApplications': False,
+        'backend': os.environ.get('DOGTAIL_BACKEND', 'atspi'),
 
         # Logging
-        'logDebugToFile': True
+        'logDebugToFile': True,
+        'logSearchReport': False
     }
 
     options = {}
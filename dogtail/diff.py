@@ -0,0 +1,343 @@
+"""Structural differences between two trees of UI elements.
+
+Compares two recorded trees - binary snapshots (see dogtail.snapshot), or
+plain or JSON-lines dumps (see dogtail.dump) - and reports the nodes that were
+added or removed, and the properties that changed on the others:
+
+    from dogtail import diff
+    print(diff.diff('/tmp/good.snapshot', '/tmp/failed.snapshot'))
+
+Nodes are matched top-down, among the children of matched parents: first by
+role and name, the n-th of several alike siblings with the n-th one; then
+the remaining ones by name alone (the role changed), and finally by role in
+document order (the name changed). Siblings being reordered is therefore not
+reported as a difference. Each node is looked at once, so large trees are
+compared in linear time.
+"""
+
+import json
+from collections import deque
+from __builtin__ import file, unicode
+
+import snapshot
+
+"""
+The properties compared on matched nodes, when both trees recorded them.
+"""
+comparedProperties = ('roleName', 'name', 'description', 'states', 'extents',
+                      'actions', 'text')
+
+_plainProperties = ('description', 'states', 'extents', 'text')
+
+
+class DumpNode(object):
+
+    """
+    A node read back from a plain or JSON-lines dump. Its properties are the
+    ones the dump recorded.
+    """
+
+    def __init__(self, properties, parent=None):
+        self.properties = properties
+        self.roleName = properties.get('roleName')
+        self.name = properties.get('name')
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+    def __str__(self):
+        return '[%s | %s]' % (self.roleName, self.name)
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _parsePlainProperty(name, value):
+    if name == 'states':
+        return frozenset(value and value.split(', ') or ())
+    if name == 'extents':
+        if value == 'None':
+            return None
+        return tuple([int(v) for v in value.split(', ')])
+    if value == 'None':
+        return None
+    return value
+
+
+def _loadPlain(lines):
+    root = None
+    ancestors = []
+    for line in lines:
+        line = line.rstrip('\n')
+        stripped = line.lstrip(' ')
+        if not (stripped.startswith('[') and stripped.endswith(']')):
+            continue
+        depth = len(line) - len(stripped)
+        fields = stripped[1:-1].split(' | ')
+        if fields[0] == 'action' and depth > 0 and len(ancestors) >= depth:
+            actions = ancestors[depth - 1].properties.setdefault('actions', {})
+            actions[fields[1]] = ' | '.join(fields[2:]).strip()
+            continue
+        properties = {'roleName': fields[0]}
+        while len(fields) > 2:
+            name, separator, value = fields[-1].partition(': ')
+            if not separator or name not in _plainProperties:
+                break
+            properties[name] = _parsePlainProperty(name, value)
+            fields.pop()
+        properties['name'] = ' | '.join(fields[1:])
+        del ancestors[depth:]
+        node = DumpNode(properties, ancestors and ancestors[-1] or None)
+        if root is None:
+            root = node
+        ancestors.append(node)
+    return root
+
+
+def _loadJsonLines(lines):
+    root = None
+    ancestors = []
+    for line in lines:
+        if not line.strip():
+            continue
+        values = json.loads(line)
+        depth = values.pop('depth')
+        properties = {}
+        for name, value in values.items():
+            name = _utf8(name)
+            if name == 'actions' and value is not None:
+                value = dict((_utf8(action['name']),
+                              _utf8(action['keyBinding']))
+                             for action in value)
+            elif name == 'states' and value is not None:
+                value = frozenset([_utf8(state) for state in value])
+            elif name == 'extents' and value is not None:
+                value = tuple(value)
+            properties[name] = _utf8(value)
+        del ancestors[depth:]
+        node = DumpNode(properties, ancestors and ancestors[-1] or None)
+        if root is None:
+            root = node
+        ancestors.append(node)
+    return root
+
+
+def load(fileName):
+    """
+    Loads a recorded tree, returning its root: a snapshot.SnapshotNode for a
+    binary snapshot, or a DumpNode for a plain or JSON-lines dump; None if
+    the tree is empty.
+    """
+    treeFile = file(fileName, 'rb')
+    try:
+        start = treeFile.read(len(snapshot.MAGIC))
+        if start == snapshot.MAGIC:
+            return snapshot.Snapshot(fileName).root
+        treeFile.seek(0)
+        if start.lstrip().startswith('{'):
+            return _loadJsonLines(treeFile)
+        return _loadPlain(treeFile)
+    finally:
+        treeFile.close()
+
+
+def _snapshotProperties(node):
+    # Straight from the record: the action lists and state sets are shared
+    # between nodes, and decoded once.
+    snapshot = node.snapshot
+    record = node._recordData
+    return {'roleName': snapshot._string(record[1]),
+            'name': snapshot._string(record[2]),
+            'description': snapshot._string(record[3]),
+            'states': snapshot._stateSet(record[13]),
+            'extents': node.extents,
+            'actions': dict(snapshot._actionList(record[12]))}
+
+
+def _properties(node):
+    if isinstance(node, DumpNode):
+        return node.properties
+    if isinstance(node, snapshot.SnapshotNode):
+        return _snapshotProperties(node)
+    properties = {}
+    for name in comparedProperties:
+        try:
+            properties[name] = getattr(node, name)
+        except AttributeError:
+            pass
+    return properties
+
+
+def _path(node):
+    path = []
+    while node is not None:
+        path.append(str(node))
+        node = node.parent
+    path.reverse()
+    return '/'.join(path)
+
+
+def _size(node):
+    size = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        size += 1
+        stack.extend(node.children)
+    return size
+
+
+class Difference(object):
+
+    """
+    A difference between the trees: a node 'added' or 'removed' (with its
+    subtree of 'size' nodes), or a property of a matched node 'changed'
+    from oldValue to newValue.
+    """
+
+    def __init__(self, kind, node, property=None, oldValue=None,
+                 newValue=None, size=1):
+        self.kind = kind
+        self.node = node
+        self.property = property
+        self.oldValue = oldValue
+        self.newValue = newValue
+        self.size = size
+
+    @property
+    def path(self):
+        """
+        The path to the node, from the root, in the tree it belongs to.
+        """
+        return _path(self.node)
+
+    def __str__(self):
+        if self.kind == 'changed':
+            return '~ %s: %s %r -> %r' % (self.path, self.property,
+                                          self.oldValue, self.newValue)
+        sign = self.kind == 'added' and '+' or '-'
+        if self.size > 1:
+            return '%s %s (and %i descendants)' % (sign, self.path,
+                                                   self.size - 1)
+        return '%s %s' % (sign, self.path)
+
+
+def _matchChildren(oldChildren, newChildren):
+    """
+    Pairs the children, returning (pairs, removed, added), with the pairs
+    in the order of the old children.
+    """
+    def keyedMatch(oldChildren, newChildren, key):
+        candidates = {}
+        for child in newChildren:
+            candidates.setdefault(key(child), deque()).append(child)
+        pairs = []
+        unmatched = []
+        for child in oldChildren:
+            queue = candidates.get(key(child))
+            if queue:
+                pairs.append((child, queue.popleft()))
+            else:
+                unmatched.append(child)
+        matched = set(id(new) for old, new in pairs)
+        return pairs, unmatched, [child for child in newChildren
+                                  if id(child) not in matched]
+
+    children = oldChildren
+    pairs = []
+    for key in (lambda node: (node.roleName, node.name),
+                lambda node: node.name,
+                lambda node: node.roleName):
+        if not (oldChildren and newChildren):
+            break
+        keyPairs, oldChildren, newChildren = keyedMatch(
+            oldChildren, newChildren, key)
+        pairs.extend(keyPairs)
+    if len(pairs) > 1:
+        order = dict((id(child), index) for index, child in enumerate(children))
+        pairs.sort(key=lambda pair: order[id(pair[0])])
+    return pairs, oldChildren, newChildren
+
+
+class TreeDiff(object):
+
+    """
+    The differences between an old and a new tree, given by their roots
+    (nodes of snapshots or dumps), as a list of Difference instances. A
+    root of None stands for an empty tree, such as an empty dump.
+    """
+
+    def __init__(self, oldRoot, newRoot):
+        self.oldRoot = oldRoot
+        self.newRoot = newRoot
+        self.differences = []
+        self.matched = 0
+        if oldRoot is None or newRoot is None:
+            if oldRoot is not None:
+                self.differences.append(
+                    Difference('removed', oldRoot, size=_size(oldRoot)))
+            if newRoot is not None:
+                self.differences.append(
+                    Difference('added', newRoot, size=_size(newRoot)))
+            return
+        stack = [(oldRoot, newRoot)]
+        while stack:
+            old, new = stack.pop()
+            self.matched += 1
+            self._compare(old, new)
+            pairs, removed, added = _matchChildren(list(old.children),
+                                                   list(new.children))
+            for node in removed:
+                self.differences.append(
+                    Difference('removed', node, size=_size(node)))
+            for node in added:
+                self.differences.append(
+                    Difference('added', node, size=_size(node)))
+            pairs.reverse()
+            stack.extend(pairs)
+
+    def _compare(self, old, new):
+        oldProperties = _properties(old)
+        newProperties = _properties(new)
+        for name in comparedProperties:
+            if name in oldProperties and name in newProperties and \
+                    oldProperties[name] != newProperties[name]:
+                self.differences.append(Difference(
+                    'changed', new, name, oldProperties[name],
+                    newProperties[name]))
+
+    def __iter__(self):
+        return iter(self.differences)
+
+    def __len__(self):
+        return len(self.differences)
+
+    def __nonzero__(self):
+        return bool(self.differences)
+
+    def byKind(self, kind):
+        """
+        The differences of the given kind: 'added', 'removed' or 'changed'.
+        """
+        return [d for d in self.differences if d.kind == kind]
+
+    def __str__(self):
+        if not self.differences:
+            return "No differences (%i nodes matched)" % self.matched
+        return '\n'.join([str(d) for d in self.differences])
+
+
+def diff(old, new):
+    """
+    Compares two trees, each given as a file name (see load()) or as a root
+    node, and returns a TreeDiff.
+    """
+    if isinstance(old, basestring):
+        old = load(old)
+    if isinstance(new, basestring):
+        new = load(new)
+    return TreeDiff(old, new)
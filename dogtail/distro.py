@@ -39,11 +39,63 @@ class PackageDb(object):
     """
     Class to abstract the details of whatever software package database is in
     use (RPM, APT, etc)
+
+    The answers of getVersion(), getFiles(), getDependencies() and
+    getMoFiles() are cached per package (or locale), until the modification time of one of the databasePaths
+    changes (i.e. packages get installed or removed).
+    """
+
+    """
+    The files or directories whose modification time changes when the
+    package database does.
     """
+    databasePaths = []
 
     def __init__(self):
         self.prefix = '/usr'
         self.localePrefixes = [self.prefix + '/share/locale']
+        self._cache = {}
+        self._cacheMTime = None
+
+    def databaseMTime(self):
+        """
+        The latest modification time of the databasePaths, or None if there
+        are none.
+        """
+        mTimes = []
+        for path in self.databasePaths:
+            try:
+                mTimes.append(os.stat(path).st_mtime)
+            except OSError:
+                pass
+        return mTimes and max(mTimes) or None
+
+    def invalidate(self):
+        """
+        Forgets the cached answers and anything else kept from the package
+        database.
+        """
+        self._cache = {}
+
+    def _cached(self, query, packageName, function):
+        mTime = self.databaseMTime()
+        if mTime != self._cacheMTime:
+            self.invalidate()
+            self._cacheMTime = mTime
+        try:
+            result = self._cache[(query, packageName)]
+        except KeyError:
+            try:
+                result = function(packageName)
+            except PackageNotFoundError as error:
+                result = error
+            self._cache[(query, packageName)] = result
+        if isinstance(result, PackageNotFoundError):
+            raise result
+        # A copy, so that callers changing it do not change the cache
+        if isinstance(result, list):
+            return list(result)
+        return result
 
     def getVersion(self, packageName):
         """
@@ -52,13 +104,44 @@ class PackageDb(object):
 
         Note: does not know about distributions' internal revision numbers.
         """
-        raise NotImplementedError
+        return self._cached('version', packageName, self._getVersion)
 
     def getFiles(self, packageName):
         """
         Method to get a list of filenames owned by the package, or raise an
          exception if not found.
         """
+        return self._cached('files', packageName, self._getFiles)
+
+    def getVersions(self, packageNames):
+        """
+        Gets the versions of many packages in one call, as a dict mapping the
+        names of the installed ones to their Version; packages that are not
+        installed are left out.
+        """
+        return self._batch(self.getVersion, packageNames)
+
+    def getFileLists(self, packageNames):
+        """
+        Gets the files of many packages in one call, as a dict mapping the
+        names of the installed ones to their list of files; packages that
+        are not installed are left out.
+        """
+        return self._batch(self.getFiles, packageNames)
+
+    def _batch(self, method, packageNames):
+        result = {}
+        for packageName in packageNames:
+            try:
+                result[packageName] = method(packageName)
+            except PackageNotFoundError:
+                pass
+        return result
+
+    def _getVersion(self, packageName):
+        raise NotImplementedError
+
+    def _getFiles(self, packageName):
         raise NotImplementedError
 
     def getMoFiles(self, locale=None):
@@ -66,6 +149,9 @@ class PackageDb(object):
         Method to get a list of all .mo files on the system, optionally for a
         specific locale.
         """
+        return self._cached('moFiles', locale, self._getMoFiles)
+
+    def _getMoFiles(self, locale):
         moFiles = {}
 
         def appendIfMoFile(moFiles, dirName, fNames):
@@ -87,31 +173,51 @@ class PackageDb(object):
         is dependent on, or raise an exception if the package is not
         found.
         """
+        return self._cached('dependencies', packageName,
+                            self._getDependencies)
+
+    def _getDependencies(self, packageName):
         raise NotImplementedError
 
 
 class _RpmPackageDb(PackageDb):  # pragma: no cover
 
+    databasePaths = ['/var/lib/rpm', '/var/lib/rpm/Packages',
+                     '/var/lib/rpm/rpmdb.sqlite']
+
     def __init__(self):
         PackageDb.__init__(self)
+        self._transactionSet = None
 
-    def getVersion(self, packageName):
-        import rpm
-        ts = rpm.TransactionSet()
-        for header in ts.dbMatch("name", packageName):
+    def invalidate(self):
+        PackageDb.invalidate(self)
+        if self._transactionSet is not None:
+            self._transactionSet.closeDB()
+            self._transactionSet = None
+
+    @property
+    def transactionSet(self):
+        """
+        The rpm.TransactionSet used for all the queries of the process.
+        """
+        if self._transactionSet is None:
+            import rpm
+            self._transactionSet = rpm.TransactionSet()
+        return self._transactionSet
+
+    def _getVersion(self, packageName):
+        for header in self.transactionSet.dbMatch("name", packageName):
             return Version.fromString(header["version"])
         raise PackageNotFoundError(packageName)
 
-    def getFiles(self, packageName):
-        import rpm
-        ts = rpm.TransactionSet()
-        for header in ts.dbMatch("name", packageName):
+    def _getFiles(self, packageName):
+        for header in self.transactionSet.dbMatch("name", packageName):
             return header["filenames"]
         raise PackageNotFoundError(packageName)
 
-    def getDependencies(self, packageName):
+    def _getDependencies(self, packageName):
         import rpm
-        ts = rpm.TransactionSet()
+        ts = self.transactionSet
         for header in ts.dbMatch("name", packageName):
             # Simulate a set using a hash (to a dummy value);
             # sets were only added in Python 2.4
@@ -135,26 +241,56 @@ class _RpmPackageDb(PackageDb):  # pragma: no cover
 
 class _AptPackageDb(PackageDb):
 
+    databasePaths = ['/var/lib/dpkg/status']
+    infoDir = '/var/lib/dpkg/info'
+
     def __init__(self):
         PackageDb.__init__(self)
         self.cache = None
+        self._packagesByName = None
 
-    def getVersion(self, packageName):
+    def invalidate(self):
+        PackageDb.invalidate(self)
+        self.cache = None
+        self._packagesByName = None
+
+    def _getPackages(self, packageName):
+        """
+        The apt_pkg packages with the given name, from an index built once
+        per cache.
+        """
         if not self.cache:
             import apt_pkg
             apt_pkg.init()
             self.cache = apt_pkg.GetCache()
-        packages = self.cache.Packages
-        for package in packages:
-            if package.Name == packageName:
-                verString = re.match(
-                    '.*Ver:\'(.*)-.*\' Section:', str(package.CurrentVer)).group(1)
-                return Version.fromString(verString)
+        if self._packagesByName is None:
+            self._packagesByName = {}
+            for package in self.cache.Packages:
+                self._packagesByName.setdefault(
+                    package.Name, []).append(package)
+        return self._packagesByName.get(packageName, [])
+
+    def _getVersion(self, packageName):
+        for package in self._getPackages(packageName):
+            verString = re.match(
+                '.*Ver:\'(.*)-.*\' Section:', str(package.CurrentVer)).group(1)
+            return Version.fromString(verString)
         raise PackageNotFoundError(packageName)
 
-    def getFiles(self, packageName):
+    def _getFiles(self, packageName):
+        # dpkg keeps the files of each package in a .list file, possibly
+        # qualified with the architecture; reading it saves running dpkg.
+        import glob
+        listFiles = glob.glob(os.path.join(self.infoDir, packageName + '.list')) \
+            or glob.glob(os.path.join(self.infoDir, packageName + ':*.list'))
+        if listFiles:
+            list = []
+            for listFile in listFiles:
+                with open(listFile) as lines:
+                    list.extend(lines.readlines())
+        else:
+            list = os.popen('dpkg -L %s' % packageName).readlines()
         files = []
-        list = os.popen('dpkg -L %s' % packageName).readlines()
         if not list:
             raise PackageNotFoundError(packageName)
         else:
@@ -164,26 +300,20 @@ class _AptPackageDb(PackageDb):
                     files.append(file)
             return files
 
-    def getDependencies(self, packageName):
+    def _getDependencies(self, packageName):
         # Simulate a set using a hash (to a dummy value);
         # sets were only added in Python 2.4
         result = {}
-        if not self.cache:
-            import apt_pkg
-            apt_pkg.init()
-            self.cache = apt_pkg.GetCache()
-        packages = self.cache.Packages
-        for package in packages:
-            if package.Name == packageName:
-                current = package.CurrentVer
-                if not current:
-                    raise PackageNotFoundError(packageName)
-                depends = current.DependsList
-                list = depends['Depends']
-                for dependency in list:
-                    name = dependency[0].TargetPkg.Name
-                    # Add to the hash using a dummy value
-                    result[name] = None
+        for package in self._getPackages(packageName):
+            current = package.CurrentVer
+            if not current:
+                raise PackageNotFoundError(packageName)
+            depends = current.DependsList
+            list = depends['Depends']
+            for dependency in list:
+                name = dependency[0].TargetPkg.Name
+                # Add to the hash using a dummy value
+                result[name] = None
         return result.keys()
 
 
@@ -199,7 +329,7 @@ class _PortagePackageDb(PackageDb):  # pragma: no cover
     def __init__(self):
         PackageDb.__init__(self)
 
-    def getVersion(self, packageName):
+    def _getVersion(self, packageName):
         # the portage utilities are almost always going to be in
         # /usr/lib/portage/pym
         import sys
@@ -222,7 +352,7 @@ class _ConaryPackageDb(PackageDb):  # pragma: no cover
     def __init__(self):
         PackageDb.__init__(self)
 
-    def getVersion(self, packageName):
+    def _getVersion(self, packageName):
         from conaryclient import ConaryClient
         client = ConaryClient()
         dbVersions = client.db.getTroveVersionList(packageName)
@@ -252,7 +382,7 @@ class JhBuildPackageDb(PackageDb):  # pragma: no cover
         self.prefix = os.path.commonprefix(prefixes)
         self.localePrefixes.append(self.prefix + '/share/locale')
 
-    def getDependencies(self, packageName):
+    def _getDependencies(self, packageName):
         result = {}
         lines = os.popen('jhbuild list ' + packageName).readlines()
         for line in lines:
@@ -358,5 +488,27 @@ def detectDistro():
     logger.log(distro.__class__.__name__)
     return distro
 
-distro = detectDistro()
-packageDb = distro.packageDb
+distro = None
+
+
+def getDistro():
+    """
+    The Distro in use, detected on the first call.
+    """
+    global distro
+    if distro is None:
+        distro = detectDistro()
+    return distro
+
+
+class _LazyPackageDb(object):
+
+    """
+    Stands for the PackageDb of the distribution, which is only detected once
+    the package database is first used.
+    """
+
+    def __getattr__(self, name):
+        return getattr(getDistro().packageDb, name)
+
+packageDb = _LazyPackageDb()
@@ -1,33 +1,462 @@
 """Utility functions for 'dumping' trees of Node objects.
 
+The tree is walked iteratively, so deep trees do not hit the recursion limit,
+and written as it is walked through a buffered file. Only the requested
+properties are fetched from each node.
+
+All the dumpers take the same arguments:
+
+node: the root of the tree to dump.
+
+fileName: the file to write to, or an open file; the dump goes to standard
+output if it is None.
+
+maxDepth: how many levels below node to dump; None dumps the whole tree.
+
+roleNames: dump only the nodes with one of these role names; all the nodes
+are still walked.
+
+properties: the properties to dump, among the keys of 'fetchers'. The
+default is 'defaultProperties'.
+
 Author: Zack Cerza <zcerza@redhat.com>"""
 __author__ = "Zack Cerza <zcerza@redhat.com>"
 
-from __builtin__ import file
+import sys
+import json
+import time
+from StringIO import StringIO
+from xml.sax.saxutils import quoteattr
+from backend import pyatspi
+from config import config
+from logging import debugLogger as logger
+from __builtin__ import file, unicode
 
 spacer = ' '
 
+"""
+Size of the buffer used when writing a dump to a file.
+"""
+bufferSize = 64 * 1024
+
+"""
+The properties dumped when none are requested.
+"""
+defaultProperties = ('roleName', 'name', 'actions')
+
 
-def plain(node, fileName=None):
+_stateNames = {}
+
+
+def stateName(state):
+    """
+    The name of an AT-SPI state, e.g. 'multi line'.
+    """
+    try:
+        return _stateNames[state]
+    except KeyError:
+        name = _stateNames[state] = \
+            pyatspi.stateToString(state).lower().replace('_', ' ')
+        return name
+
+
+def _fetchActions(node):
+    try:
+        action = node.queryAction()
+    except NotImplementedError:
+        return []
+    actions = {}
+    for i in range(action.nActions):
+        actions[action.getName(i)] = action.getKeyBinding(i)
+    return actions.items()
+
+
+def _fetchStates(node):
+    return sorted(stateName(state) for state in node.getState().getStates())
+
+
+def _fetchExtents(node):
+    try:
+        extents = node.queryComponent().getExtents(pyatspi.DESKTOP_COORDS)
+    except NotImplementedError:
+        return None
+    return (extents.x, extents.y, extents.width, extents.height)
+
+
+def _fetchText(node):
+    try:
+        return node.queryText().getText(0, -1)
+    except NotImplementedError:
+        return None
+
+"""
+Functions fetching each of the properties that can be dumped from a node.
+'actions' is a list of (name, key binding) pairs.
+"""
+fetchers = {
+    'roleName': lambda node: node.getRoleName(),
+    'name': lambda node: node.name,
+    'description': lambda node: node.description,
+    'actions': _fetchActions,
+    'states': _fetchStates,
+    'extents': _fetchExtents,
+    'text': _fetchText,
+}
+
+
+class DumpTimeout(Exception):
+
+    """
+    Raised by walk() when it runs past its deadline.
+    """
+    pass
+
+
+def walk(node, maxDepth=None, roleNames=None, properties=defaultProperties,
+         depth=0, deadline=None):
+    """
+    Walks the tree below node depth-first and in document order, without
+    recursion, yielding (depth, properties) for every node, where properties
+    is a dict of the requested properties. node is at the given depth.
+
+    The anchors of the links in the text of a node follow its children, as
+    in Node.children, unless config.includeLinkAnchors is False.
+
+    If deadline (as returned by time.time()) is given, DumpTimeout is raised
+    once it has passed.
+    """
+    if roleNames is not None:
+        roleNames = set(roleNames)
+    properties = list(properties)
+    if roleNames is not None and 'roleName' not in properties:
+        properties.append('roleName')
+    unknown = [name for name in properties if name not in fetchers]
+    if unknown:
+        raise ValueError("Unknown properties: %s" % ', '.join(unknown))
+    fetch = [(name, fetchers[name]) for name in properties]
+    from tree import _readLinkAnchors
+
+    stack = [(node, depth)]
+    while stack:
+        if deadline is not None and time.time() > deadline:
+            raise DumpTimeout()
+        node, depth = stack.pop()
+        values = {}
+        for name, fetcher in fetch:
+            try:
+                values[name] = fetcher(node)
+            except Exception:
+                values[name] = None
+        if roleNames is None or values['roleName'] in roleNames:
+            yield depth, values
+        if maxDepth is not None and depth >= maxDepth:
+            continue
+        try:
+            childCount = node.childCount
+        except Exception:
+            continue
+        children = []
+        for index in range(childCount):
+            try:
+                child = node[index]
+            except Exception:
+                continue
+            if child is not None:
+                children.append((child, depth + 1))
+        children.extend((anchor, depth + 1)
+                        for anchor in _readLinkAnchors(node))
+        children.reverse()
+        stack.extend(children)
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class _Output(object):
+
+    """
+    Opens fileName for buffered writing, or uses the given open file or
+    standard output; only a file opened here is closed.
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.opened = False
+
+    def __enter__(self):
+        if self.fileName is None:
+            return sys.stdout
+        if isinstance(self.fileName, basestring):
+            self.opened = True
+            self.file = file(self.fileName, 'w', bufferSize)
+            return self.file
+        return self.fileName
+
+    def __exit__(self, *exc):
+        if self.opened:
+            self.file.close()
+        else:
+            (self.fileName or sys.stdout).flush()
+
+
+def _plainProperties(properties):
+    return ['roleName', 'name'] + \
+        [name for name in properties if name not in ('roleName', 'name')]
+
+
+def _writePlain(write, items, properties):
+    for depth, values in items:
+        indent = spacer * depth
+        fields = [values['roleName'], values['name']]
+        for name in properties:
+            if name not in ('roleName', 'name', 'actions'):
+                value = values[name]
+                if isinstance(value, (list, tuple)):
+                    value = ', '.join([str(v) for v in value])
+                fields.append('%s: %s' % (name, _encode(value)))
+        write('%s[%s]\n' % (indent, ' | '.join(
+            [str(_encode(field)) for field in fields])))
+        for actionName, keyBinding in values.get('actions') or ():
+            write('%s[action | %s | %s ]\n' %
+                  (indent + spacer, _encode(actionName),
+                   _encode(keyBinding)))
+
+
+def _writeJsonLines(write, items, properties):
+    for depth, values in items:
+        if values.get('actions') is not None:
+            values['actions'] = [{'name': name, 'keyBinding': keyBinding}
+                                 for name, keyBinding in values['actions']]
+        values['depth'] = depth
+        write(json.dumps(values, sort_keys=True) + '\n')
+
+
+def _xmlAttribute(name, value):
+    if isinstance(value, (list, tuple)):
+        value = ' '.join([str(v) for v in value])
+    elif not isinstance(value, basestring):
+        value = str(value)
+    return ' %s=%s' % (name, _encode(quoteattr(value)))
+
+
+def _xmlAttributes(values, properties):
+    return ''.join([_xmlAttribute(name, values[name]) for name in properties
+                    if name != 'actions' and values[name] is not None])
+
+
+def _writeXml(write, items, properties, level=1):
+    """
+    Writes the nodes as nested elements, the outermost ones indented by
+    level; all the elements opened are closed.
+    """
+    openDepths = []
+    try:
+        for depth, values in items:
+            while openDepths and openDepths[-1] >= depth:
+                write(spacer * (len(openDepths) + level - 1) + '</node>\n')
+                openDepths.pop()
+            indent = spacer * (len(openDepths) + level)
+            write('%s<node%s>\n' % (indent, _xmlAttributes(values,
+                                                            properties)))
+            for actionName, keyBinding in values.get('actions') or ():
+                write('%s<action%s%s/>\n' %
+                      (indent + spacer, _xmlAttribute('name', actionName),
+                       _xmlAttribute('keyBinding', keyBinding)))
+            openDepths.append(depth)
+    finally:
+        # Keeps the output well-formed when the walk is interrupted
+        while openDepths:
+            write(spacer * (len(openDepths) + level - 1) + '</node>\n')
+            openDepths.pop()
+
+_xmlHeader = '<?xml version="1.0" encoding="UTF-8"?>\n<dump>\n'
+_xmlFooter = '</dump>\n'
+
+
+def plain(node, fileName=None, maxDepth=None, roleNames=None,
+          properties=defaultProperties):
     """
     Plain-text dump. The hierarchy is represented through indentation.
+
+    Each node is written as [role name | name], followed by any other
+    requested property as | property: value; its actions are written below
+    it as [action | name | key binding ].
+    """
+    properties = _plainProperties(properties)
+    with _Output(fileName) as output:
+        _writePlain(output.write,
+                    walk(node, maxDepth, roleNames, properties), properties)
+
+
+def jsonLines(node, fileName=None, maxDepth=None, roleNames=None,
+              properties=defaultProperties):
+    """
+    JSON-lines dump: one JSON object per line and node, holding its depth
+    and the requested properties.
+    """
+    with _Output(fileName) as output:
+        _writeJsonLines(output.write,
+                        walk(node, maxDepth, roleNames, properties),
+                        properties)
+
+
+def xml(node, fileName=None, maxDepth=None, roleNames=None,
+        properties=defaultProperties):
+    """
+    XML dump: a <node> element per node, with the requested properties as
+    attributes and its actions and children as nested elements. When
+    roleNames is given, nodes are nested in their closest dumped ancestor.
     """
-    def crawl(node, depth):
-        dump(node, depth)
-        for action in node.actions.values():
-            dump(action, depth + 1)
-        for child in node.children:
-            crawl(child, depth + 1)
-
-    def dumpFile(item, depth):
-        _file.write(spacer * depth + str(item) + '\n')
-
-    def dumpStdOut(item, depth):
-        print(spacer * depth + str(item))
-    if fileName:
-        dump = dumpFile
-        _file = file(fileName, 'w')
-    else:
-        dump = dumpStdOut
-
-    crawl(node, 0)
+    with _Output(fileName) as output:
+        output.write(_xmlHeader)
+        _writeXml(output.write, walk(node, maxDepth, roleNames, properties),
+                  properties)
+        output.write(_xmlFooter)
+
+
+def _applicationName(application):
+    try:
+        return application.name
+    except Exception:
+        return str(application)
+
+
+def eachApplication(root, function, appTimeout, activity='Dumping'):
+    """
+    Calls function(application, deadline) for each application of the
+    desktop root, concurrently on the thread pool shared by the concurrent
+    reads of dogtail.tree, deadline being appTimeout seconds from now.
+    function returns its result and whether it ran out of time.
+
+    Returns the (application, result) pairs in order, with a result of None
+    for the applications that did not answer in time, and the names of the
+    applications that ran out of time, which are logged.
+    """
+    from tree import _submit
+    deadline = time.time() + appTimeout
+    calls = []
+    for index in range(root.childCount):
+        application = root[index]
+        if application is not None:
+            calls.append((application,
+                          _submit(function, application, deadline)))
+    results = []
+    timedOut = []
+    for application, call in calls:
+        # Hanging applications get a second's grace to be left out without
+        # losing what the rest of them answered.
+        call.wait(max(0, deadline + 1 - time.time()))
+        result = None
+        late = True
+        if call.ready():
+            result, late = call.get()
+        if late:
+            name = _applicationName(application)
+            logger.log("%s %s ran out of its %s seconds" %
+                       (activity, name, appTimeout))
+            timedOut.append(name)
+        results.append((application, result))
+    return results, timedOut
+
+
+def desktop(type='plain', fileName=None, maxDepth=None, roleNames=None,
+            properties=defaultProperties, appTimeout=None, root=None):
+    """
+    Dumps the whole desktop (root, by default dogtail.tree.root) like the
+    dumper of the given type, but with each application dumped concurrently
+    in its own thread, as applications answer independently of each other.
+    The output of the applications is then merged, in order.
+
+    Each application gets appTimeout seconds, config.dumpTimeout by default.
+    The part of a slower application dumped so far is kept; one that does
+    not answer at all is left out. The names of the applications that ran
+    out of time are returned.
+
+    A 'snapshot' is written by snapshot.write(), which reads the
+    applications the same way; it needs a file name.
+    """
+    if root is None:
+        from tree import root
+    if appTimeout is None:
+        appTimeout = config.dumpTimeout
+    if type == 'snapshot':
+        if fileName is None or not isinstance(fileName, basestring):
+            raise ValueError("A snapshot is written to a file name")
+        import snapshot
+        return snapshot.write(root, fileName, maxDepth=maxDepth,
+                              appTimeout=appTimeout)
+    if type == 'plain':
+        properties = _plainProperties(properties)
+    options = {'maxDepth': maxDepth, 'roleNames': roleNames}
+
+    def writeApplication(output, items):
+        if type == 'plain':
+            _writePlain(output.write, items, properties)
+        elif type == 'json':
+            _writeJsonLines(output.write, items, properties)
+        else:
+            _writeXml(output.write, items, properties, level=level + 1)
+
+    if type not in dumpers:
+        raise ValueError("Unknown dump type: %s" % type)
+    rootItems = list(walk(root, maxDepth=0, roleNames=roleNames,
+                          properties=properties))
+    level = rootItems and 1 or 0
+
+    def dumpApplication(application, deadline):
+        output = StringIO()
+        try:
+            writeApplication(output, walk(application, depth=1,
+                                          deadline=deadline,
+                                          properties=properties, **options))
+        except DumpTimeout:
+            return output.getvalue(), True
+        return output.getvalue(), False
+
+    applications = []
+    timedOut = []
+    if maxDepth is None or maxDepth > 0:
+        applications, timedOut = eachApplication(root, dumpApplication,
+                                                 appTimeout)
+
+    with _Output(fileName) as output:
+        write = output.write
+        if type == 'plain':
+            _writePlain(write, rootItems, properties)
+        elif type == 'json':
+            _writeJsonLines(write, rootItems, properties)
+        else:
+            write(_xmlHeader)
+            for depth, values in rootItems:
+                write('%s<node%s>\n' % (spacer, _xmlAttributes(values,
+                                                                properties)))
+        for application, result in applications:
+            if result is not None:
+                write(result)
+        if type == 'xml':
+            if rootItems:
+                write(spacer + '</node>\n')
+            write(_xmlFooter)
+    return timedOut
+
+
+def snapshot(node, fileName, maxDepth=None, roleNames=None, properties=None):
+    """
+    Binary snapshot, see dogtail.snapshot. It records a fixed set of
+    properties of all the nodes, so roleNames and properties are ignored.
+    """
+    import snapshot
+    snapshot.write(node, fileName, maxDepth=maxDepth)
+
+"""
+The dumpers by the type names Node.dump() accepts.
+"""
+dumpers = {
+    'plain': plain,
+    'json': jsonLines,
+    'xml': xml,
+    'snapshot': snapshot,
+}
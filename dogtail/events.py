@@ -0,0 +1,143 @@
+"""Waiting for applications to tell that something happened.
+
+Rather than polling a node in a loop with sleeps, the waits of
+Node.waitFor(), waitForName(), waitForText() and waitUntilGone() (and the
+startup detection of dogtail.utils.run()) sleep until an event that may
+fulfil them comes, then check again:
+
+    dialog.button('OK').waitFor('sensitive', timeout=10)
+
+All the waits in progress share one listener per event type, registered
+while some wait needs it. In case an application does not emit the events
+it should, the conditions are also checked again every config.waitInterval
+seconds.
+"""
+
+import threading
+from time import time
+
+from backend import pyatspi
+from config import config
+
+_lock = threading.Lock()
+
+"""
+The shortest interval in seconds between two checks of a condition, so that
+a wait never spins.
+"""
+minimumInterval = 0.01
+
+"""
+The waits in progress.
+"""
+waiters = []
+
+# The number of waits listening to each event type
+_listened = {}
+
+
+def _onEvent(event):
+    for waiter in list(waiters):
+        if waiter.wants(event):
+            waiter.wake.set()
+
+
+class _Waiter(object):
+
+    def __init__(self, eventTypes, sources, accept):
+        self.eventTypes = eventTypes
+        self.sources = sources
+        self.accept = accept
+        self.wake = threading.Event()
+
+    def wants(self, event):
+        if self.sources is not None and event.source not in self.sources:
+            return False
+        for eventType in self.eventTypes:
+            if event.type == eventType or \
+                    event.type.startswith(eventType + ':'):
+                return self.accept is None or _holds(
+                    lambda: self.accept(event))
+        return False
+
+
+def _register(waiter):
+    with _lock:
+        waiters.append(waiter)
+        for eventType in waiter.eventTypes:
+            if not _listened.get(eventType):
+                pyatspi.Registry.registerEventListener(_onEvent, eventType)
+            _listened[eventType] = _listened.get(eventType, 0) + 1
+
+
+def _deregister(waiter):
+    with _lock:
+        waiters.remove(waiter)
+        for eventType in waiter.eventTypes:
+            _listened[eventType] -= 1
+            if not _listened[eventType]:
+                pyatspi.Registry.deregisterEventListener(_onEvent, eventType)
+
+
+def _sleep(wake, seconds):
+    """
+    Sleeps until wake is set or for the given number of seconds, letting
+    the events come meanwhile.
+    """
+    # The fake delivers its events right away, from the thread changing
+    # the tree; pyatspi queues them in the main loop, run here.
+    if config.backend == 'fake':
+        wake.wait(seconds)
+        return
+    from gi.repository import GLib
+    context = GLib.MainContext.default()
+    timedOut = []
+    source = GLib.timeout_add(max(1, int(seconds * 1000)),
+                              lambda: timedOut.append(True))
+    while not wake.isSet() and not timedOut:
+        context.iteration(True)
+    if not timedOut:
+        GLib.source_remove(source)
+
+
+def _holds(condition):
+    try:
+        return bool(condition())
+    except Exception:
+        return False
+
+
+def waitUntil(condition, eventTypes, sources=None, timeout=None,
+              interval=None, accept=None):
+    """
+    Waits until condition() (a function taking no arguments) is true,
+    checking it again each time an event of one of the given types comes
+    from one of the given sources (from any node if sources is None) and is
+    accepted by accept (a function taking the event, if given), and
+    every interval seconds (config.waitInterval by default, and at least
+    minimumInterval). Returns whether it became true within timeout seconds
+    (config.waitTimeout by default).
+    """
+    if timeout is None:
+        timeout = config.waitTimeout
+    if interval is None:
+        interval = config.waitInterval
+    interval = max(interval, minimumInterval)
+    if _holds(condition):
+        return True
+    if sources is not None:
+        sources = set(sources)
+    waiter = _Waiter(tuple(eventTypes), sources, accept)
+    _register(waiter)
+    try:
+        deadline = time() + timeout
+        while True:
+            waiter.wake.clear()
+            if _holds(condition):
+                return True
+            remaining = deadline - time()
+            if remaining <= 0:
+                return False
+            _sleep(waiter.wake, min(remaining, interval))
+    finally:
+        _deregister(waiter)
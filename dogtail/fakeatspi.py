@@ -0,0 +1,1032 @@
+# -*- coding: utf-8 -*-
+"""
+An in-process fake of the AT-SPI bindings (pyatspi)
+
+This module implements the subset of the pyatspi API that dogtail uses - the
+Accessible object, its Action, Component, Text, EditableText, Selection,
+Table, Hypertext and Value interfaces, state and relation sets and the
+Registry - on top of plain Python objects. It needs neither an accessibility
+bus nor a running session, so dogtail.tree, dogtail.predicate,
+dogtail.procedural and dogtail.dump can be exercised and benchmarked on a
+headless machine.
+
+Select it before dogtail.tree is first imported, either by exporting
+DOGTAIL_BACKEND=fake or with:
+
+    from dogtail.config import config
+    config.backend = 'fake'
+
+and then populate the desktop, from nested dicts or from a saved plain dump:
+
+    from dogtail import fakeatspi
+    fakeatspi.addApplication(fakeatspi.buildTree(
+        {'name': 'gedit', 'roleName': 'application', 'children': [
+            {'name': 'Untitled', 'roleName': 'frame', 'children': [
+                {'name': 'Save', 'roleName': 'push button',
+                 'actions': ['click']}]}]}))
+    fakeatspi.addApplication(fakeatspi.loadDump('/tmp/gedit.dump'))
+
+Every call that would be a round trip to the application on a real desktop
+is counted in 'callCount' and can be slowed down by a configurable per-call
+latency (see setLatency()), so that benchmarks reflect the number of remote
+calls made.
+"""
+
+import threading
+import time
+
+
+class GError(Exception):
+
+    """
+    Raised when calling into a defunct accessible, like GLib.GError is by the
+    real bindings.
+    """
+    pass
+
+
+def _makeConstants(prefix, names):
+    """
+    Defines a module-level constant (e.g. STATE_SHOWING) for each of the
+    names, returning a dict mapping the names to the constants.
+    """
+    constants = {}
+    for value, name in enumerate(names):
+        globals()[prefix + name.upper().replace(' ', '_')] = value
+        constants[name] = value
+    return constants
+
+_roleNames = (
+    'invalid', 'accelerator label', 'alert', 'animation', 'arrow', 'calendar',
+    'canvas', 'check box', 'check menu item', 'color chooser',
+    'column header', 'combo box', 'date editor', 'desktop icon',
+    'desktop frame', 'dial', 'dialog', 'directory pane', 'drawing area',
+    'file chooser', 'filler', 'focus traversable', 'font chooser', 'frame',
+    'glass pane', 'html container', 'icon', 'image', 'internal frame',
+    'label', 'layered pane', 'list', 'list item', 'menu', 'menu bar',
+    'menu item', 'option pane', 'page tab', 'page tab list', 'panel',
+    'password text', 'popup menu', 'progress bar', 'push button',
+    'radio button', 'radio menu item', 'root pane', 'row header',
+    'scroll bar', 'scroll pane', 'separator', 'slider', 'spin button',
+    'split pane', 'status bar', 'table', 'table cell', 'table column header',
+    'table row header', 'tearoff menu item', 'terminal', 'text',
+    'toggle button', 'tool bar', 'tool tip', 'tree', 'tree table', 'unknown',
+    'viewport', 'window', 'extended', 'header', 'footer', 'paragraph',
+    'ruler', 'application', 'autocomplete', 'editbar', 'embedded', 'entry',
+    'chart', 'caption', 'document frame', 'heading', 'page', 'section',
+    'redundant object', 'form', 'link', 'input method window', 'table row',
+    'tree item', 'document spreadsheet', 'document presentation',
+    'document text', 'document web', 'document email', 'comment', 'list box',
+    'grouping', 'image map', 'notification', 'info bar', 'level bar',
+    'title bar', 'block quote', 'audio', 'video', 'definition', 'article',
+    'landmark', 'log', 'marquee', 'math', 'rating', 'timer', 'static')
+roleByName = _makeConstants('ROLE_', _roleNames)
+ROLE_LAST_DEFINED = len(_roleNames)
+
+_stateNames = (
+    'invalid', 'active', 'armed', 'busy', 'checked', 'collapsed', 'defunct',
+    'editable', 'enabled', 'expandable', 'expanded', 'focusable', 'focused',
+    'has tooltip', 'horizontal', 'iconified', 'modal', 'multi line',
+    'multiselectable', 'opaque', 'pressed', 'resizable', 'selectable',
+    'selected', 'sensitive', 'showing', 'single line', 'stale', 'transient',
+    'vertical', 'visible', 'manages descendants', 'indeterminate',
+    'required', 'truncated', 'animated', 'invalid entry',
+    'supports autocompletion', 'selectable text', 'is default', 'visited',
+    'checkable', 'has popup', 'read only')
+stateByName = _makeConstants('STATE_', _stateNames)
+
+_relationNames = (
+    'null', 'label for', 'labelled by', 'controller for', 'controlled by',
+    'member of', 'tooltip for', 'node child of', 'node parent of',
+    'extended', 'flows to', 'flows from', 'subwindow of', 'embeds',
+    'embedded by', 'popup for', 'parent window of', 'description for',
+    'described by', 'details', 'details for', 'error message', 'error for')
+relationByName = _makeConstants('RELATION_', _relationNames)
+
+
+def stateToString(state):
+    return _stateNames[state]
+
+
+def relationToString(relationType):
+    return _relationNames[relationType]
+
+DESKTOP_COORDS = 0
+WINDOW_COORDS = 1
+
+KEY_PRESS = 0
+KEY_RELEASE = 1
+KEY_PRESSRELEASE = 2
+KEY_SYM = 3
+KEY_STRING = 4
+
+"""
+The states a node gets if its specification does not list any.
+"""
+defaultStates = ('enabled', 'sensitive', 'showing', 'visible')
+
+"""
+Seconds every remote call is delayed by; see setLatency().
+"""
+latency = 0.0
+
+"""
+Number of remote calls made since the last resetCallCount().
+"""
+callCount = 0
+
+_callLock = threading.Lock()
+
+
+def setLatency(seconds):
+    """
+    Makes every remote call take (at least) the given number of seconds, to
+    mimic the round trip to the application over D-Bus.
+    """
+    global latency
+    latency = seconds
+
+
+def resetCallCount():
+    global callCount
+    with _callLock:
+        callCount = 0
+
+
+def _remote(node=None):
+    """
+    Accounts for a remote call, optionally made on the given node.
+    """
+    global callCount
+    with _callLock:
+        callCount += 1
+    if latency:
+        time.sleep(latency)
+    if node is not None and node._defunct:
+        raise GError("The application no longer exists")
+
+
+class StateSet(object):
+
+    def __init__(self, states=()):
+        self.__states = set(states)
+
+    def contains(self, state):
+        return state in self.__states
+
+    def add(self, *states):
+        self.__states.update(states)
+
+    def remove(self, *states):
+        self.__states.difference_update(states)
+
+    def getStates(self):
+        return list(self.__states)
+
+    def isEmpty(self):
+        return not self.__states
+
+
+class Relation(object):
+
+    def __init__(self, relationType, targets):
+        self.__relationType = relationType
+        self.__targets = targets
+
+    def getRelationType(self):
+        return self.__relationType
+
+    def getNTargets(self):
+        return len(self.__targets)
+
+    def getTarget(self, index):
+        return self.__targets[index]
+
+
+class _Rect(object):
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class _Interface(object):
+
+    def __init__(self, node):
+        self._node = node
+
+
+class Action(_Interface):
+
+    @property
+    def nActions(self):
+        _remote(self._node)
+        return len(self._node._actions)
+
+    def getName(self, index):
+        _remote(self._node)
+        return self._node._actions[index][0]
+
+    def getDescription(self, index):
+        _remote(self._node)
+        return self._node._actions[index][1]
+
+    def getKeyBinding(self, index):
+        _remote(self._node)
+        return self._node._actions[index][2]
+
+    def doAction(self, index):
+        _remote(self._node)
+        name = self._node._actions[index][0]
+        self._node.performedActions.append(name)
+        callback = self._node._actions[index][3]
+        if callback:
+            callback(self._node)
+        return True
+
+
+class Component(_Interface):
+
+    def getExtents(self, coordType):
+        _remote(self._node)
+        return _Rect(*self._node._extents)
+
+    def getPosition(self, coordType):
+        _remote(self._node)
+        return tuple(self._node._extents[:2])
+
+    def getSize(self):
+        _remote(self._node)
+        return tuple(self._node._extents[2:])
+
+    def contains(self, x, y, coordType):
+        _remote(self._node)
+        return self._node._contains(x, y)
+
+    def getAccessibleAtPoint(self, x, y, coordType):
+        _remote(self._node)
+        for child in reversed(self._node._children):
+            if child._extents and child._contains(x, y):
+                return child
+
+    def grabFocus(self):
+        _remote(self._node)
+        for node in _desktop._iterSubtree():
+            node._states.discard(STATE_FOCUSED)
+        self._node._states.add(STATE_FOCUSED)
+        return True
+
+
+class Text(_Interface):
+
+    @property
+    def characterCount(self):
+        _remote(self._node)
+        return len(self._node._text)
+
+    @property
+    def caretOffset(self):
+        _remote(self._node)
+        return self._node._caretOffset
+
+    def setCaretOffset(self, offset):
+        _remote(self._node)
+        self._node._caretOffset = max(0, min(offset, len(self._node._text)))
+        return True
+
+    def getText(self, startOffset, endOffset):
+        _remote(self._node)
+        if endOffset == -1:
+            endOffset = len(self._node._text)
+        return self._node._text[startOffset:endOffset]
+
+
+class EditableText(Text):
+
+    def setTextContents(self, text):
+        _remote(self._node)
+        self._node.setText(text)
+        return True
+
+    def insertText(self, position, text, length):
+        _remote(self._node)
+        old = self._node._text
+        self._node._text = old[:position] + text[:length] + old[position:]
+        Registry._notify('object:text-changed:insert', self._node, position,
+                         len(text[:length]), text[:length])
+        return True
+
+    def deleteText(self, startPos, endPos):
+        _remote(self._node)
+        old = self._node._text
+        self._node._text = old[:startPos] + old[endPos:]
+        Registry._notify('object:text-changed:delete', self._node, startPos,
+                         endPos - startPos, old[startPos:endPos])
+        return True
+
+
+class Selection(_Interface):
+
+    @property
+    def nSelectedChildren(self):
+        _remote(self._node)
+        return len(self.__selected())
+
+    def __selected(self):
+        return [c for c in self._node._children if STATE_SELECTED in c._states]
+
+    def getSelectedChild(self, index):
+        _remote(self._node)
+        return self.__selected()[index]
+
+    def isChildSelected(self, index):
+        _remote(self._node)
+        return STATE_SELECTED in self._node._children[index]._states
+
+    def selectChild(self, index):
+        _remote(self._node)
+        if not self._node._multiselectable:
+            for child in self._node._children:
+                child._states.discard(STATE_SELECTED)
+        self._node._children[index]._states.add(STATE_SELECTED)
+        return True
+
+    def deselectChild(self, index):
+        _remote(self._node)
+        self._node._children[index]._states.discard(STATE_SELECTED)
+        return True
+
+    def selectAll(self):
+        _remote(self._node)
+        for child in self._node._children:
+            child._states.add(STATE_SELECTED)
+        return True
+
+    def clearSelection(self):
+        _remote(self._node)
+        for child in self._node._children:
+            child._states.discard(STATE_SELECTED)
+        return True
+
+
+class Table(_Interface):
+
+    """
+    The cells of a fake table are the children of its node, row by row.
+    """
+
+    @property
+    def nColumns(self):
+        _remote(self._node)
+        return self._node._nColumns
+
+    @property
+    def nRows(self):
+        _remote(self._node)
+        return len(self._node._children) // self._node._nColumns
+
+    def getAccessibleAt(self, row, column):
+        _remote(self._node)
+        return self._node._children[self._node._cellIndex(row, column)]
+
+    def getIndexAt(self, row, column):
+        _remote(self._node)
+        return self._node._cellIndex(row, column)
+
+    def getRowAtIndex(self, index):
+        _remote(self._node)
+        return index // self._node._nColumns
+
+    def getColumnAtIndex(self, index):
+        _remote(self._node)
+        return index % self._node._nColumns
+
+    def getColumnHeader(self, column):
+        _remote(self._node)
+        return self._node._columnHeaders[column]
+
+    def getColumnDescription(self, column):
+        _remote(self._node)
+        return self._node._columnHeaders[column]._name
+
+
+class Hyperlink(object):
+
+    def __init__(self, node, uri, anchors):
+        self._node = node
+        self.__uri = uri
+        self.__anchors = anchors
+
+    @property
+    def nAnchors(self):
+        _remote(self._node)
+        return len(self.__anchors)
+
+    def getObject(self, index):
+        _remote(self._node)
+        return self.__anchors[index]
+
+    def getURI(self, index):
+        _remote(self._node)
+        return self.__uri
+
+
+class Hypertext(_Interface):
+
+    def getNLinks(self):
+        _remote(self._node)
+        return len(self._node._links)
+
+    def getLink(self, index):
+        _remote(self._node)
+        return self._node._links[index]
+
+
+class Value(_Interface):
+
+    def currentValue():
+        def fget(self):
+            _remote(self._node)
+            return self._node._value[0]
+
+        def fset(self, value):
+            _remote(self._node)
+            self._node._value[0] = value
+
+        return property(fget, fset)
+    currentValue = currentValue()
+
+    @property
+    def minimumValue(self):
+        _remote(self._node)
+        return self._node._value[1]
+
+    @property
+    def maximumValue(self):
+        _remote(self._node)
+        return self._node._value[2]
+
+    @property
+    def minimumIncrement(self):
+        _remote(self._node)
+        return self._node._value[3]
+
+
+class _AccessibleBase(object):
+
+    """
+    Accessible needs a base class of its own so that dogtail.tree can mix
+    Node into it, like it does with the real Accessibility.Accessible.
+    """
+    pass
+
+
+class _Connection(object):
+
+    """
+    The application an accessible belongs to, as Atspi.Accessible.app.
+    """
+
+    def __init__(self, busName):
+        self.bus_name = busName
+
+
+class Accessible(_AccessibleBase):
+
+    """
+    A fake accessible object. Its data lives in underscored attributes so
+    that it does not shadow anything dogtail.tree.Node provides; tests and
+    benchmarks change it through the set*() and appendChild() methods.
+    """
+    _nextId = 0
+
+    def __init__(self, name='', roleName='unknown', description='',
+                 states=defaultStates, actions=(), extents=None, text=None,
+                 value=None, toolkitName='fake'):
+        self._name = name
+        self._roleName = roleName
+        self._description = description
+        self._states = set([stateByName[s] for s in states])
+        self._actions = []
+        for action in actions:
+            self.addAction(action)
+        self._extents = extents and tuple(extents)
+        self._text = text
+        self._caretOffset = 0
+        self._value = value and list(value)
+        self._relations = {}
+        self._links = []
+        self._nColumns = 0
+        self._columnHeaders = []
+        self._multiselectable = STATE_MULTISELECTABLE in self._states
+        self._selection = False
+        self._toolkitName = toolkitName
+        self._parent = None
+        self._children = []
+        self._defunct = False
+        self._processId = None
+        Accessible._nextId += 1
+        self._id = Accessible._nextId
+        self.performedActions = []
+
+    #
+    # Setting up the tree
+    #
+
+    def appendChild(self, child):
+        child._parent = self
+        self._children.append(child)
+        Registry._notify('object:children-changed:add', self,
+                         len(self._children) - 1, 0, child)
+        return child
+
+    def removeChild(self, child):
+        index = self._children.index(child)
+        del self._children[index]
+        child._parent = None
+        Registry._notify('object:children-changed:remove', self, index, 0,
+                         child)
+
+    def addAction(self, action, description='', keyBinding='', callback=None):
+        """
+        Adds an action; action is its name, or a dict with 'name',
+        'description', 'keyBinding' and 'callback' keys.
+        """
+        if isinstance(action, dict):
+            self._actions.append((action['name'],
+                                  action.get('description', ''),
+                                  action.get('keyBinding', ''),
+                                  action.get('callback', None)))
+        else:
+            self._actions.append((action, description, keyBinding, callback))
+
+    def addRelation(self, relationName, target):
+        """
+        Adds target to the relation of the given name (e.g. 'label for'),
+        adding the reverse relation to the target for the label relations.
+        """
+        self._relations.setdefault(relationByName[relationName], []).append(
+            target)
+        reverse = {'label for': 'labelled by',
+                   'labelled by': 'label for'}.get(relationName)
+        if reverse:
+            target._relations.setdefault(
+                relationByName[reverse], []).append(self)
+
+    def addLink(self, uri, anchor):
+        """
+        Adds a hyperlink to uri with a single anchor object.
+        """
+        self._links.append(Hyperlink(self, uri, [anchor]))
+        anchor._parent = self
+
+    def setName(self, name):
+        self._name = name
+        Registry._notify('object:property-change:accessible-name', self,
+                         anyData=name)
+
+    def setDescription(self, description):
+        self._description = description
+        Registry._notify('object:property-change:accessible-description',
+                         self, anyData=description)
+
+    def setState(self, stateName, present=True):
+        state = stateByName[stateName]
+        if present == (state in self._states):
+            return
+        if present:
+            self._states.add(state)
+        else:
+            self._states.discard(state)
+        Registry._notify('object:state-changed:' + stateName.replace(' ', '-'),
+                         self, int(present))
+
+    def setExtents(self, extents):
+        self._extents = extents and tuple(extents)
+        Registry._notify('object:bounds-changed', self,
+                         anyData=extents and _Rect(*extents))
+
+    def setText(self, text):
+        old = self._text
+        self._text = text
+        if old:
+            Registry._notify('object:text-changed:delete', self, 0, len(old),
+                             old)
+        if text:
+            Registry._notify('object:text-changed:insert', self, 0, len(text),
+                             text)
+
+    def setTable(self, nColumns, columnHeaders=()):
+        """
+        Makes the node a table with nColumns columns; its children are the
+        cells, row by row.
+        """
+        self._nColumns = nColumns
+        self._columnHeaders = []
+        for header in columnHeaders:
+            node = Accessible(header, 'table column header')
+            node._parent = self
+            self._columnHeaders.append(node)
+
+    def setSelection(self, multiselectable=False):
+        self._selection = True
+        self._multiselectable = multiselectable
+
+    def kill(self):
+        """
+        Makes this node and all of its descendants defunct.
+        """
+        for node in self._iterSubtree():
+            node._defunct = True
+
+    def _iterSubtree(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node._children))
+
+    def _contains(self, x, y):
+        if not self._extents:
+            return False
+        ex, ey, ew, eh = self._extents
+        return ex <= x < ex + ew and ey <= y < ey + eh
+
+    def _cellIndex(self, row, column):
+        return row * self._nColumns + column
+
+    #
+    # The pyatspi Accessible API
+    #
+
+    def __str__(self):
+        try:
+            return '[%s | %s]' % (self.getRoleName(), self.name)
+        except GError:
+            return '[DEAD]'
+
+    def __repr__(self):
+        return '<fake Accessible %s>' % self
+
+    def __nonzero__(self):
+        return True
+
+    def __len__(self):
+        return self.childCount
+
+    def __getitem__(self, index):
+        childCount = self.childCount
+        if index < 0:
+            index += childCount
+        if index < 0 or index >= childCount:
+            raise IndexError(index)
+        return self.getChildAtIndex(index)
+
+    def __iter__(self):
+        for i in range(self.childCount):
+            yield self.getChildAtIndex(i)
+
+    # Held by the proxy: no remote call
+    @property
+    def app(self):
+        node = self
+        while node._parent is not None and node._parent is not _desktop:
+            node = node._parent
+        return _Connection(':1.%i' % node._id)
+
+    @property
+    def path(self):
+        return '/org/a11y/atspi/accessible/%i' % self._id
+
+    @property
+    def name(self):
+        _remote(self)
+        return self._name
+
+    @property
+    def description(self):
+        _remote(self)
+        return self._description
+
+    @property
+    def parent(self):
+        _remote(self)
+        return self._parent
+
+    @property
+    def childCount(self):
+        _remote(self)
+        return len(self._children)
+
+    @property
+    def toolkitName(self):
+        _remote(self)
+        return self._toolkitName
+
+    @property
+    def id(self):
+        _remote(self)
+        return self._id
+
+    def getChildAtIndex(self, index):
+        _remote(self)
+        return self._children[index]
+
+    def get_process_id(self):
+        _remote(self)
+        node = self
+        while node._parent is not None and node._parent is not _desktop:
+            node = node._parent
+        if node._processId is None:
+            raise GError("Process id unknown")
+        return node._processId
+
+    def getIndexInParent(self):
+        _remote(self)
+        if self._parent is None:
+            return -1
+        return self._parent._children.index(self)
+
+    def getRole(self):
+        _remote(self)
+        return roleByName.get(self._roleName, ROLE_UNKNOWN)
+
+    def getRoleName(self):
+        _remote(self)
+        return self._roleName
+
+    def getState(self):
+        _remote(self)
+        return StateSet(self._states)
+
+    def getRelationSet(self):
+        _remote(self)
+        return [Relation(relationType, list(targets))
+                for relationType, targets in self._relations.items()]
+
+    def getApplication(self):
+        _remote(self)
+        node = self
+        while node is not None and node._roleName != 'application':
+            node = node._parent
+        return node
+
+    def queryAction(self):
+        _remote(self)
+        if not self._actions:
+            raise NotImplementedError
+        return Action(self)
+
+    def queryComponent(self):
+        _remote(self)
+        if self._extents is None:
+            raise NotImplementedError
+        return Component(self)
+
+    def queryText(self):
+        _remote(self)
+        if self._text is None:
+            raise NotImplementedError
+        return Text(self)
+
+    def queryEditableText(self):
+        _remote(self)
+        if self._text is None or STATE_EDITABLE not in self._states:
+            raise NotImplementedError
+        return EditableText(self)
+
+    def querySelection(self):
+        _remote(self)
+        if not self._selection:
+            raise NotImplementedError
+        return Selection(self)
+
+    def queryTable(self):
+        _remote(self)
+        if not self._nColumns:
+            raise NotImplementedError
+        return Table(self)
+
+    def queryHypertext(self):
+        _remote(self)
+        if not self._links:
+            raise NotImplementedError
+        return Hypertext(self)
+
+    def queryValue(self):
+        _remote(self)
+        if self._value is None:
+            raise NotImplementedError
+        return Value(self)
+
+
+# Accessibility.Application is a plain Accessible in the fake:
+Application = Accessible
+
+
+class EventType(str):
+
+    """
+    The type of an event, e.g. 'object:children-changed:add', with its parts
+    as attributes like in pyatspi: klass, major, minor and detail.
+    """
+
+    def __new__(cls, name):
+        eventType = str.__new__(cls, name)
+        eventType.klass, eventType.major, eventType.minor, \
+            eventType.detail = (name.split(':', 3) + ['', '', ''])[:4]
+        return eventType
+
+
+class Event(object):
+
+    """
+    An event about a change of an Accessible, delivered to the listeners
+    registered with the Registry.
+    """
+
+    def __init__(self, type, source, detail1=0, detail2=0, anyData=None):
+        self.type = EventType(type)
+        self.source = source
+        self.detail1 = detail1
+        self.detail2 = detail2
+        self.any_data = anyData
+
+    @property
+    def host_application(self):
+        return self.source.getApplication()
+
+    def __str__(self):
+        return '%s(%s, %s, %s)' % (self.type, self.source, self.detail1,
+                                   self.detail2)
+
+
+class _Registry(object):
+
+    """
+    Stands in for pyatspi.Registry. Synthesized input events are recorded
+    rather than delivered anywhere. The changes made to the fake tree through
+    the methods of Accessible are delivered to the event listeners at once,
+    in the thread making them.
+    """
+
+    def __init__(self):
+        self.mouseEvents = []
+        self.keyboardEvents = []
+        self.listeners = []
+
+    def registerEventListener(self, client, *eventTypes):
+        for eventType in eventTypes:
+            self.listeners.append((client, eventType))
+
+    def deregisterEventListener(self, client, *eventTypes):
+        for eventType in eventTypes:
+            if (client, eventType) in self.listeners:
+                self.listeners.remove((client, eventType))
+
+    def _notify(self, eventType, source, detail1=0, detail2=0, anyData=None):
+        if not self.listeners:
+            return
+        event = None
+        for client, registered in list(self.listeners):
+            if eventType == registered or \
+                    eventType.startswith(registered + ':'):
+                if event is None:
+                    event = Event(eventType, source, detail1, detail2,
+                                  anyData)
+                client(event)
+
+    def getDesktop(self, index):
+        return _desktop
+
+    def generateMouseEvent(self, x, y, name):
+        self.mouseEvents.append((x, y, name))
+
+    def generateKeyboardEvent(self, keycode, keystring, kind):
+        self.keyboardEvents.append((keycode, keystring, kind))
+
+Registry = _Registry()
+
+_desktop = Accessible('main', 'desktop frame', states=())
+
+
+def buildTree(spec):
+    """
+    Builds a tree of Accessible objects from nested dicts and returns its
+    root. A spec may have the keys 'name', 'roleName', 'description',
+    'states' (a list of state names), 'actions', 'extents' (x, y, w, h),
+    'text', 'value' (current, minimum, maximum, increment), 'columns' and
+    'columnHeaders' (for tables), 'selection', 'links' (a list of dicts with
+    'uri' and 'anchor' specs), 'children' (a list of specs) and, for
+    applications, 'pid' (their process id).
+
+    Nodes may be given an 'id' and refer to each other through 'relations',
+    a dict mapping relation names to lists of ids, e.g.
+    {'relations': {'label for': ['entry1']}}.
+    """
+    byId = {}
+    pendingRelations = []
+
+    def build(spec):
+        node = Accessible(spec.get('name', ''),
+                          spec.get('roleName', 'unknown'),
+                          spec.get('description', ''),
+                          spec.get('states', defaultStates),
+                          spec.get('actions', ()),
+                          spec.get('extents'),
+                          spec.get('text'),
+                          spec.get('value'))
+        if 'id' in spec:
+            byId[spec['id']] = node
+        node._processId = spec.get('pid')
+        for relationName, targets in spec.get('relations', {}).items():
+            pendingRelations.append((node, relationName, targets))
+        if spec.get('columns'):
+            node.setTable(spec['columns'], spec.get('columnHeaders', ()))
+        if spec.get('selection'):
+            node.setSelection(STATE_MULTISELECTABLE in node._states)
+        for link in spec.get('links', ()):
+            node.addLink(link['uri'], build(link['anchor']))
+        stack.append((node, spec.get('children', ())))
+        return node
+
+    stack = []
+    root = build(spec)
+    # Build the children iteratively, so that deep trees work:
+    while stack:
+        node, childSpecs = stack.pop()
+        for childSpec in childSpecs:
+            node.appendChild(build(childSpec))
+    for node, relationName, targets in pendingRelations:
+        for target in targets:
+            node._relations.setdefault(
+                relationByName[relationName], []).append(byId[target])
+    return root
+
+
+def loadDump(fileName):
+    """
+    Builds a tree of Accessible objects from the output of
+    dogtail.dump.plain() (a file name or an open file) and returns its root.
+    Actions are restored; everything else a plain dump does not record gets
+    its default value.
+    """
+    if isinstance(fileName, basestring):
+        dumpFile = open(fileName)
+    else:
+        dumpFile = fileName
+    root = None
+    ancestors = []
+    try:
+        for line in dumpFile:
+            line = line.rstrip('\n')
+            stripped = line.lstrip(' ')
+            if not (stripped.startswith('[') and stripped.endswith(']')):
+                continue
+            depth = len(line) - len(stripped)
+            fields = stripped[1:-1].split(' | ', 1)
+            if fields[0] == 'action':
+                actionName, keyBinding = (fields[1].rsplit(' | ', 1) + [''])[:2]
+                ancestors[depth - 1].addAction(actionName,
+                                               keyBinding=keyBinding.strip())
+                continue
+            node = Accessible(fields[1] if len(fields) > 1 else '', fields[0])
+            del ancestors[depth:]
+            if ancestors:
+                ancestors[-1].appendChild(node)
+            else:
+                root = node
+            ancestors.append(node)
+    finally:
+        if dumpFile is not fileName:
+            dumpFile.close()
+    return root
+
+
+def addApplication(application):
+    """
+    Adds an application (an Accessible, usually from buildTree() or
+    loadDump()) to the desktop. A dumped desktop frame has its applications
+    added instead.
+    """
+    if application._roleName == 'desktop frame':
+        for child in list(application._children):
+            _desktop.appendChild(child)
+    else:
+        _desktop.appendChild(application)
+    return application
+
+
+def reset():
+    """
+    Removes all applications from the desktop and forgets the recorded
+    input events, calls and event listeners.
+    """
+    del Registry.listeners[:]
+    for child in list(_desktop._children):
+        _desktop.removeChild(child)
+    del Registry.mouseEvents[:]
+    del Registry.keyboardEvents[:]
+    resetCallCount()
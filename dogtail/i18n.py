@@ -122,6 +122,9 @@ def translate(srcString):
     return results.keys()
 
 
+_regexCharacters = re.compile(r'[.^$*+?{}\[\]\\|]')
+
+
 class TranslatableString(object):
 
     """
@@ -141,6 +144,21 @@ class TranslatableString(object):
         self.untranslatedString = untranslatedString
         self.translatedStrings = translate(untranslatedString)
 
+    def literals(self):
+        """
+        The strings matchedBy() accepts, if they are plain strings rather
+        than regular expressions, or None.
+        """
+        strings = set(self.translatedStrings)
+        strings.add(self.untranslatedString)
+        for string in strings:
+            string = safeDecode(string)
+            if string.startswith('*'):
+                string = string[1:]
+            if _regexCharacters.search(string):
+                return None
+        return frozenset(safeDecode(string) for string in strings)
+
     def matchedBy(self, string):
         """
         Compare the test string against either the translation of the original
@@ -184,6 +202,18 @@ class TranslatableString(object):
         # ts=0
         return stringsMatch(self.untranslatedString, string)
 
+    # The translations only depend on the untranslated string
+    def __eq__(self, other):
+        if not isinstance(other, TranslatableString):
+            return False
+        return self.untranslatedString == other.untranslatedString
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.untranslatedString)
+
     def __str__(self):
         """
         Provide a meaningful debug version of the string (and the translation in
@@ -240,11 +270,18 @@ def getMoFilesForPackage(packageName, language='', getDependencies=True):
             result.append(filename)
 
     if getDependencies:
-        # Recurse:
-        for dep in distro.packageDb.getDependencies(packageName):
-            # We pass False to the inner call because getDependencies has already
-            # walked the full tree
-            result.extend(getMoFilesForPackage(dep, language, False))
+        # getDependencies has already walked the full tree, so the files of
+        # all the dependencies can be looked up at once:
+        dependencies = distro.packageDb.getDependencies(packageName)
+        fileLists = distro.packageDb.getFileLists(dependencies)
+        for dep in dependencies:
+            # As when each dependency was looked up on its own, one that is
+            # not installed is an error.
+            if dep not in fileLists:
+                raise distro.PackageNotFoundError(dep)
+            for filename in fileLists[dep]:
+                if isMoFile(filename, language):
+                    result.append(filename)
 
     return result
 
@@ -282,6 +319,6 @@ def loadTranslationsFromPackageMoFiles(packageName, getDependencies=True):
 
     import distro
     language = os.environ.get('LANGUAGE', os.environ['LANG'])[0:2]
-    if isinstance(distro.distro, distro.Ubuntu):
+    if isinstance(distro.getDistro(), distro.Ubuntu):
         load('language-pack-gnome-%s' % language, language)
     load(packageName, language, getDependencies)
@@ -0,0 +1,439 @@
+"""A local mirror of the tree of an application, kept current by events.
+
+Searching the live tree costs a round trip to the application for every node
+visited and property read. A LiveMirror copies the tree of an application
+once, then applies the children-changed, property-change and state-changed
+events the application emits to the copy:
+
+    from dogtail.mirror import LiveMirror
+    gedit = tree.root.application('gedit')
+    mirror = LiveMirror(gedit)
+    gedit.child('Save', roleName='push button')
+    ...
+    mirror.close()
+
+While a mirror is open, Node.findChild(), findChildren() and everything
+built on them (child(), button(), the dogtail.procedural focus helpers...)
+search the mirror of the nodes below its application instead of the live
+tree. The mirror holds the role names, names, descriptions and states of the
+nodes; predicates reading anything else read it from the live node. A node
+found in the mirror is checked against the live node before it is returned,
+and if it no longer matches, that part of the mirror is read again.
+
+The nodes are also indexed by role name and by name, so that the predicates
+telling which roles or names they need (see Predicate.indexKeys()), like
+button('OK') or menuItem('Quit'), are only tried on the nodes that have
+them rather than on the whole tree. Searches for labelled nodes only read
+the relations of the labels.
+
+Only the applications emitting these events can be mirrored faithfully;
+most toolkits do, but a node changing without telling is not noticed until
+a search finds it and the check against the live node fails.
+"""
+
+from backend import pyatspi, RemoteError
+from config import config
+from dump import stateName
+from i18n import safeDecode
+from logging import debugLogger as logger
+from predicate import Predicate
+
+"""
+The events keeping mirrors current.
+"""
+eventTypes = ('object:children-changed', 'object:property-change',
+              'object:state-changed')
+
+"""
+The open mirrors.
+"""
+mirrors = []
+
+
+def lookup(accessible):
+    """
+    The open LiveMirror holding accessible, or None.
+    """
+    for mirror in mirrors:
+        if accessible in mirror.nodes:
+            return mirror
+
+
+def _normalize(name):
+    return safeDecode(name or '')
+
+
+def _pumpEvents():
+    # The fake delivers its events right away; pyatspi queues them in the
+    # main loop, which scripts do not usually run.
+    if config.backend == 'fake':
+        return
+    from gi.repository import GLib
+    context = GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+def _liveChildren(accessible):
+    try:
+        childCount = accessible.childCount
+    except Exception:
+        return []
+    children = []
+    for index in xrange(childCount):
+        try:
+            child = accessible[index]
+        except Exception:
+            continue
+        if child is not None:
+            children.append(child)
+    return children
+
+
+class MirrorNode(object):
+
+    """
+    The mirrored properties of a live accessible, which predicates see in
+    place of the node itself. The other attributes are read from the live
+    accessible.
+    """
+
+    __slots__ = ('accessible', 'parent', 'children', 'roleName', 'name',
+                 'description', 'states')
+
+    def __init__(self, accessible, parent):
+        self.accessible = accessible
+        self.parent = parent
+        self.children = []
+        self.refresh()
+
+    def refresh(self):
+        """
+        Reads the mirrored properties of the live accessible again.
+        """
+        accessible = self.accessible
+        self.roleName = accessible.getRoleName()
+        self.name = accessible.name
+        self.description = accessible.description
+        self.states = frozenset(stateName(state) for state in
+                                accessible.getState().getStates())
+
+    def getRoleName(self):
+        return self.roleName
+
+    def __state(stateName):
+        return property(lambda self: stateName in self.states)
+    sensitive = __state('sensitive')
+    showing = __state('showing')
+    focusable = __state('focusable')
+    focused = __state('focused')
+    checked = __state('checked')
+
+    def __getattr__(self, name):
+        return getattr(self.accessible, name)
+
+    def __str__(self):
+        return '[%s | %s]' % (self.roleName, self.name)
+
+
+class LiveMirror(object):
+
+    """
+    A mirror of the tree of an application (a Node), which starts being
+    used by searches right away unless start is False. The mirror is kept
+    until close() is called; it can also be used as a context manager.
+    """
+
+    def __init__(self, application, start=True):
+        self.application = application
+        # The MirrorNode of each live accessible
+        self.nodes = {}
+        # Sets of MirrorNodes by role name and by normalized name
+        self.byRoleName = {}
+        self.byName = {}
+        self.eventCount = 0
+        self.root = self._build(application, None)
+        self.running = False
+        if start:
+            self.start()
+
+    def _index(self, node):
+        self.byRoleName.setdefault(node.roleName, set()).add(node)
+        self.byName.setdefault(_normalize(node.name), set()).add(node)
+
+    def _unindex(self, node):
+        self.byRoleName.get(node.roleName, set()).discard(node)
+        self.byName.get(_normalize(node.name), set()).discard(node)
+
+    def _refresh(self, node):
+        self._unindex(node)
+        node.refresh()
+        self._index(node)
+
+    def _build(self, accessible, parent):
+        root = MirrorNode(accessible, parent)
+        self.nodes[accessible] = root
+        self._index(root)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            for child in _liveChildren(node.accessible):
+                try:
+                    mirrored = MirrorNode(child, node)
+                except Exception:
+                    continue
+                self.nodes[child] = mirrored
+                self._index(mirrored)
+                node.children.append(mirrored)
+                stack.append(mirrored)
+        return root
+
+    def _forget(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if self.nodes.get(node.accessible) is node:
+                del self.nodes[node.accessible]
+            self._unindex(node)
+            stack.extend(node.children)
+
+    def resync(self, node):
+        """
+        Reads the given MirrorNode and its children from the live tree again,
+        keeping the mirror of the children that are still there. A node that
+        cannot be read any more is removed, and its parent read again.
+        """
+        while True:
+            try:
+                self._refresh(node)
+                break
+            except Exception:
+                if node.parent is None:
+                    return
+                node = node.parent
+        previous = dict((child.accessible, child) for child in node.children)
+        children = []
+        for child in _liveChildren(node.accessible):
+            mirrored = previous.pop(child, None)
+            if mirrored is None:
+                try:
+                    mirrored = self._build(child, node)
+                except Exception:
+                    continue
+            children.append(mirrored)
+        for gone in previous.values():
+            self._forget(gone)
+        node.children = children
+
+    def start(self):
+        """
+        Starts listening to events and using the mirror in searches.
+        """
+        if self.running:
+            return
+        pyatspi.Registry.registerEventListener(self._onEvent, *eventTypes)
+        mirrors.append(self)
+        self.running = True
+
+    def close(self):
+        """
+        Stops listening to events and using the mirror in searches.
+        """
+        if not self.running:
+            return
+        pyatspi.Registry.deregisterEventListener(self._onEvent, *eventTypes)
+        mirrors.remove(self)
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _onEvent(self, event):
+        node = self.nodes.get(event.source)
+        if node is None:
+            return
+        self.eventCount += 1
+        if config.debugSearching:
+            logger.log("Mirroring %s" % event)
+        try:
+            if event.type.major == 'children-changed':
+                self.resync(node)
+            else:
+                self._refresh(node)
+        except Exception:
+            if node.parent is not None:
+                self.resync(node.parent)
+
+    def _descendants(self, node, recursive, stats):
+        if not recursive:
+            if stats:
+                stats.nodesVisited += len(node.children)
+                stats.maxDepth = max(stats.maxDepth, node.children and 1 or 0)
+            for child in list(node.children):
+                yield child
+            return
+        stack = [(child, 1) for child in reversed(node.children)]
+        while stack:
+            node, depth = stack.pop()
+            if stats:
+                stats.nodesVisited += 1
+                if depth > stats.maxDepth:
+                    stats.maxDepth = depth
+            yield node
+            stack.extend([(child, depth + 1)
+                          for child in reversed(node.children)])
+
+    def _matches(self, candidate, pred, stats):
+        if stats:
+            stats.predicateEvaluations += 1
+        try:
+            return pred(candidate)
+        except (RemoteError, LookupError):
+            return False
+
+    def _labelled(self, label):
+        labelled = set()
+        for node in list(self.byRoleName.get('label', ())):
+            if not label.matchedBy(node.name):
+                continue
+            try:
+                targets = node.accessible.labellee
+            except Exception:
+                continue
+            if not isinstance(targets, list):
+                targets = [targets]
+            for target in targets:
+                if target in self.nodes:
+                    labelled.add(self.nodes[target])
+        return labelled
+
+    def _candidates(self, pred):
+        """
+        The smallest set of nodes the index gives for the predicate, or None
+        if it does not restrict role names nor names.
+        """
+        roleNames, names = pred.indexKeys()
+        sets = []
+        if roleNames is not None:
+            sets.append(set().union(*[self.byRoleName.get(roleName, ())
+                                      for roleName in roleNames]))
+        if names is not None:
+            sets.append(set().union(*[self.byName.get(_normalize(name), ())
+                                      for name in names]))
+        if not sets:
+            return None
+        return min(sets, key=len)
+
+    def _position(self, node):
+        position = []
+        while node.parent is not None:
+            position.append(node.parent.children.index(node))
+            node = node.parent
+        position.reverse()
+        return position
+
+    def _matching(self, node, candidates, function, recursive, stats):
+        """
+        The candidates below node (or children of it, if recursive is False)
+        satisfying function.
+        """
+        matched = []
+        for candidate in candidates:
+            if stats:
+                stats.nodesVisited += 1
+            ancestor = candidate.parent
+            if recursive:
+                while ancestor is not None and ancestor is not node:
+                    ancestor = ancestor.parent
+            if ancestor is node and self._matches(candidate, function, stats):
+                matched.append(candidate)
+        return matched
+
+    def _search(self, node, pred, recursive, stats):
+        """
+        Yields the MirrorNodes below node satisfying pred, in document order.
+        """
+        if not isinstance(pred, Predicate):
+            for candidate in self._descendants(node, recursive, stats):
+                if self._matches(candidate, pred, stats):
+                    yield candidate
+            return
+        function = pred.satisfiedByNode
+        matched = []
+        # The nodes a predicate about labels can match are first looked for
+        # among those the matching labels are a label for; a node may also
+        # be labelled only through its own relations.
+        label = pred.requiredLabel()
+        if label is not None:
+            matched = self._matching(node, self._labelled(label), function,
+                                     recursive, stats)
+        if not matched:
+            candidates = self._candidates(pred)
+            if candidates is None:
+                for candidate in self._search(node, function, recursive,
+                                              stats):
+                    yield candidate
+                return
+            matched = self._matching(node, candidates, function, recursive,
+                                     stats)
+        if len(matched) <= 64:
+            matched.sort(key=self._position)
+            for candidate in matched:
+                yield candidate
+        else:
+            matched = set(matched)
+            for candidate in self._descendants(node, recursive, None):
+                if candidate in matched:
+                    yield candidate
+
+    def findChild(self, accessible, pred, recursive=True, stats=None):
+        """
+        Searches the mirror below accessible, a live node of the mirrored
+        application, for a node satisfying pred (a Predicate or a function
+        taking a node). The live node found is returned once it satisfies
+        pred too, or None.
+        """
+        _pumpEvents()
+        check = isinstance(pred, Predicate) and pred.satisfiedByNode or pred
+        for attempt in range(3):
+            node = self.nodes.get(accessible)
+            if node is None:
+                return None
+            for candidate in self._search(node, pred, recursive, stats):
+                break
+            else:
+                return None
+            if self._matches(candidate.accessible, check, stats):
+                return candidate.accessible
+            logger.log("Mirror of %s out of date, reading it again" %
+                       candidate)
+            self.resync(candidate)
+
+    def findChildren(self, accessible, pred, recursive=True, stats=None):
+        """
+        Like findChild(), but returns all the live nodes satisfying pred.
+        """
+        _pumpEvents()
+        check = isinstance(pred, Predicate) and pred.satisfiedByNode or pred
+        node = self.nodes.get(accessible)
+        if node is None:
+            return []
+        result = []
+        stale = []
+        for candidate in list(self._search(node, pred, recursive, stats)):
+            if self._matches(candidate.accessible, check, stats):
+                result.append(candidate.accessible)
+            else:
+                stale.append(candidate)
+        for candidate in stale:
+            logger.log("Mirror of %s out of date, reading it again" %
+                       candidate)
+            self.resync(candidate)
+        return result
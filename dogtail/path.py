@@ -37,17 +37,16 @@ class SearchPath(object):
 
     # We need equality to work so that dicts of these work:
     def __eq__(self, other):
-        # print "eq: self:%s"%self
-        # print "       other:%s"%other
-        if len(self.__list) != len(other.__list):
-            # print "nonequal length"
+        if not isinstance(other, SearchPath):
             return False
-        else:
-            for i in range(len(self.__list)):
-                if self.__list[i] != other.__list[i]:
-                    return False
-        # print True
-        return True
+        return self.__list == other.__list
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Like a list, a SearchPath should not be changed while it is a dict key
+    def __hash__(self):
+        return hash(tuple(self.__list))
 
     def append(self, predicate, isRecursive):
         assert predicate
@@ -111,3 +110,73 @@ class SearchPath(object):
     def getPredicate(self, i):
         (predicate, isRecursive) = self.__list[i]
         return predicate
+
+
+class PathResolver(object):
+
+    """
+    Finds the nodes that many SearchPaths lead to at once. The paths are
+    arranged in a trie, so that the searches of a prefix they share (say,
+    the application and the window) are only made once, then each branch is
+    searched from the node found.
+
+    If cache is True, the nodes found for the prefixes are kept between
+    calls of resolve(), until clear() is called. A kept node is checked to
+    still be alive before it is used again, and the prefixes that were not
+    found are searched again. root is the node searches start from
+    (dogtail.tree.root by default), and retry is passed on to
+    Node.findChild().
+    """
+
+    def __init__(self, root=None, cache=False, retry=False):
+        if root is None:
+            import tree
+            root = tree.root
+        self.root = root
+        self.cache = cache
+        self.retry = retry
+        self.__found = {}
+
+    def clear(self):
+        """
+        Forgets the nodes kept for the prefixes.
+        """
+        self.__found = {}
+
+    def __find(self, node, prefix):
+        found = self.__found.get(prefix)
+        if found is not None and not found.dead:
+            return found
+        predicate, isRecursive = prefix[-1]
+        found = node.findChild(predicate, recursive=isRecursive,
+                               retry=self.retry, requireResult=False)
+        self.__found[prefix] = found
+        return found
+
+    def resolve(self, paths):
+        """
+        Returns a dict of the node (or None) each of the given SearchPaths
+        leads to.
+        """
+        paths = list(paths)
+        trie = {}
+        for path in paths:
+            branch = trie
+            for step in path:
+                branch = branch.setdefault(step, {})
+        if not self.cache:
+            self.__found = {}
+        found = {(): self.root}
+        stack = [((), self.root, trie)]
+        while stack:
+            prefix, node, branch = stack.pop()
+            for step, subBranch in branch.items():
+                stepPrefix = prefix + (step,)
+                if node is None:
+                    found[stepPrefix] = None
+                else:
+                    found[stepPrefix] = self.__find(node, stepPrefix)
+                stack.append((stepPrefix, found[stepPrefix], subBranch))
+        if not self.cache:
+            self.__found = {}
+        return dict((path, found[tuple(path)]) for path in paths)
@@ -58,6 +58,23 @@ class Predicate(object):
     def describeSearchResult(self, node):
         raise NotImplementedError
 
+    def indexKeys(self):
+        """
+        Returns (roleNames, names): every node satisfying the predicate has
+        one of these role names and one of these names, where None does not
+        restrict anything. Indexed searches (see dogtail.mirror) only try the
+        predicate on such nodes.
+        """
+        return None, None
+
+    def requiredLabel(self):
+        """
+        A TranslatableString matching the name of the label of every node
+        satisfying the predicate, or None. Searches can then look for the
+        labels rather than ask every node for its label.
+        """
+        return None
+
     def makeScriptMethodCall(self, isRecursive):
         """
         Method to generate a string containing a (hopefully) readable search
@@ -75,20 +92,40 @@ class Predicate(object):
         """
         raise NotImplementedError
 
+    def __new__(cls, *args, **kwargs):
+        # The arguments are kept so that predicates can be pickled: their
+        # satisfiedByNode functions cannot be, and are made again instead.
+        self = object.__new__(cls)
+        self._arguments = (args, kwargs)
+        return self
+
+    def __reduce__(self):
+        args, kwargs = self._arguments
+        return (_makePredicate, (type(self), args, kwargs))
+
+    def _key(self):
+        return (type(self), tuple(sorted(
+            (name, value) for name, value in self.__dict__.items()
+            if name != '_arguments' and not callable(value))))
+
     def __eq__(self, other):
         """
         Predicates are considered equal if they are of the same subclass and
         have the same data
         """
-        # print "predeq: self:%s"%self
-        # print "               other:%s"%other
-        # print "predeq: selfdict:%s"%self.__dict__
-        # print "               otherdict:%s"%other.__dict__
-
-        if type(self) != type(other):
+        if not isinstance(other, Predicate):
             return False
-        else:
-            return self.__dict__ == other.__dict__
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+def _makePredicate(cls, args, kwargs):
+    return cls(*args, **kwargs)
 
 
 class IsAnApplicationNamed(Predicate):
@@ -105,6 +142,9 @@ class IsAnApplicationNamed(Predicate):
             return node.roleName == 'application' and stringMatches(self.appName, node.name)
         return satisfiedByNode
 
+    def indexKeys(self):
+        return ('application',), self.appName.literals()
+
     def describeSearchResult(self):
         return '%s application' % self.appName
 
@@ -120,13 +160,17 @@ class GenericPredicate(Predicate):
 
     """SubtreePredicate subclass that takes various optional search fields"""
 
-    def __init__(self, name=None, roleName=None, description=None, label=None, debugName=None):
+    def __init__(self, name=None, roleName=None, description=None, label=None, debugName=None, states=None):
         if name:
             self.name = TranslatableString(name)
         else:
             self.name = None
         self.roleName = roleName
         self.description = description
+        if states:
+            self.states = frozenset(states)
+        else:
+            self.states = None
         if label:
             self.label = TranslatableString(label)
         else:
@@ -145,6 +189,8 @@ class GenericPredicate(Predicate):
                 self.debugName += " roleName='%s'" % roleName
             if description:
                 self.debugName += " description='%s'" % description
+            if states:
+                self.debugName += " states=%s" % ', '.join(sorted(states))
         assert self.debugName
 
         self.satisfiedByNode = self._genCompareFunc()
@@ -171,9 +217,21 @@ class GenericPredicate(Predicate):
                 if self.description:
                     if self.description != node.description:
                         return False
+                if self.states:
+                    if not self.states <= node.states:
+                        return False
                 return True
         return satisfiedByNode
 
+    def indexKeys(self):
+        if self.label:
+            return None, None
+        return (self.roleName and (self.roleName,) or None,
+                self.name and self.name.literals() or None)
+
+    def requiredLabel(self):
+        return self.label
+
     def describeSearchResult(self):
         return self.debugName
 
@@ -217,6 +275,9 @@ class IsNamed(Predicate):
             return stringMatches(self.name, node.name)
         return satisfiedByNode
 
+    def indexKeys(self):
+        return None, self.name.literals()
+
     def describeSearchResult(self):
         return "named %s" % self.name
 
@@ -241,6 +302,9 @@ class IsAWindowNamed(Predicate):
             return node.roleName == 'frame' and stringMatches(self.windowName, node.name)
         return satisfiedByNode
 
+    def indexKeys(self):
+        return ('frame',), self.windowName.literals()
+
     def describeSearchResult(self):
         return "%s window" % self.windowName
 
@@ -258,6 +322,9 @@ class IsAWindow(Predicate):
     def __init__(self):
         self.satisfiedByNode = lambda node: node.roleName == 'frame'
 
+    def indexKeys(self):
+        return ('frame',), None
+
     def describeSearchResult(self):
         return "window"
 
@@ -276,6 +343,9 @@ class IsADialogNamed(Predicate):
             return node.roleName == 'dialog' and stringMatches(self.dialogName, node.name)
         return satisfiedByNode
 
+    def indexKeys(self):
+        return ('dialog',), self.dialogName.literals()
+
     def describeSearchResult(self):
         return '%s dialog' % self.dialogName
 
@@ -310,6 +380,9 @@ class IsLabelledAs(Predicate):
                 return False
         return satisfiedByNode
 
+    def requiredLabel(self):
+        return self.labelText
+
     def describeSearchResult(self):
         return 'labelled %s' % self.labelText
 
@@ -330,6 +403,9 @@ class IsAMenuNamed(Predicate):
         self.satisfiedByNode = lambda node: node.roleName == 'menu' and \
             stringMatches(self.menuName, node.name)
 
+    def indexKeys(self):
+        return ('menu',), self.menuName.literals()
+
     def describeSearchResult(self):
         return '%s menu' % (self.menuName)
 
@@ -351,6 +427,9 @@ class IsAMenuItemNamed(Predicate):
             node.roleName.endswith('menu item') and \
             stringMatches(self.menuItemName, node.name)
 
+    def indexKeys(self):
+        return None, self.menuItemName.literals()
+
     def describeSearchResult(self):
         return '%s menuitem' % (self.menuItemName)
 
@@ -371,6 +450,9 @@ class IsATextEntryNamed(Predicate):
         self.satisfiedByNode = lambda node: node.roleName == 'text' and \
             stringMatches(self.textEntryName, node.name)
 
+    def indexKeys(self):
+        return ('text',), self.textEntryName.literals()
+
     def describeSearchResult(self):
         return '%s textentry' % (self.textEntryName)
 
@@ -391,6 +473,9 @@ class IsAButtonNamed(Predicate):
         self.satisfiedByNode = lambda node: node.roleName == 'push button' \
             and stringMatches(self.buttonName, node.name)
 
+    def indexKeys(self):
+        return ('push button',), self.buttonName.literals()
+
     def describeSearchResult(self):
         return '%s button' % (self.buttonName)
 
@@ -411,6 +496,9 @@ class IsATabNamed(Predicate):
         self.satisfiedByNode = lambda node: node.roleName == 'page tab' and \
             stringMatches(self.tabName, node.name)
 
+    def indexKeys(self):
+        return ('page tab',), self.tabName.literals()
+
     def describeSearchResult(self):
         return '%s tab' % (self.tabName)
 
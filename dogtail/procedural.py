@@ -18,7 +18,6 @@ __author__ = 'Zack Cerza <zcerza@redhat.com>'
 import tree
 import predicate
 from config import config
-from utils import Lock
 import rawinput
 
 #FocusError = "FocusError: %s not found"
@@ -435,17 +434,6 @@ def run(application, arguments='', appName=''):
     focus.application(application)
     return pid
 
-import os
-# tell sniff not to use auto-refresh while script using this module is running
-# may have already been locked by dogtail.tree
-if not os.path.exists('/tmp/sniff_refresh.lock'):  # pragma: no cover
-    sniff_lock = Lock(lockname='sniff_refresh.lock', randomize=False)
-    try:
-        sniff_lock.lock()
-    except OSError:
-        pass  # lock was already present from other script instance or leftover from killed instance
-    # lock should unlock automatically on script exit.
-
 focus = Focus()
 click = Click()
 activate = Action('activate')
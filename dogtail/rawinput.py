@@ -11,20 +11,25 @@ __author__ = """
 David Malcolm <dmalcolm@redhat.com>,
 Zack Cerza <zcerza@redhat.com>
 """
-import gi
-
-gi.require_version('Gtk', '3.0')
-gi.require_version('Gdk', '3.0')
-
-from gi.repository import Gdk
 from config import config
-from utils import doDelay
+from utils import doDelay, requireGtk
 from logging import debugLogger as logger
-from pyatspi import Registry as registry
-from pyatspi import (KEY_SYM, KEY_PRESS, KEY_PRESSRELEASE, KEY_RELEASE)
+from backend import pyatspi
 from exceptions import ValueError
 from __builtin__ import unicode, unichr
 
+registry = pyatspi.Registry
+
+
+def _gdk():
+    """
+    Returns the GDK bindings, which are only imported once some key needs
+    resolving since importing them is slow.
+    """
+    requireGtk()
+    from gi.repository import Gdk
+    return Gdk
+
 
 def doTypingDelay():
     doDelay(config.typingDelay)
@@ -149,7 +154,7 @@ keyNameAliases = {
 
 # TODO: Dead code
 def keySymToUniChar(keySym):  # pragma: no cover
-    i = Gdk.keyval_to_unicode(keySym)
+    i = _gdk().keyval_to_unicode(keySym)
     if i:
         UniChar = unichr(i)
     else:
@@ -162,16 +167,17 @@ def uniCharToKeySym(uniChar):
     if not isinstance(uniChar, unicode):
         uniChar = unicode(uniChar)
     i = ord(uniChar)
-    keySym = Gdk.unicode_to_keyval(i)
+    keySym = _gdk().unicode_to_keyval(i)
     return keySym
 
 
 # dead code
 def keySymToKeyName(keySym):  # pragma: no cover
-    return Gdk.keyval_name(keySym)
+    return _gdk().keyval_name(keySym)
 
 
 def keyNameToKeySym(keyName):
+    Gdk = _gdk()
     try:
         keyName = keyNameAliases.get(keyName.lower(), keyName)
         keySym = Gdk.keyval_from_name(keyName)
@@ -195,6 +201,7 @@ def keyNameToKeyCode(keyName):
     Generally you should use uniCharToKeySym() and should only need this
     function for nonprintable keys anyway.
     """
+    Gdk = _gdk()
     keymap = Gdk.Keymap.get_for_display(Gdk.Display.get_default())
     entries = keymap.get_entries_for_keyval(
         Gdk.keyval_from_name(keyName))
@@ -212,7 +219,7 @@ def pressKey(keyName):
     looked up by uniCharToKeySym().
     """
     keySym = keyNameToKeySym(keyName)
-    registry.generateKeyboardEvent(keySym, None, KEY_SYM)
+    registry.generateKeyboardEvent(keySym, None, pyatspi.KEY_SYM)
     doTypingDelay()
 
 
@@ -231,6 +238,7 @@ def keyCombo(comboString):
                 if S:
                     S = keyNameAliases.get(S.lower(), S)
                     strings.append(S)
+    Gdk = _gdk()
     for s in strings:
         if not hasattr(Gdk, s):
             if not hasattr(Gdk, 'KEY_' + s):
@@ -240,10 +248,10 @@ def keyCombo(comboString):
     for modifier in modifiers:
 
         code = keyNameToKeyCode(modifier)
-        registry.generateKeyboardEvent(code, None, KEY_PRESS)
+        registry.generateKeyboardEvent(code, None, pyatspi.KEY_PRESS)
     code = keyNameToKeyCode(finalKey)
-    registry.generateKeyboardEvent(code, None, KEY_PRESSRELEASE)
+    registry.generateKeyboardEvent(code, None, pyatspi.KEY_PRESSRELEASE)
     for modifier in modifiers:
         code = keyNameToKeyCode(modifier)
-        registry.generateKeyboardEvent(code, None, KEY_RELEASE)
+        registry.generateKeyboardEvent(code, None, pyatspi.KEY_RELEASE)
     doDelay()
@@ -0,0 +1,657 @@
+"""Compact binary snapshots of trees of Node objects.
+
+A snapshot records the names, roles, descriptions, states, extents, actions
+and relations of the nodes of a tree, with its structure, for analysing it
+offline:
+
+    from dogtail import snapshot
+    snapshot.write(tree.root, '/tmp/desktop.snapshot')
+    # or: tree.root.dump('snapshot', '/tmp/desktop.snapshot')
+
+    shot = snapshot.Snapshot('/tmp/desktop.snapshot')
+    shot.root.findChildren(predicate.GenericPredicate(roleName='push button'))
+
+All strings are stored once in a string table, and so are the distinct lists
+of actions and sets of states. Every node is a fixed-size record pointing
+into them and into arrays of child indexes and relations.
+Nodes are stored in document order, so the descendants of a node are the
+records that follow it up to its subtree end. Snapshot files are memory
+mapped and read lazily: opening one takes the same time whatever its size,
+and only the nodes and strings that get looked at are decoded.
+
+Snapshots can be viewed in sniff ('sniff /tmp/desktop.snapshot'), through
+Snapshot.toFake().
+"""
+
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from backend import pyatspi
+from config import config
+from logging import debugLogger as logger
+import dump
+import predicate
+from __builtin__ import file, unicode
+
+"""
+The first bytes of every snapshot file.
+"""
+MAGIC = 'DTSNAP\0\0'
+
+"""
+The version of the format written by this module.
+"""
+VERSION = 1
+
+# magic, version, node count, string count, then the offsets of the string
+# index, string data, node records, children, action lists, actions, state
+# sets, states and relations
+_header = struct.Struct('<8sIIIIIIIIIIII')
+
+# parent, role, name, description, flags, x, y, width, height, subtree end,
+# (start, count) in the children, action list, state set, then (start,
+# count) in the relations
+_record = struct.Struct('<iIIIIiiiiIIIIIII')
+
+_HAS_EXTENTS = 1
+
+_arrayType = [t for t in 'IL' if array(t).itemsize == 4][0]
+
+
+def _packArray(values):
+    values = array(_arrayType, values)
+    if sys.byteorder != 'little':  # pragma: no cover
+        values.byteswap()
+    return values.tostring()
+
+
+def _fetchRelations(node):
+    relations = []
+    for relation in node.getRelationSet():
+        targets = [relation.getTarget(i)
+                   for i in range(relation.getNTargets())]
+        relations.append((pyatspi.relationToString(
+            relation.getRelationType()).lower().replace('_', ' '), targets))
+    return relations
+
+_properties = ('roleName', 'name', 'description', 'states', 'extents',
+               'actions')
+
+
+def _collect(root, maxDepth=None, depth=0, deadline=None):
+    """
+    Reads the tree below root in document order, returning a list of
+    [parent index, values, child indexes, relations] records. The anchors
+    of the links in the text of a node are among its children, as in
+    dump.walk. If deadline passes, the records collected so far are
+    returned, with 'timedOut' set.
+    """
+    from tree import _readLinkAnchors
+    fetch = [(name, dump.fetchers[name]) for name in _properties]
+    records = []
+    indexes = {}
+    stack = [(root, -1, depth)]
+    timedOut = False
+    while stack:
+        if deadline is not None and time.time() > deadline:
+            timedOut = True
+            break
+        node, parentIndex, depth = stack.pop()
+        values = {}
+        for name, fetcher in fetch:
+            try:
+                values[name] = fetcher(node)
+            except Exception:
+                values[name] = None
+        try:
+            relations = _fetchRelations(node)
+        except Exception:
+            relations = []
+        index = len(records)
+        indexes[node] = index
+        records.append([parentIndex, values, [], relations])
+        if parentIndex >= 0:
+            records[parentIndex][2].append(index)
+        if maxDepth is not None and depth >= maxDepth:
+            continue
+        try:
+            childCount = node.childCount
+        except Exception:
+            continue
+        children = []
+        for i in range(childCount):
+            try:
+                child = node[i]
+            except Exception:
+                continue
+            if child is not None:
+                children.append((child, index, depth + 1))
+        children.extend((anchor, index, depth + 1)
+                        for anchor in _readLinkAnchors(node))
+        children.reverse()
+        stack.extend(children)
+    # Relations can only point to nodes of the snapshot
+    for record in records:
+        record[3] = [(name, [indexes[target] for target in targets
+                             if target in indexes])
+                     for name, targets in record[3]]
+    return records, timedOut
+
+
+def _collectDesktop(root, maxDepth, appTimeout):
+    """
+    Collects the desktop like _collect(), with each application read
+    concurrently within appTimeout seconds. Returns the records and the
+    names of the applications that ran out of time.
+    """
+    records = _collect(root, maxDepth=0)[0]
+    if maxDepth is not None and maxDepth < 1:
+        return records, []
+
+    def collect(application, deadline):
+        return _collect(application, maxDepth, 1, deadline)
+
+    applications, timedOut = dump.eachApplication(root, collect, appTimeout,
+                                                  'Snapshotting')
+    for application, applicationRecords in applications:
+        if not applicationRecords:
+            continue
+        offset = len(records)
+        records[0][2].append(offset)
+        for parentIndex, values, children, relations in applicationRecords:
+            records.append([
+                parentIndex >= 0 and parentIndex + offset or 0, values,
+                [child + offset for child in children],
+                [(name, [target + offset for target in targets])
+                 for name, targets in relations]])
+    return records, timedOut
+
+
+def write(node, fileName, maxDepth=None, appTimeout=None):
+    """
+    Writes a snapshot of the tree below node to fileName. maxDepth limits
+    how many levels below node are recorded.
+
+    A snapshot of the desktop reads the applications concurrently, each
+    within appTimeout seconds (config.dumpTimeout by default), like
+    dump.desktop(). The names of the applications that ran out of time are
+    returned.
+    """
+    timedOut = []
+    if node.getRoleName() == 'desktop frame':
+        if appTimeout is None:
+            appTimeout = config.dumpTimeout
+        records, timedOut = _collectDesktop(node, maxDepth, appTimeout)
+    else:
+        records = _collect(node, maxDepth)[0]
+
+    strings = {}
+    stringList = []
+
+    def stringId(value):
+        if value is None:
+            value = ''
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        try:
+            return strings[value]
+        except KeyError:
+            strings[value] = len(stringList)
+            stringList.append(value)
+            return strings[value]
+    stringId('')
+
+    # The descendants of a node run up to the subtree end of its last child
+    subtreeEnds = range(len(records))
+    for index in range(len(records) - 1, -1, -1):
+        children = records[index][2]
+        if children:
+            subtreeEnds[index] = subtreeEnds[children[-1]]
+
+    def tableId(table, entries, values, items):
+        """
+        Stores the list values once, as a (start, count) entry of entries
+        pointing into items; table maps the lists stored to their entries.
+        """
+        values = tuple(values or ())
+        try:
+            return table[values]
+        except KeyError:
+            table[values] = len(table)
+            entries.extend((len(items), len(values)))
+            for value in values:
+                if isinstance(value, tuple):
+                    items.extend([stringId(v) for v in value])
+                else:
+                    items.append(stringId(value))
+            return table[values]
+    actionLists = {}
+    actionListEntries = []
+    actions = []
+    stateSets = {}
+    stateSetEntries = []
+    states = []
+
+    nodeRecords = []
+    children = []
+    relations = []
+    for index, (parentIndex, values, childIndexes, nodeRelations) in \
+            enumerate(records):
+        extents = values['extents']
+        flags = extents and _HAS_EXTENTS or 0
+        x, y, width, height = extents or (0, 0, 0, 0)
+        relationTargets = [(name, target) for name, targets in nodeRelations
+                           for target in targets]
+        nodeRecords.append(_record.pack(
+            parentIndex, stringId(values['roleName']),
+            stringId(values['name']), stringId(values['description']),
+            flags, x, y, width, height, subtreeEnds[index],
+            len(children), len(childIndexes),
+            tableId(actionLists, actionListEntries, values['actions'],
+                    actions),
+            tableId(stateSets, stateSetEntries, values['states'], states),
+            len(relations) // 2, len(relationTargets)))
+        children.extend(childIndexes)
+        for name, target in relationTargets:
+            relations.extend((stringId(name), target))
+
+    stringOffsets = [0]
+    for value in stringList:
+        stringOffsets.append(stringOffsets[-1] + len(value))
+    sections = [_packArray(stringOffsets), ''.join(stringList),
+                ''.join(nodeRecords), _packArray(children),
+                _packArray(actionListEntries), _packArray(actions),
+                _packArray(stateSetEntries), _packArray(states),
+                _packArray(relations)]
+    offsets = []
+    position = _header.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    snapshotFile = file(fileName, 'wb', dump.bufferSize)
+    try:
+        snapshotFile.write(_header.pack(MAGIC, VERSION, len(records),
+                                        len(stringList), *offsets))
+        for section in sections:
+            snapshotFile.write(section)
+    finally:
+        snapshotFile.close()
+    return timedOut
+
+
+class SnapshotError(Exception):
+
+    """
+    The file is not a snapshot this version of dogtail can read.
+    """
+    pass
+
+
+class Snapshot(object):
+
+    """
+    A snapshot file, opened for reading. Its nodes are SnapshotNode
+    instances, starting with 'root'.
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        snapshotFile = file(fileName, 'rb')
+        try:
+            # mmap cannot map an empty file
+            size = os.fstat(snapshotFile.fileno()).st_size
+            if size < _header.size:
+                raise SnapshotError("%s is not a dogtail snapshot" % fileName)
+            self._map = mmap.mmap(snapshotFile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            snapshotFile.close()
+        try:
+            self._readHeader(size)
+        except SnapshotError:
+            self._map.close()
+            raise
+
+    def _readHeader(self, size):
+        fileName = self.fileName
+        header = _header.unpack_from(self._map)
+        (magic, version, self.nodeCount, self.stringCount,
+         self._stringIndex, self._stringData, self._nodes, self._children,
+         self._actionLists, self._actions, self._stateSets, self._states,
+         self._relations) = header
+        if magic != MAGIC:
+            raise SnapshotError("%s is not a dogtail snapshot" % fileName)
+        if version != VERSION:
+            raise SnapshotError("%s is a version %i snapshot" %
+                                (fileName, version))
+        # The sections follow each other up to the end of the file; the
+        # string index and the node records have a known size.
+        offsets = list(header[4:]) + [size]
+        if offsets[0] != _header.size or offsets != sorted(offsets) or \
+                self._stringData - self._stringIndex < \
+                4 * (self.stringCount + 1) or \
+                self._children - self._nodes < \
+                _record.size * self.nodeCount:
+            raise SnapshotError("%s is a truncated or damaged snapshot" %
+                                fileName)
+        self._strings = {}
+        self._actionListCache = {}
+        self._stateSetCache = {}
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self.nodeCount
+
+    def _string(self, stringId):
+        try:
+            return self._strings[stringId]
+        except KeyError:
+            start, end = struct.unpack_from(
+                '<II', self._map, self._stringIndex + 4 * stringId)
+            value = self._map[self._stringData + start:
+                              self._stringData + end]
+            self._strings[stringId] = value
+            return value
+
+    def _record(self, index):
+        if not 0 <= index < self.nodeCount:
+            raise IndexError(index)
+        return _record.unpack_from(self._map,
+                                   self._nodes + _record.size * index)
+
+    def _array(self, section, start, count):
+        return struct.unpack_from('<%iI' % count, self._map,
+                                  section + 4 * start)
+
+    def _actionList(self, listId):
+        try:
+            return self._actionListCache[listId]
+        except KeyError:
+            start, count = self._array(self._actionLists, 2 * listId, 2)
+            values = self._array(self._actions, start, 2 * count)
+            actions = tuple((self._string(values[i]),
+                             self._string(values[i + 1]))
+                            for i in range(0, len(values), 2))
+            self._actionListCache[listId] = actions
+            return actions
+
+    def _stateSet(self, setId):
+        try:
+            return self._stateSetCache[setId]
+        except KeyError:
+            start, count = self._array(self._stateSets, 2 * setId, 2)
+            states = frozenset(self._string(state) for state in
+                               self._array(self._states, start, count))
+            self._stateSetCache[setId] = states
+            return states
+
+    def node(self, index):
+        """
+        The node stored at the given index; the root is at index 0.
+        """
+        return SnapshotNode(self, index)
+
+    @property
+    def root(self):
+        """
+        The first node, or None if the snapshot is empty.
+        """
+        if self.nodeCount:
+            return self.node(0)
+
+    def nodes(self):
+        """
+        Iterates over all the nodes, in document order.
+        """
+        for index in xrange(self.nodeCount):
+            yield SnapshotNode(self, index)
+
+    def toFake(self):
+        """
+        Builds a dogtail.fakeatspi tree of the snapshot, e.g. to browse it
+        with sniff or to run searches on it through dogtail.tree, and returns
+        its root.
+        """
+        import fakeatspi
+        nodes = []
+        for node in self.nodes():
+            states = [state for state in node.states
+                      if state in fakeatspi.stateByName]
+            fake = fakeatspi.Accessible(node.name, node.roleName,
+                                        node.description, states,
+                                        extents=node.extents)
+            for actionName, keyBinding in node.actions.items():
+                fake.addAction(actionName, keyBinding=keyBinding)
+            if node.parent is not None:
+                nodes[node.parent.index].appendChild(fake)
+            nodes.append(fake)
+        for node in self.nodes():
+            for relationName, targets in node.relations.items():
+                relationType = fakeatspi.relationByName.get(relationName)
+                if relationType is None:
+                    continue
+                nodes[node.index]._relations[relationType] = \
+                    [nodes[target.index] for target in targets]
+        return nodes[0]
+
+
+class SnapshotNode(object):
+
+    """
+    A node of a Snapshot. It offers the read-only parts of the Node API
+    that the predicates use, and the search methods.
+    """
+
+    def __init__(self, snapshot, index):
+        self.snapshot = snapshot
+        self.index = index
+        self.__record = None
+
+    @property
+    def _recordData(self):
+        if self.__record is None:
+            self.__record = self.snapshot._record(self.index)
+        return self.__record
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotNode) and \
+            other.snapshot is self.snapshot and other.index == self.index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.snapshot), self.index))
+
+    def __str__(self):
+        return '[%s | %s]' % (self.roleName, self.name)
+
+    def __repr__(self):
+        return '<SnapshotNode %i %s>' % (self.index, self)
+
+    @property
+    def parent(self):
+        parent = self._recordData[0]
+        if parent < 0:
+            return None
+        return SnapshotNode(self.snapshot, parent)
+
+    @property
+    def roleName(self):
+        return self.snapshot._string(self._recordData[1])
+
+    def getRoleName(self):
+        return self.roleName
+
+    @property
+    def name(self):
+        return self.snapshot._string(self._recordData[2])
+
+    @property
+    def description(self):
+        return self.snapshot._string(self._recordData[3])
+
+    @property
+    def extents(self):
+        """
+        (x, y, width, height), or None if the node had no extents.
+        """
+        record = self._recordData
+        if not record[4] & _HAS_EXTENTS:
+            return None
+        return record[5:9]
+
+    @property
+    def position(self):
+        extents = self.extents
+        return extents and extents[:2]
+
+    @property
+    def size(self):
+        extents = self.extents
+        return extents and extents[2:]
+
+    @property
+    def childCount(self):
+        return self._recordData[11]
+
+    def __len__(self):
+        return self.childCount
+
+    def __nonzero__(self):
+        return True
+
+    def __getitem__(self, index):
+        childCount = self.childCount
+        if index < 0:
+            index += childCount
+        if not 0 <= index < childCount:
+            raise IndexError(index)
+        return SnapshotNode(self.snapshot, self.snapshot._array(
+            self.snapshot._children, self._recordData[10] + index, 1)[0])
+
+    @property
+    def children(self):
+        record = self._recordData
+        return [SnapshotNode(self.snapshot, index) for index in
+                self.snapshot._array(self.snapshot._children, record[10],
+                                     record[11])]
+
+    def __iter__(self):
+        return iter(self.children)
+
+    @property
+    def indexInParent(self):
+        parent = self.parent
+        if parent is None:
+            return -1
+        return parent.children.index(self)
+
+    @property
+    def actions(self):
+        """
+        A dictionary of the action names, with their key bindings as values.
+        """
+        return dict(self.snapshot._actionList(self._recordData[12]))
+
+    @property
+    def states(self):
+        """
+        The names of the states of the node, as a frozenset.
+        """
+        return self.snapshot._stateSet(self._recordData[13])
+
+    def __state(stateName):
+        return property(lambda self: stateName in self.states)
+    sensitive = __state('sensitive')
+    showing = __state('showing')
+    focusable = __state('focusable')
+    focused = __state('focused')
+    checked = __state('checked')
+
+    @property
+    def relations(self):
+        """
+        A dictionary of the relation names (e.g. 'labelled by'), with the
+        lists of their target nodes as values.
+        """
+        record = self._recordData
+        values = self.snapshot._array(self.snapshot._relations,
+                                      2 * record[14], 2 * record[15])
+        relations = {}
+        for i in range(0, len(values), 2):
+            relations.setdefault(self.snapshot._string(values[i]), []).append(
+                SnapshotNode(self.snapshot, values[i + 1]))
+        return relations
+
+    def __relation(self, relationName):
+        targets = self.relations.get(relationName)
+        if not targets:
+            return None
+        if len(targets) == 1:
+            return targets[0]
+        return targets
+
+    @property
+    def labeler(self):
+        return self.__relation('labelled by')
+    labeller = labeler
+
+    @property
+    def labelee(self):
+        return self.__relation('label for')
+    labellee = labelee
+
+    def _descendants(self, recursive=True):
+        if not recursive:
+            return self.children
+        return (SnapshotNode(self.snapshot, index) for index in
+                xrange(self.index + 1, self._recordData[9] + 1))
+
+    def findChildren(self, pred, recursive=True):
+        """
+        All the descendants (or children, if recursive is False) satisfying
+        the predicate, in document order.
+        """
+        if isinstance(pred, predicate.Predicate):
+            pred = pred.satisfiedByNode
+        result = []
+        for node in self._descendants(recursive):
+            try:
+                if pred(node):
+                    result.append(node)
+            except Exception:
+                pass
+        return result
+
+    def findChild(self, pred, recursive=True):
+        """
+        The first descendant (or child, if recursive is False) satisfying
+        the predicate, or None. Snapshots do not change, so there is no
+        retrying.
+        """
+        if isinstance(pred, predicate.Predicate):
+            pred = pred.satisfiedByNode
+        for node in self._descendants(recursive):
+            try:
+                if pred(node):
+                    return node
+            except Exception:
+                pass
+
+    def child(self, name='', roleName='', description='', label='',
+              recursive=True):
+        """
+        The first descendant satisfying the given criteria, or None.
+        """
+        return self.findChild(predicate.GenericPredicate(
+            name=name, roleName=roleName, description=description,
+            label=label), recursive)
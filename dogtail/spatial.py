@@ -0,0 +1,328 @@
+"""A spatial index of the nodes of a tree, to find them by position.
+
+Node.getChildAtPoint() asks the application which child is at a point, level
+after level, so finding the widgets under many points (say, the regions of a
+screenshot) costs thousands of round trips. A SpatialIndex reads the extents
+of all the nodes below a root once, files them in a grid of square cells,
+then answers locally:
+
+    from dogtail.spatial import SpatialIndex
+    index = SpatialIndex(gedit.window('Untitled'))
+    index.at(120, 45)                   # the deepest node at a point
+    index.overlapping(0, 0, 200, 100)   # the nodes meeting a rectangle
+    index.nearest(500, 20)              # the node closest to a point
+    index.close()
+
+While it is open, the index listens to the bounds-changed events of the
+application, and reads the extents of the nodes that moved again before the
+next query; after a children-changed event, it is built again. Meanwhile,
+getChildAtPoint() on its root uses it too.
+
+An index can also be built on the root of a recorded tree (see
+dogtail.diff.load()), which does not change.
+"""
+
+from backend import pyatspi
+from mirror import _pumpEvents
+
+"""
+The events keeping indexes current.
+"""
+eventTypes = ('object:bounds-changed', 'object:children-changed')
+
+"""
+The open indexes.
+"""
+indexes = []
+
+
+def lookup(node):
+    """
+    The open SpatialIndex built on node, or on another proxy of the same
+    accessible, or None.
+    """
+    for index in indexes:
+        if index.root == node:
+            return index
+
+
+def _usable(extents):
+    return extents is not None and extents[2] > 0 and extents[3] > 0
+
+
+def _contains(extents, x, y):
+    ex, ey, ew, eh = extents
+    return ex <= x < ex + ew and ey <= y < ey + eh
+
+
+def _distance(extents, x, y):
+    ex, ey, ew, eh = extents
+    dx = max(ex - x, 0, x - (ex + ew - 1))
+    dy = max(ey - y, 0, y - (ey + eh - 1))
+    return (dx * dx + dy * dy) ** 0.5
+
+
+class SpatialIndex(object):
+
+    """
+    An index of the extents of root and its descendants, in cells of
+    cellSize pixels. root is a live Node, whose index starts listening to
+    events right away unless start is False, or the root of a recorded
+    tree. The index is kept until close() is called; it can also be used
+    as a context manager.
+    """
+
+    """
+    The most cells a node is filed in. Larger nodes, like the contents of a
+    scrolled viewport, are kept aside and looked at by every query.
+    """
+    maxCells = 1024
+
+    def __init__(self, root, cellSize=64, start=True, threads=8):
+        self.root = root
+        self.cellSize = cellSize
+        self.threads = threads
+        self.live = hasattr(root, 'queryComponent')
+        self.running = False
+        self.build()
+        if start and self.live:
+            self.start()
+
+    def _walk(self):
+        import tree
+        nodes = []
+        depths = []
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes.append(node)
+            depths.append(depth)
+            if self.live:
+                try:
+                    children = tree._readChildren(node)
+                except Exception:
+                    children = []
+            else:
+                children = node.children
+            stack.extend([(child, depth + 1) for child in reversed(children)])
+        return nodes, depths
+
+    def _readExtents(self, nodes):
+        if not self.live:
+            return [node.extents for node in nodes]
+        import tree
+
+        def readExtents(node):
+            try:
+                return node.extents
+            except Exception:
+                return None
+        return tree._concurrently(readExtents, nodes, self.threads)
+
+    def build(self):
+        """
+        Reads the tree and its extents, and files them again.
+        """
+        nodes, depths = self._walk()
+        # By entry: the node, its depth, and its extents or None
+        self.nodes = nodes
+        self.depths = depths
+        self.extents = self._readExtents(nodes)
+        self.entries = dict((node, entry) for entry, node in enumerate(nodes))
+        self.cells = {}
+        self.oversized = set()
+        for entry, extents in enumerate(self.extents):
+            self._file(entry, extents)
+        self.moved = set()
+        self.stale = False
+
+    def _cellSpan(self, x, y, width, height):
+        size = self.cellSize
+        columns = (x + width - 1) // size - x // size + 1
+        rows = (y + height - 1) // size - y // size + 1
+        return columns * rows
+
+    def _cellRange(self, x, y, width, height):
+        size = self.cellSize
+        for cx in xrange(x // size, (x + width - 1) // size + 1):
+            for cy in xrange(y // size, (y + height - 1) // size + 1):
+                yield (cx, cy)
+
+    def _file(self, entry, extents):
+        if not _usable(extents):
+            return
+        if self._cellSpan(*extents) > self.maxCells:
+            self.oversized.add(entry)
+            return
+        for cell in self._cellRange(*extents):
+            self.cells.setdefault(cell, []).append(entry)
+
+    def _unfile(self, entry, extents):
+        if not _usable(extents):
+            return
+        if entry in self.oversized:
+            self.oversized.remove(entry)
+            return
+        for cell in self._cellRange(*extents):
+            self.cells[cell].remove(entry)
+
+    def start(self):
+        """
+        Starts listening to events and answering getChildAtPoint() on the
+        root.
+        """
+        if self.running:
+            return
+        pyatspi.Registry.registerEventListener(self._onEvent, *eventTypes)
+        indexes.append(self)
+        self.running = True
+
+    def close(self):
+        """
+        Stops listening to events and answering getChildAtPoint().
+        """
+        if not self.running:
+            return
+        pyatspi.Registry.deregisterEventListener(self._onEvent, *eventTypes)
+        indexes.remove(self)
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def _onEvent(self, event):
+        if event.source not in self.entries:
+            return
+        if event.type.major == 'children-changed':
+            self.stale = True
+        else:
+            self.moved.add(event.source)
+
+    def _update(self):
+        if self.running:
+            _pumpEvents()
+        if self.stale:
+            self.build()
+            return
+        moved = self.moved
+        if not moved:
+            return
+        self.moved = set()
+        entries = [self.entries[node] for node in moved]
+        for entry, extents in zip(entries, self._readExtents(
+                [self.nodes[entry] for entry in entries])):
+            self._unfile(entry, self.extents[entry])
+            self.extents[entry] = extents
+            self._file(entry, extents)
+
+    def _candidates(self, x, y, width=1, height=1):
+        entries = set(self.oversized)
+        if self._cellSpan(x, y, width, height) > len(self.cells):
+            # Fewer cells are filled than the rectangle covers
+            for cell, cellEntries in self.cells.iteritems():
+                if x // self.cellSize <= cell[0] <= \
+                        (x + width - 1) // self.cellSize and \
+                        y // self.cellSize <= cell[1] <= \
+                        (y + height - 1) // self.cellSize:
+                    entries.update(cellEntries)
+            return entries
+        for cell in self._cellRange(x, y, width, height):
+            entries.update(self.cells.get(cell, ()))
+        return entries
+
+    def nodesAt(self, x, y):
+        """
+        The nodes whose extents contain the point, the deepest first.
+        """
+        self._update()
+        entries = [entry for entry in self._candidates(x, y)
+                   if _contains(self.extents[entry], x, y)]
+        entries.sort(key=lambda entry: (self.depths[entry], entry),
+                     reverse=True)
+        return [self.nodes[entry] for entry in entries]
+
+    def at(self, x, y):
+        """
+        The deepest node whose extents contain the point (the last one in
+        document order, if several are), or None.
+        """
+        nodes = self.nodesAt(x, y)
+        if nodes:
+            return nodes[0]
+
+    def overlapping(self, x, y, width, height):
+        """
+        The nodes whose extents overlap the rectangle, in document order.
+        """
+        self._update()
+        if width <= 0 or height <= 0:
+            return []
+        found = []
+        for entry in sorted(self._candidates(x, y, width, height)):
+            ex, ey, ew, eh = self.extents[entry]
+            if ex < x + width and x < ex + ew and \
+                    ey < y + height and y < ey + eh:
+                found.append(self.nodes[entry])
+        return found
+
+    def nearest(self, x, y, maxDistance=None):
+        """
+        The node whose extents are the closest to the point (the deepest,
+        among those containing it), or None if none is within maxDistance
+        pixels.
+        """
+        self._update()
+        best = self._closest(None, self.oversized, x, y)
+        size = self.cellSize
+        cx, cy = x // size, y // size
+        reach = -1
+        if self.cells:
+            columns = [cell[0] for cell in self.cells]
+            rows = [cell[1] for cell in self.cells]
+            reach = max(abs(cx - min(columns)), abs(cx - max(columns)),
+                        abs(cy - min(rows)), abs(cy - max(rows)))
+        for ring in xrange(reach + 1):
+            # The cells of this ring are at least this far
+            if best is not None and best[0] <= (ring - 1) * size:
+                break
+            if maxDistance is not None and maxDistance < (ring - 1) * size:
+                break
+            if 8 * ring > len(self.cells):
+                # The rings are getting larger than what is left to see, if
+                # far away nodes stretch the grid: look at it all at once.
+                for cell, entries in self.cells.iteritems():
+                    if max(abs(cell[0] - cx), abs(cell[1] - cy)) >= ring:
+                        best = self._closest(best, entries, x, y)
+                break
+            for cell in self._ring(cx, cy, ring):
+                best = self._closest(best, self.cells.get(cell, ()), x, y)
+        if best is None or maxDistance is not None and best[0] > maxDistance:
+            return None
+        return self.nodes[-best[2]]
+
+    def _closest(self, best, entries, x, y):
+        # Candidates are compared by distance, then depth and entry
+        for entry in entries:
+            candidate = (_distance(self.extents[entry], x, y),
+                         -self.depths[entry], -entry)
+            if best is None or candidate < best:
+                best = candidate
+        return best
+
+    def _ring(self, cx, cy, ring):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
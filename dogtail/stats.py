@@ -0,0 +1,174 @@
+"""Statistics about searches in the tree.
+
+Every search made through Node.findChild() or Node.findChildren() collects a
+SearchStatistics instance. The statistics of a successful findChild() are
+available as the 'searchStats' attribute of the node it returned; a failed
+one attaches them to the SearchError it raises as 'stats'.
+
+All searches are also accumulated in 'searchReport', which can be printed at
+any time or logged automatically when the script exits by setting
+config.logSearchReport. Searches visiting many nodes to find something on
+the first attempt are good candidates for being made non-recursive or for
+being anchored lower in the tree.
+"""
+
+import atexit
+from config import config
+from logging import debugLogger as logger
+
+
+class SearchStatistics(object):
+
+    """
+    Statistics about a single (possibly retried) search.
+
+    nodesVisited (int):
+    The number of nodes the traversal reached, over all attempts.
+
+    maxDepth (int):
+    The deepest level below the search root that was reached; direct
+    children are at depth 1.
+
+    predicateEvaluations (int):
+    How many times the predicate was evaluated.
+
+    remoteCalls (int):
+    The calls the traversal itself made to enumerate children (child counts
+    and child lookups). Properties read by the predicate are not included.
+
+    attempts (int):
+    The number of attempts made.
+
+    traversalTime (float):
+    Seconds spent walking the tree.
+
+    sleepTime (float):
+    Seconds spent sleeping between attempts.
+
+    found (boolean):
+    Whether the search succeeded.
+    """
+
+    def __init__(self, description, recursive=True):
+        self.description = description
+        self.recursive = recursive
+        self.nodesVisited = 0
+        self.maxDepth = 0
+        self.predicateEvaluations = 0
+        self.remoteCalls = 0
+        self.attempts = 0
+        self.traversalTime = 0.0
+        self.sleepTime = 0.0
+        self.found = False
+
+    @property
+    def firstAttemptHit(self):
+        """Did the search succeed on its first attempt?"""
+        return self.found and self.attempts == 1
+
+    def __str__(self):
+        return "[search stats | %s | %s after %i attempt(s), %i nodes, " \
+            "depth %i, %i predicate evaluations, %i remote calls, " \
+            "%.3fs traversing, %.3fs sleeping ]" % \
+            (self.description, self.found and "found" or "not found",
+             self.attempts, self.nodesVisited, self.maxDepth,
+             self.predicateEvaluations, self.remoteCalls,
+             self.traversalTime, self.sleepTime)
+
+
+class SearchTotals(object):
+
+    """
+    Accumulated statistics of all the searches sharing one description.
+    """
+
+    def __init__(self, description):
+        self.description = description
+        self.searches = 0
+        self.failures = 0
+        self.firstAttemptHits = 0
+        self.attempts = 0
+        self.nodesVisited = 0
+        self.maxDepth = 0
+        self.predicateEvaluations = 0
+        self.remoteCalls = 0
+        self.traversalTime = 0.0
+        self.sleepTime = 0.0
+
+    def add(self, stats):
+        self.searches += 1
+        if not stats.found:
+            self.failures += 1
+        if stats.firstAttemptHit:
+            self.firstAttemptHits += 1
+        self.attempts += stats.attempts
+        self.nodesVisited += stats.nodesVisited
+        self.maxDepth = max(self.maxDepth, stats.maxDepth)
+        self.predicateEvaluations += stats.predicateEvaluations
+        self.remoteCalls += stats.remoteCalls
+        self.traversalTime += stats.traversalTime
+        self.sleepTime += stats.sleepTime
+
+
+class SearchReport(object):
+
+    """
+    Aggregates SearchStatistics per search description, for a whole script.
+    """
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, stats):
+        try:
+            totals = self.totals[stats.description]
+        except KeyError:
+            totals = self.totals[stats.description] = \
+                SearchTotals(stats.description)
+        totals.add(stats)
+
+    def reset(self):
+        """
+        Forgets all the searches recorded so far.
+        """
+        self.totals = {}
+
+    def sorted(self):
+        """
+        The accumulated totals, the most expensive searches first.
+        """
+        return sorted(self.totals.values(),
+                      key=lambda t: (t.traversalTime + t.sleepTime,
+                                     t.nodesVisited),
+                      reverse=True)
+
+    def __str__(self):
+        lines = ["Search report: %i distinct searches" % len(self.totals)]
+        for t in self.sorted():
+            lines.append(
+                "  %s: %i searches (%i failed, %i first-attempt hits), "
+                "%i attempts, %i nodes (%.1f per search), max depth %i, "
+                "%i predicate evaluations, %i remote calls, "
+                "%.3fs traversing, %.3fs sleeping" %
+                (t.description, t.searches, t.failures, t.firstAttemptHits,
+                 t.attempts, t.nodesVisited,
+                 float(t.nodesVisited) / t.searches, t.maxDepth,
+                 t.predicateEvaluations, t.remoteCalls,
+                 t.traversalTime, t.sleepTime))
+        return '\n'.join(lines)
+
+    def log(self):
+        """
+        Writes the report to the debug log.
+        """
+        logger.log(str(self))
+
+
+searchReport = SearchReport()
+
+
+def _logSearchReportAtExit():
+    if config.logSearchReport and searchReport.totals:
+        searchReport.log()
+
+atexit.register(_logSearchReportAtExit)
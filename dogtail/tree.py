@@ -61,44 +61,44 @@ David Malcolm <dmalcolm@redhat.com>
 """
 
 from config import config
-if config.checkForA11y:
-    from utils import checkForA11y
-    checkForA11y()
-
 import predicate
-from time import sleep
+from time import sleep, time
 from utils import doDelay
 from utils import Blinker
-from utils import Lock
+from utils import lockSniffRefresh
+from utils import checkForA11yOnce
 import rawinput
 import path
+import mirror
+import spatial
+import events
+from dump import stateName
+from i18n import TranslatableString
+from stats import SearchStatistics, searchReport
 from __builtin__ import xrange
+from contextlib import contextmanager
+import threading
+import Queue
+import atexit
 
 from logging import debugLogger as logger
 
-try:
-    import pyatspi
-    import Accessibility
-except ImportError:  # pragma: no cover
-    raise ImportError("Error importing the AT-SPI bindings")
-
-# We optionally import the bindings for libWnck.
-try:
-    from gi.repository import Wnck
-    gotWnck = True  # pragma: no cover
-except ImportError:
-    # Skip this warning, since the functionality is almost entirely nonworking anyway.
-    # print "Warning: Dogtail could not import the Python bindings for
-    # libwnck. Window-manager manipulation will not be available."
-    gotWnck = False
-
-from gi.repository import GLib
+from backend import pyatspi, Accessibility, accessibleKey, RemoteError
+import weakref
 
 haveWarnedAboutChildrenLimit = False
 
 
 class SearchError(Exception):
-    pass
+
+    """
+    A search failed. If it was made by Node.findChild(), 'stats' holds the
+    stats.SearchStatistics describing it.
+    """
+
+    def __init__(self, message, stats=None):
+        Exception.__init__(self, message)
+        self.stats = stats
 
 
 class NotSensitiveError(Exception):
@@ -147,14 +147,17 @@ class Action(object):
              'open',
              'menu')
 
-    def __init__(self, node, action, index):
+    def __init__(self, node, action, index, name=None):
         self.node = node
         self.__action = action
         self.__index = index
+        self.__name = name
 
     @property
     def name(self):
-        return self.__action.getName(self.__index)
+        if self.__name is None:
+            self.__name = self.__action.getName(self.__index)
+        return self.__name
 
     @property
     def description(self):
@@ -172,13 +175,19 @@ class Action(object):
         """
         Performs the given tree.Action, with appropriate delays and logging.
         """
-        logger.log("%s on %s" % (self.name, self.node.getLogString()))
-        if not self.node.sensitive:
-            if config.ensureSensitivity:
-                raise NotSensitiveError(self)
-            else:
-                nSE = NotSensitiveError(self)
-                logger.log("Warning: " + str(nSE))
+        checkForA11yOnce()
+        lockSniffRefresh()
+        with searchPathScope():
+            logger.log("%s on %s" % (self.name, self.node.getLogString()))
+            states = self.node.states
+            if 'defunct' in states:
+                self.node._forgetActions()
+            if not states.sensitive:
+                if config.ensureSensitivity:
+                    raise NotSensitiveError(self)
+                else:
+                    nSE = NotSensitiveError(self)
+                    logger.log("Warning: " + str(nSE))
         if config.blinkOnActions:
             self.node.blink()
         result = self.__action.doAction(self.__index)
@@ -186,6 +195,328 @@ class Action(object):
         return result
 
 
+class States(frozenset):
+
+    """
+    The names of the states of a node, as fetched at once by Node.states,
+    e.g. 'sensitive' or 'multi line'. The common ones are also boolean
+    attributes, so that several of them can be checked on one fetch.
+    """
+
+    def __state(stateName):
+        return property(lambda self: stateName in self)
+    sensitive = __state('sensitive')
+    showing = __state('showing')
+    focusable = __state('focusable')
+    focused = __state('focused')
+    checked = __state('checked')
+    del __state
+
+
+class Properties(dict):
+
+    """
+    The properties of a node fetched at once by Node.fetch() or
+    fetchMany(), by name; they can also be read as attributes.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _fetchers(names):
+    import dump
+    fetchers = dict(dump.fetchers)
+    fetchers['states'] = lambda node: node.states
+    fetchers['actions'] = lambda node: dict(dump.fetchers['actions'](node))
+    fetchers['childCount'] = lambda node: node.childCount
+    unknown = [name for name in names if name not in fetchers]
+    if unknown:
+        raise ValueError("Unknown properties: %s" % ', '.join(unknown))
+    return [(name, fetchers[name]) for name in names]
+
+
+def _fetch(node, fetchers):
+    properties = Properties()
+    for name, fetcher in fetchers:
+        properties[name] = fetcher(node)
+    return properties
+
+
+"""
+The number of threads of the pool shared by all the concurrent reads.
+"""
+poolThreads = 16
+
+_pool = None
+_poolLock = threading.Lock()
+_poolWorker = threading.local()
+
+
+def _threadPool():
+    """
+    The thread pool shared by all the concurrent reads, created on first use
+    and closed at exit.
+    """
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(poolThreads)
+            atexit.register(_closeThreadPool)
+        return _pool
+
+
+def _closeThreadPool():
+    global _pool
+    with _poolLock:
+        pool = _pool
+        _pool = None
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def _submit(function, *args):
+    """
+    Starts function(*args) on the shared pool, returning its
+    multiprocessing.pool.AsyncResult.
+    """
+    return _threadPool().apply_async(function, args)
+
+
+def _runChunk(function, chunk):
+    _poolWorker.active = True
+    try:
+        return [function(item) for item in chunk]
+    finally:
+        _poolWorker.active = False
+
+
+def _concurrently(function, items, threads):
+    """
+    map() run by up to the given number of threads (and at most
+    poolThreads) of the shared pool, for work that mostly waits for
+    applications to answer. Work done by the pool's own threads is not
+    dispatched again, but done right away.
+    """
+    items = list(items)
+    threads = min(threads, len(items))
+    if threads <= 1 or getattr(_poolWorker, 'active', False):
+        return [function(item) for item in items]
+    # One chunk of consecutive items per thread
+    size = -(-len(items) // threads)
+    chunks = [items[first:first + size]
+              for first in xrange(0, len(items), size)]
+    result = []
+    for values in _threadPool().map(lambda chunk: _runChunk(function, chunk),
+                                    chunks):
+        result.extend(values)
+    return result
+
+
+"""
+The Node standing for each accessible, by key, while it is in use.
+"""
+_internedNodes = weakref.WeakValueDictionary()
+
+
+def internNode(node):
+    """
+    The one Node object kept for the accessible node stands for (see
+    Node.key): node itself, unless another proxy of the same accessible was
+    interned before and is still in use. What is kept in the user_data of
+    nodes, like their debugName, is then shared by the nodes searches find.
+    """
+    key = node.key
+    interned = _internedNodes.get(key)
+    if interned is None:
+        _internedNodes[key] = interned = node
+    return interned
+
+
+_searchPathMemo = threading.local()
+
+
+@contextmanager
+def searchPathScope():
+    """
+    Within this context, what the search paths of nodes are made of (see
+    Node.getAbsoluteSearchPath()) is read once per node and shared, e.g.
+    between the paths of siblings: useful when logging many nodes with
+    config.absoluteNodePaths. The tree is assumed not to change meanwhile.
+    Each call of getAbsoluteSearchPath() runs in such a scope.
+    """
+    if getattr(_searchPathMemo, 'values', None) is not None:
+        yield
+        return
+    _searchPathMemo.values = {}
+    try:
+        yield
+    finally:
+        _searchPathMemo.values = None
+
+
+def _memoized(kind, node, compute):
+    values = getattr(_searchPathMemo, 'values', None)
+    if values is None:
+        return compute()
+    key = (kind, node)
+    try:
+        return values[key]
+    except KeyError:
+        value = values[key] = compute()
+        return value
+
+
+def _readChildren(node):
+    """
+    The children of node that can be read, like Node.children but with no
+    limit on their number.
+    """
+    children = []
+    for index in xrange(node.childCount):
+        # Workaround for GNOME bugs #465103 and #321273, as in Node.children
+        try:
+            child = node[index]
+        except LookupError:
+            child = None
+        if child:
+            children.append(child)
+    children.extend(_readLinkAnchors(node))
+    return children
+
+
+def _readLinkAnchors(node):
+    """
+    The anchors of the links in the text of node (see Node.linkAnchors),
+    which the walks of the tree count among its children, unless
+    config.includeLinkAnchors is False.
+    """
+    if not config.includeLinkAnchors:
+        return []
+    try:
+        return list(LinkAnchors(node))
+    except (NotImplementedError, RemoteError, LookupError):
+        return []
+
+
+def _visibleStrings(node, showingOnly, maxDepth=None):
+    """
+    Yields the (node key, string, kind) tuples of
+    Node.iterUserVisibleStrings() for node and its descendants (down to
+    maxDepth levels below it), depth-first. Nodes that cannot be read are
+    skipped with their subtrees.
+    """
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        try:
+            if showingOnly and not node.states.showing:
+                continue
+            key = node.key
+            name = node.name
+            description = node.description
+            if maxDepth is None or depth < maxDepth:
+                children = _readChildren(node)
+            else:
+                children = []
+        except Exception:
+            continue
+        if name:
+            yield (key, name, 'name')
+        if description:
+            yield (key, description, 'description')
+        stack.extend([(child, depth + 1) for child in reversed(children)])
+
+
+def _cellText(cell):
+    """
+    The text shown by a table cell: its name, or its text if it has none.
+    """
+    name = cell.name
+    if name:
+        return name
+    try:
+        return cell.queryText().getText(0, -1)
+    except NotImplementedError:
+        return name
+
+
+class ChildrenView(object):
+
+    """
+    A lazy view of the children of a node (see Node.childrenView), which
+    can be indexed, sliced, iterated over and measured with len() like a
+    list. Unlike Node.children, config.childrenLimit does not apply: the
+    children are fetched a page of pageSize at a time, concurrently by up
+    to the given number of threads of the pool shared by all the concurrent
+    reads, and only the pages that are used are fetched.
+
+    The number of children is read once, and the pages fetched are kept;
+    take a new view to see later changes. A child that cannot be read is
+    None when indexed, and is skipped by slices and iteration.
+    """
+
+    def __init__(self, node, pageSize=100, threads=8):
+        self.node = node
+        self.pageSize = pageSize
+        self.threads = threads
+        self.__count = None
+        self.__pages = {}
+
+    def __len__(self):
+        if self.__count is None:
+            try:
+                self.__count = self.node.childCount
+            except Exception:
+                self.__count = 0
+        return self.__count
+
+    def __readChild(self, index):
+        # Workaround for GNOME bugs #465103 and #321273, as in Node.children
+        try:
+            return self.node[index]
+        except LookupError:
+            return None
+
+    def __page(self, number):
+        try:
+            return self.__pages[number]
+        except KeyError:
+            first = number * self.pageSize
+            indexes = xrange(first, min(first + self.pageSize, len(self)))
+            page = self.__pages[number] = _concurrently(
+                self.__readChild, indexes, self.threads)
+            return page
+
+    def __child(self, index):
+        return self.__page(index // self.pageSize)[index % self.pageSize]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            children = [self.__child(i)
+                        for i in xrange(*index.indices(len(self)))]
+            return [child for child in children if child is not None]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.__child(index)
+
+    def __iter__(self):
+        for number in xrange((len(self) + self.pageSize - 1) // self.pageSize):
+            for child in self.__page(number):
+                if child is not None:
+                    yield child
+
+    def __repr__(self):
+        return '<ChildrenView of %s: %i children>' % (self.node, len(self))
+
+
 class Node(object):
 
     """
@@ -214,6 +545,38 @@ class Node(object):
 
         return property(**locals())
     debugName = debugName()
+
+    @property
+    def searchStats(self):
+        """
+        The stats.SearchStatistics of the findChild() call that returned this
+        node, or None.
+        """
+        self.__setupUserData()
+        return self.user_data.get('searchStats', None)
+
+    @property
+    def key(self):
+        """
+        A key identifying the accessible: the bus name of its application
+        and its object path, as held by the proxy, so that reading it makes
+        no remote call. Nodes compare and hash by it, so that they make
+        cheap dict keys, whichever proxy stands for them.
+        """
+        return accessibleKey(self)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Node):
+            return False
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
     #
     # Accessible
     #
@@ -234,7 +597,12 @@ class Node(object):
 
     @property
     def children(self):
-        """a list of this Accessible's children"""
+        """
+        a list of this Accessible's children, up to config.childrenLimit of
+        them; see childrenView for containers with more children. The
+        anchors of the links in its text (see linkAnchors) come last, unless
+        config.includeLinkAnchors is False.
+        """
         if self.parent and self.parent.roleName == 'hyper link':
             print(self.parent.role)
             return []
@@ -262,24 +630,18 @@ class Node(object):
         if invalidChildren and config.debugSearching:
             logger.log("Skipped %s invalid children of %s" %
                        (invalidChildren, str(self)))
-        try:
-            ht = self.queryHypertext()
-            for li in range(ht.getNLinks()):
-                link = ht.getLink(li)
-                for ai in range(link.nAnchors):
-                    child = link.getObject(ai)
-                    child.__setupUserData()
-                    child.user_data['linkAnchor'] = \
-                        LinkAnchor(node=child,
-                                   hypertext=ht,
-                                   linkIndex=li,
-                                   anchorIndex=ai)
-                    children.append(child)
-        except NotImplementedError:
-            pass
-
+        children.extend(_readLinkAnchors(self))
         return children
 
+    @property
+    def childrenView(self):
+        """
+        A lazy view (a ChildrenView) of all the children of this Accessible,
+        fetched in pages as they are used, e.g.
+        node.childrenView[1000:1100]. Link anchors are not included.
+        """
+        return ChildrenView(self)
+
     roleName = property(Accessibility.Accessible.getRoleName)
 
     role = property(Accessibility.Accessible.getRole)
@@ -290,17 +652,51 @@ class Node(object):
     # Action
     #
 
+    def _actionIndexes(self, refresh=False):
+        """
+        The Action interface of this node (or None) and the indexes of its
+        actions by name. They are queried once, then kept until refresh is
+        True or the node is found defunct.
+        """
+        self.__setupUserData()
+        cached = self.user_data.get('actionIndexes')
+        if cached is None or refresh:
+            indexes = {}
+            try:
+                action = self.queryAction()
+                for i in range(action.nActions):
+                    indexes[action.getName(i)] = i
+            except Exception:
+                action = None
+            cached = self.user_data['actionIndexes'] = (action, indexes)
+        return cached
+
+    def _forgetActions(self):
+        self.__setupUserData()
+        self.user_data.pop('actionIndexes', None)
+
     # Needed to be renamed from doAction due to conflicts
     # with 'Accessibility.Accessible.doAction' in gtk3 branch
     def doActionNamed(self, name):
         """
         Perform the action with the specified name. For a list of actions
         supported by this instance, check the 'actions' property.
+
+        The action is looked up in the actions of this node known from a
+        previous call; they are only queried again if it is not there.
         """
-        actions = self.actions
-        if name in actions:
-            return actions[name].do()
-        raise ActionNotSupported(name, self)
+        action, indexes = self._actionIndexes()
+        if name not in indexes:
+            action, indexes = self._actionIndexes(refresh=True)
+        if name not in indexes:
+            raise ActionNotSupported(name, self)
+        try:
+            return Action(self, action, indexes[name], name).do()
+        except NotSensitiveError:
+            raise
+        except Exception:
+            self._forgetActions()
+            raise
 
     @property
     def actions(self):
@@ -311,14 +707,9 @@ class Node(object):
         'click' 'press' 'release' 'activate' 'jump' 'check' 'dock' 'undock'
         'open' 'menu'
         """
-        actions = {}
-        try:
-            action = self.queryAction()
-            for i in range(action.nActions):
-                a = Action(self, action, i)
-                actions[action.getName(i)] = a
-        finally:
-            return actions
+        action, indexes = self._actionIndexes()
+        return dict((name, Action(self, action, index, name))
+                    for name, index in indexes.items())
 
     def combovalue():
         doc = "The value (as a string) currently selected in the combo box."
@@ -338,6 +729,14 @@ class Node(object):
     # Hypertext and Hyperlink
     #
 
+    @property
+    def linkAnchors(self):
+        """
+        A lazy view (a LinkAnchors) of the anchors of the links in the text
+        of this Accessible, read as they are used.
+        """
+        return LinkAnchors(self)
+
     @property
     def URI(self):
         try:
@@ -426,6 +825,14 @@ class Node(object):
             return False
 
     def getChildAtPoint(self, x, y):
+        """
+        The deepest node below this one (or this one) at the point, or None.
+        If a dogtail.spatial.SpatialIndex is open on this node, it is asked
+        rather than the application.
+        """
+        index = spatial.lookup(self)
+        if index is not None:
+            return index.at(x, y)
         node = self
         while True:
             try:
@@ -536,34 +943,117 @@ class Node(object):
     # StateSet
     #
     @property
+    def states(self):
+        """
+        The names of the states of the Accessible (a States frozenset), from
+        a single fetch of its state set.
+        """
+        return States(stateName(state) for state in
+                      self.getState().getStates())
+
+    def fetch(self, *names):
+        """
+        Fetches the given properties at once, returning a Properties record:
+        any of 'roleName', 'name', 'description', 'states' (as Node.states),
+        'actions' (a dict of the key bindings by action name), 'extents'
+        ((x, y, width, height), or None), 'text' (or None) and 'childCount'.
+
+        The properties are read one after the other, each with a single
+        call (two for 'actions' and 'extents', which query their interface
+        first); see fetchMany() to read the properties of many nodes
+        concurrently.
+        """
+        return _fetch(self, _fetchers(names))
+
+    # Each of these reads the state set once, like Node.states; to test
+    # several of them, read node.states once and test its attributes.
+    @property
     def sensitive(self):
         """Is the Accessible sensitive (i.e. not greyed out)?"""
-        return self.getState().contains(pyatspi.STATE_SENSITIVE)
+        return self.states.sensitive
 
     @property
     def showing(self):
-        return self.getState().contains(pyatspi.STATE_SHOWING)
+        return self.states.showing
 
     @property
     def focusable(self):
         """Is the Accessible capable of having keyboard focus?"""
-        return self.getState().contains(pyatspi.STATE_FOCUSABLE)
+        return self.states.focusable
 
     @property
     def focused(self):
         """Does the Accessible have keyboard focus?"""
-        return self.getState().contains(pyatspi.STATE_FOCUSED)
+        return self.states.focused
 
     @property
     def checked(self):
         """Is the Accessible a checked checkbox?"""
-        return self.getState().contains(pyatspi.STATE_CHECKED)
+        return self.states.checked
 
     @property
     def isChecked(self):
         """Is the Accessible a checked checkbox? Compatibility property, same as Node.checked."""
         return self.checked
 
+    #
+    # Waiting (see dogtail.events)
+    #
+
+    def waitFor(self, state='sensitive', timeout=None, present=True):
+        """
+        Waits until the Accessible has the given state (e.g. 'showing'), or
+        no longer has it if present is False, waking up on its state-changed
+        events. Returns whether it happened within timeout seconds (see
+        events.waitUntil() for the default).
+        """
+        state = state.replace('-', ' ')
+        return events.waitUntil(
+            lambda: (state in self.states) == present,
+            ('object:state-changed',), [self], timeout)
+
+    def waitForName(self, pattern, timeout=None):
+        """
+        Waits until the name of the Accessible matches pattern, as searches
+        match names. Returns whether it did within timeout seconds.
+        """
+        pattern = TranslatableString(pattern)
+        return events.waitUntil(
+            lambda: pattern.matchedBy(self.name),
+            ('object:property-change:accessible-name',), [self], timeout)
+
+    def waitForText(self, pattern, timeout=None):
+        """
+        Waits until the text of the Accessible matches pattern, as searches
+        match names. Returns whether it did within timeout seconds.
+        """
+        pattern = TranslatableString(pattern)
+        return events.waitUntil(
+            lambda: pattern.matchedBy(self.text or ''),
+            ('object:text-changed',), [self], timeout)
+
+    def waitUntilGone(self, timeout=None):
+        """
+        Waits until the Accessible is defunct or removed from the tree,
+        waking up on the children-changed events of its ancestors. Returns
+        whether it was gone within timeout seconds.
+        """
+        sources = [self]
+        try:
+            node = self.parent
+            while node is not None:
+                sources.append(node)
+                node = node.parent
+        except Exception:
+            pass
+
+        def gone():
+            return self.dead or self.parent is None
+
+        return events.waitUntil(
+            gone, ('object:children-changed:remove',
+                   'object:state-changed:defunct'), sources, timeout)
+
     #
     # Selection
     #
@@ -623,6 +1113,90 @@ class Node(object):
         for i in xrange(selection.nSelectedChildren):
             selectedChildren.append(selection.getSelectedChild(i))
 
+    #
+    # Table
+    #
+    # These go through the table's own indexing rather than enumerating
+    # its children, so they work on tables of any size.
+
+    def columnIndex(self, header):
+        """
+        The index of the column of the table whose header (its description,
+        or the name of its header node) matches header, which is translated
+        and may be a regular expression like in searches. SearchError is
+        raised if there is no such column.
+        """
+        table = self.queryTable()
+        header = TranslatableString(header)
+        for column in xrange(table.nColumns):
+            try:
+                description = table.getColumnDescription(column)
+            except Exception:
+                description = None
+            if description and header.matchedBy(description):
+                return column
+            try:
+                headerNode = table.getColumnHeader(column)
+            except Exception:
+                headerNode = None
+            if headerNode is not None and header.matchedBy(headerNode.name):
+                return column
+        raise SearchError("column '%s' of %s" % (header, self.getLogString()))
+
+    def _column(self, column):
+        if isinstance(column, basestring):
+            return self.columnIndex(column)
+        return column
+
+    def cellAt(self, row, column):
+        """
+        The cell of the table at the given row and column, given by its
+        index or header (see columnIndex()).
+        """
+        return self.queryTable().getAccessibleAt(row, self._column(column))
+
+    def readRows(self, start=0, count=None, columns=None, threads=8):
+        """
+        The texts of the cells (their names, or their text if they have no
+        name) of count rows of the table from start on, or of all the
+        remaining rows, as a list of lists. columns restricts it to the
+        given columns (indexes or headers).
+
+        The rows are read concurrently, see fetchMany().
+        """
+        table = self.queryTable()
+        if columns is None:
+            columns = range(table.nColumns)
+        else:
+            columns = [self._column(column) for column in columns]
+        nRows = table.nRows
+        if count is None or start + count > nRows:
+            count = max(0, nRows - start)
+
+        def readRow(row):
+            return [_cellText(table.getAccessibleAt(row, column))
+                    for column in columns]
+        return _concurrently(readRow, xrange(start, start + count), threads)
+
+    def rowWhere(self, column, value, start=0, threads=8):
+        """
+        The index of the first row of the table, from start on, whose cell
+        in column (an index or header) has the given text, or None. Only
+        that column is read, a batch of rows at a time.
+        """
+        table = self.queryTable()
+        column = self._column(column)
+        nRows = table.nRows
+        batch = max(1, threads) * 8
+        for first in xrange(start, nRows, batch):
+            rows = xrange(first, min(first + batch, nRows))
+            texts = _concurrently(
+                lambda row: _cellText(table.getAccessibleAt(row, column)),
+                rows, threads)
+            for row, text in zip(rows, texts):
+                if text == value:
+                    return row
+
     #
     # Value
     #
@@ -673,8 +1247,9 @@ class Node(object):
         """
         logger.log("Typing text into %s: '%s'" % (self.getLogString(), string))
 
-        if self.focusable:
-            if not self.focused:
+        states = self.states
+        if states.focusable:
+            if not states.focused:
                 try:
                     self.grabFocus()
                 except Exception:
@@ -691,8 +1266,9 @@ class Node(object):
         if config.debugSearching:
             logger.log("Pressing keys '%s' into %s" %
                        (comboString, self.getLogString()))
-        if self.focusable:
-            if not self.focused:
+        states = self.states
+        if states.focusable:
+            if not states.focused:
                 try:
                     self.grabFocus()
                 except Exception:
@@ -719,10 +1295,30 @@ class Node(object):
         assert isinstance(pred, predicate.Predicate)
         return pred.satisfiedByNode(self)
 
-    def dump(self, type='plain', fileName=None):
+    def dump(self, type='plain', fileName=None, maxDepth=None, roleNames=None,
+             properties=None):
+        """
+        Dumps the tree below this node to fileName (or standard output), as
+        'plain' text, 'json' lines or 'xml', or to a binary 'snapshot' file
+        (see dogtail.snapshot). See dogtail.dump for the other arguments.
+        The applications of the desktop are dumped concurrently, each within
+        config.dumpTimeout seconds (see dump.desktop()).
+        """
         import dump
-        dumper = getattr(dump, type)
-        dumper(self, fileName)
+        try:
+            dumper = dump.dumpers[type]
+        except KeyError:
+            raise ValueError("Unknown dump type: %s" % type)
+        if properties is None:
+            properties = dump.defaultProperties
+        if self.roleName == 'desktop frame' and type != 'snapshot':
+            # Dump the applications concurrently
+            dump.desktop(type, fileName, maxDepth=maxDepth,
+                         roleNames=roleNames, properties=properties,
+                         root=self)
+        else:
+            dumper(self, fileName, maxDepth=maxDepth, roleNames=roleNames,
+                   properties=properties)
 
     def getAbsoluteSearchPath(self):
         """
@@ -743,25 +1339,32 @@ class Node(object):
         FIXME: need some heuristics to get 'good' searches, whatever
         that means
         """
-        if config.debugSearchPaths:
-            logger.log("getAbsoluteSearchPath(%s)" % self)
-
-        if self.roleName == 'application':
+        with searchPathScope():
             result = path.SearchPath()
-            result.append(predicate.IsAnApplicationNamed(self.name), False)
+            for pred, isRecursive in self.__searchSteps():
+                result.append(pred, isRecursive)
             return result
-        else:
-            if self.parent:
+
+    def __searchSteps(self):
+        """
+        The (predicate, isRecursive) pairs of getAbsoluteSearchPath(), as a
+        tuple shared with the paths of the nodes below this one.
+        """
+        def compute():
+            if config.debugSearchPaths:
+                logger.log("getAbsoluteSearchPath(%s)" % self)
+
+            if self.roleName == 'application':
+                return ((predicate.IsAnApplicationNamed(self.name), False),)
+            elif self.parent:
                 (ancestor, pred, isRecursive) = self.getRelativeSearch()
                 if config.debugSearchPaths:
                     logger.log("got ancestor: %s" % ancestor)
-
-                ancestorPath = ancestor.getAbsoluteSearchPath()
-                ancestorPath.append(pred, isRecursive)
-                return ancestorPath
+                return ancestor.__searchSteps() + ((pred, isRecursive),)
             else:
                 # This should be the root node:
-                return path.SearchPath()
+                return ()
+        return _memoized('searchSteps', self, compute)
 
     def getRelativeSearch(self):
         """
@@ -771,71 +1374,205 @@ class Node(object):
         FIXME: may need to make this more robust
         FIXME: should this be private?
         """
+        return _memoized('relativeSearch', self, self.__relativeSearch)
+
+    def __relativeSearch(self):
         if config.debugSearchPaths:
             logger.log("getRelativeSearchPath(%s)" % self)
 
         assert self
         assert self.parent
 
-        isRecursive = False
-        ancestor = self.parent
-
-        # iterate up ancestors until you reach an identifiable one,
-        # setting the search to be isRecursive if need be:
-        while not self.__nodeIsIdentifiable(ancestor):
-            ancestor = ancestor.parent
-            isRecursive = True
+        (ancestor, isRecursive) = self.__identifiableAncestor()
 
         # Pick the most appropriate predicate for finding this node:
         if self.labellee:
             if self.labellee.name:
                 return (ancestor, predicate.IsLabelledAs(self.labellee.name), isRecursive)
 
-        if self.roleName == 'menu':
-            return (ancestor, predicate.IsAMenuNamed(self.name), isRecursive)
-        elif self.roleName == 'menu item' or self.roleName == 'check menu item':
-            return (ancestor, predicate.IsAMenuItemNamed(self.name), isRecursive)
-        elif self.roleName == 'text':
-            return (ancestor, predicate.IsATextEntryNamed(self.name), isRecursive)
-        elif self.roleName == 'push button':
-            return (ancestor, predicate.IsAButtonNamed(self.name), isRecursive)
-        elif self.roleName == 'frame':
-            return (ancestor, predicate.IsAWindowNamed(self.name), isRecursive)
-        elif self.roleName == 'dialog':
-            return (ancestor, predicate.IsADialogNamed(self.name), isRecursive)
+        roleName = self.roleName
+        name = self.name
+        if roleName == 'menu':
+            return (ancestor, predicate.IsAMenuNamed(name), isRecursive)
+        elif roleName == 'menu item' or roleName == 'check menu item':
+            return (ancestor, predicate.IsAMenuItemNamed(name), isRecursive)
+        elif roleName == 'text':
+            return (ancestor, predicate.IsATextEntryNamed(name), isRecursive)
+        elif roleName == 'push button':
+            return (ancestor, predicate.IsAButtonNamed(name), isRecursive)
+        elif roleName == 'frame':
+            return (ancestor, predicate.IsAWindowNamed(name), isRecursive)
+        elif roleName == 'dialog':
+            return (ancestor, predicate.IsADialogNamed(name), isRecursive)
         else:
-            pred = predicate.GenericPredicate(
-                name=self.name, roleName=self.roleName)
+            pred = predicate.GenericPredicate(name=name, roleName=roleName)
             return (ancestor, pred, isRecursive)
 
-    def __nodeIsIdentifiable(self, ancestor):
-        if ancestor.labellee:
-            return True
-        elif ancestor.name:
-            return True
-        elif not ancestor.parent:
-            return True
+    def __identifiableAncestor(self):
+        """
+        The nearest identifiable ancestor, and whether it is further up than
+        the parent. The ancestors it is found through share the answer.
+        """
+        values = getattr(_searchPathMemo, 'values', None)
+        if values is None:
+            values = {}
+        walked = []
+        node = self
+        while ('ancestor', node) not in values:
+            walked.append(node)
+            parent = node.parent
+            if parent.__nodeIsIdentifiable():
+                (ancestor, isRecursive) = (parent, False)
+                break
+            node = parent
         else:
-            return False
+            (ancestor, isRecursive) = values[('ancestor', node)]
+            isRecursive = True
+        for node in reversed(walked):
+            values[('ancestor', node)] = (ancestor, isRecursive)
+            isRecursive = True
+        return values[('ancestor', self)]
+
+    def __nodeIsIdentifiable(self):
+        def compute():
+            if self.labellee:
+                return True
+            elif self.name:
+                return True
+            elif not self.parent:
+                return True
+            else:
+                return False
+        return _memoized('identifiable', self, compute)
 
-    def _fastFindChild(self, pred, recursive=True):
+    def _descendants(self, recursive=True, stats=None):
         """
-        Searches for an Accessible using methods from pyatspi.utils
+        Iterate over the descendants of this node, depth-first and in
+        document order, or only over its children if recursive is False.
+
+        Children that cannot be read are skipped. If stats (a
+        stats.SearchStatistics) is given, the nodes visited, the depth
+        reached and the calls made to enumerate children are counted in it.
+        """
+        # Each entry is [node, index of the next child, childCount, depth]
+        stack = [[self, 0, None, 0]]
+        while stack:
+            entry = stack[-1]
+            node, index, childCount, depth = entry
+            if childCount is None:
+                try:
+                    childCount = node.childCount
+                except RemoteError:
+                    childCount = 0
+                entry[2] = childCount
+                if stats:
+                    stats.remoteCalls += 1
+            if index >= childCount:
+                stack.pop()
+                continue
+            entry[1] = index + 1
+            try:
+                child = node[index]
+            except (RemoteError, LookupError):
+                child = None
+            if stats:
+                stats.remoteCalls += 1
+            if child is None:
+                continue
+            if stats:
+                stats.nodesVisited += 1
+                if depth + 1 > stats.maxDepth:
+                    stats.maxDepth = depth + 1
+            yield child
+            if recursive:
+                stack.append([child, 0, None, depth + 1])
+
+    def _labelled(self, label, recursive=True, stats=None):
+        """
+        Lists, in document order, the descendants (or children, if recursive
+        is False) of this node that one of them is a label for, when the
+        name of that label matches label (a TranslatableString).
+
+        Rather than reading the relations of every node, like asking each of
+        them for its labeller does, one pass over the nodes reads the role
+        names and then the relations of the matching labels only.
+        """
+        positions = {}
+        targets = []
+        for position, node in enumerate(self._descendants(recursive, stats)):
+            positions[node] = position
+            try:
+                if node.roleName != 'label' or not label.matchedBy(node.name):
+                    continue
+                labellee = node.labellee
+            except (RemoteError, LookupError):
+                continue
+            if isinstance(labellee, list):
+                targets.extend(labellee)
+            elif labellee is not None:
+                targets.append(labellee)
+        targets = [target for target in set(targets) if target in positions]
+        targets.sort(key=positions.get)
+        return targets
+
+    def _satisfying(self, pred, nodes, first, stats):
+        """
+        The nodes satisfying pred (a function taking a node), or only the
+        first one if first is True. Nodes that pred cannot read, e.g.
+        defunct ones, do not satisfy it; other errors are pred's own, and
+        are raised.
+        """
+        result = []
+        for node in nodes:
+            if stats:
+                stats.predicateEvaluations += 1
+            try:
+                if pred(node):
+                    result.append(node)
+                    if first:
+                        break
+            except (RemoteError, LookupError):
+                pass
+        return result
+
+    def _searchOnce(self, pred, recursive, first, stats):
+        """
+        Searches once for the descendants (or children, if recursive is
+        False) satisfying pred, returning a list of them, or of the first
+        one only if first is True.
+
+        For a Predicate about labels, the nodes a matching label below this
+        one is a label for are tried first. Only if none of them satisfies
+        pred are all the nodes tried, since a node may also be labelled
+        through its own relations, or by a label elsewhere.
         """
         if isinstance(pred, predicate.Predicate):
+            label = pred.requiredLabel()
             pred = pred.satisfiedByNode
-        if not recursive:
-            cIter = iter(self)
-            while True:
-                try:
-                    child = cIter.next()
-                except StopIteration:
-                    break
-                if child is not None:
-                    if pred(child):
-                        return child
-        else:
-            return pyatspi.utils.findDescendant(self, pred)
+            if label is not None:
+                result = self._satisfying(
+                    pred, self._labelled(label, recursive, stats), first,
+                    stats)
+                if result:
+                    return result
+        return self._satisfying(pred, self._descendants(recursive, stats),
+                                first, stats)
+
+    def _fastFindChild(self, pred, recursive=True, stats=None):
+        """
+        Searches once for a descendant (or child, if recursive is False)
+        satisfying pred, returning it or None.
+        """
+        result = self._searchOnce(pred, recursive, True, stats)
+        if result:
+            return result[0]
+
+    def _fastFindChildren(self, pred, recursive=True, stats=None):
+        """
+        Searches once for all the descendants (or children, if recursive is
+        False) satisfying pred, returning a list.
+        """
+        return self._searchOnce(pred, recursive, False, stats)
 
     def findChild(self, pred, recursive=True, debugName=None,
                   retry=True, requireResult=True):
@@ -850,6 +1587,12 @@ class Node(object):
 
         If requireResult is True (the default), an exception is raised after all
         attempts have failed. If it is false, the function simply returns None.
+
+        Statistics about the search are attached to the result as
+        'searchStats', or to the SearchError as 'stats'.
+
+        Below an application with an open dogtail.mirror.LiveMirror, the
+        mirror is searched instead of the live tree.
         """
         def describeSearch(parent, pred, recursive, debugName):
             """
@@ -864,20 +1607,27 @@ class Node(object):
             return "%s of %s: %s" % (noun, parent.getLogString(), debugName)
 
         assert isinstance(pred, predicate.Predicate)
+        checkForA11yOnce()
+        lockSniffRefresh()
+        stats = SearchStatistics(debugName or pred.describeSearchResult(),
+                                 recursive)
         numAttempts = 0
+        result = None
         while numAttempts < config.searchCutoffCount:
             if numAttempts >= config.searchWarningThreshold or config.debugSearching:
                 logger.log("searching for %s (attempt %i)" %
                            (describeSearch(self, pred, recursive, debugName), numAttempts))
 
-            result = self._fastFindChild(pred.satisfiedByNode, recursive)
+            stats.attempts += 1
+            start = time()
+            liveMirror = mirror.lookup(self)
+            if liveMirror is not None:
+                result = liveMirror.findChild(self, pred, recursive, stats)
+            else:
+                result = self._fastFindChild(pred, recursive, stats)
+            stats.traversalTime += time() - start
             if result:
-                assert isinstance(result, Node)
-                if debugName:
-                    result.debugName = debugName
-                else:
-                    result.debugName = pred.describeSearchResult()
-                return result
+                break
             else:
                 if not retry:
                     break
@@ -885,37 +1635,55 @@ class Node(object):
                 if config.debugSearching or config.debugSleep:
                     logger.log("sleeping for %f" %
                                config.searchBackoffDuration)
+                start = time()
                 sleep(config.searchBackoffDuration)
+                stats.sleepTime += time() - start
+        stats.found = bool(result)
+        searchReport.add(stats)
+        if config.debugSearching:
+            logger.log(str(stats))
+        if result:
+            assert isinstance(result, Node)
+            result = internNode(result)
+            if debugName:
+                result.debugName = debugName
+            else:
+                result.debugName = pred.describeSearchResult()
+            result.__setupUserData()
+            result.user_data['searchStats'] = stats
+            return result
         if requireResult:
-            raise SearchError(describeSearch(self, pred, recursive, debugName))
+            raise SearchError(describeSearch(self, pred, recursive, debugName),
+                              stats)
 
     # The canonical "search for multiple" method:
     def findChildren(self, pred, recursive=True):
         """
         Find all children/descendents satisfying the predicate.
+
+        Below an application with an open dogtail.mirror.LiveMirror, the
+        mirror is searched instead of the live tree.
         """
+        checkForA11yOnce()
+        lockSniffRefresh()
         if isinstance(pred, predicate.Predicate):
-            pred = pred.satisfiedByNode
-        if not recursive:
-            cIter = iter(self)
-            result = []
-            while True:
-                try:
-                    child = cIter.next()
-                except StopIteration:
-                    break
-                if child is not None and pred(child):
-                    result.append(child)
-            return result
+            stats = SearchStatistics(pred.describeSearchResult(), recursive)
         else:
-            descendants = []
-            while True:
-                try:
-                    descendants = pyatspi.utils.findAllDescendants(self, pred)
-                    break
-                except GLib.GError:
-                    continue
-            return descendants
+            stats = SearchStatistics(getattr(pred, '__name__', str(pred)),
+                                     recursive)
+        stats.attempts = 1
+        start = time()
+        liveMirror = mirror.lookup(self)
+        if liveMirror is not None:
+            result = liveMirror.findChildren(self, pred, recursive, stats)
+        else:
+            result = self._fastFindChildren(pred, recursive, stats)
+        stats.traversalTime = time() - start
+        stats.found = bool(result)
+        searchReport.add(stats)
+        if config.debugSearching:
+            logger.log(str(stats))
+        return [internNode(node) for node in result]
 
     # The canonical "search above this node" method:
     def findAncestor(self, pred):
@@ -1040,18 +1808,85 @@ class Node(object):
 
         (Could be implemented as an attribute)
         """
-        result = []
-        if self.name:
-            result.append(self.name)
-        if self.description:
-            result.append(self.description)
-        try:
-            children = self.children
-        except Exception:
-            return result
+        return [string for key, string, kind in
+                self.iterUserVisibleStrings(unique=False)]
+
+    def iterUserVisibleStrings(self, showingOnly=False, unique=True,
+                               threads=1):
+        """
+        Iterates over the user-visible strings of this node and its
+        descendents, depth-first, as (node key, string, kind) tuples, where
+        kind is 'name' or 'description' (see Node.key).
+
+        If showingOnly is True, the nodes that are not showing are skipped,
+        with their subtrees. If unique is True, each string is only produced
+        the first time it is met. With threads above 1, the subtrees of the
+        children of this node (the windows of an application) are walked by
+        up to that many threads of the shared pool (see poolThreads) at once;
+        the strings of each subtree then come in order, but interleaved with
+        those of the others.
+        """
+        seen = set()
+        if threads > 1:
+            strings = self.__concurrentVisibleStrings(showingOnly, threads)
+        else:
+            strings = _visibleStrings(self, showingOnly)
+        for item in strings:
+            if unique:
+                if item[1] in seen:
+                    continue
+                seen.add(item[1])
+            yield item
+
+    def __concurrentVisibleStrings(self, showingOnly, threads):
+        # The strings of this node, then of its children's subtrees as the
+        # threads find them
+        for item in _visibleStrings(self, showingOnly, maxDepth=0):
+            yield item
+        if showingOnly and not self.states.showing:
+            return
+        children = _readChildren(self)
+        workers = min(threads, poolThreads, len(children))
+        if workers <= 1 or getattr(_poolWorker, 'active', False):
+            # Work given by the pool's own threads is done right away
+            for child in children:
+                for item in _visibleStrings(child, showingOnly):
+                    yield item
+            return
+        results = Queue.Queue()
+        subtrees = Queue.Queue()
         for child in children:
-            result.extend(child.getUserVisibleStrings())
-        return result
+            subtrees.put(child)
+        stopped = threading.Event()
+
+        def work():
+            _poolWorker.active = True
+            try:
+                while not stopped.is_set():
+                    try:
+                        child = subtrees.get_nowait()
+                    except Queue.Empty:
+                        return
+                    for item in _visibleStrings(child, showingOnly):
+                        if stopped.is_set():
+                            return
+                        results.put(item)
+            finally:
+                _poolWorker.active = False
+                results.put(None)
+
+        for i in range(workers):
+            _submit(work)
+        try:
+            while workers:
+                item = results.get()
+                if item is None:
+                    workers -= 1
+                else:
+                    yield item
+        finally:
+            # Free the pool's threads if the strings are no longer wanted
+            stopped.set()
 
     def blink(self):
         """
@@ -1087,6 +1922,92 @@ class LinkAnchor(object):
         return self.link.getURI(self.anchorIndex)
 
 
+class LinkAnchors(object):
+
+    """
+    The anchors of the links in the text of a node, as a read-only sequence
+    of nodes, each with its LinkAnchor in user_data['linkAnchor'] (hence its
+    URI). Nothing is read until the view is used; the links are then read
+    one at a time as far as needed, and each anchor node is set up when it
+    is first returned. A node without the Hypertext interface has none.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.__hypertext = None
+        self.__nLinks = None
+        # (link index, anchor index) of each anchor of the links read so far
+        self.__positions = []
+        self.__links = []
+        self.__anchors = {}
+
+    def __readHypertext(self):
+        if self.__nLinks is None:
+            try:
+                self.__hypertext = self.node.queryHypertext()
+                self.__nLinks = self.__hypertext.getNLinks()
+            except NotImplementedError:
+                self.__nLinks = 0
+
+    def __readLinks(self, count=None):
+        """
+        Reads links until at least count anchors are known, or all of them.
+        """
+        self.__readHypertext()
+        while len(self.__links) < self.__nLinks and \
+                (count is None or len(self.__positions) < count):
+            linkIndex = len(self.__links)
+            link = self.__hypertext.getLink(linkIndex)
+            for anchorIndex in range(link.nAnchors):
+                self.__positions.append((linkIndex, anchorIndex))
+            self.__links.append(link)
+
+    def __anchor(self, index):
+        if index not in self.__anchors:
+            linkIndex, anchorIndex = self.__positions[index]
+            child = self.__links[linkIndex].getObject(anchorIndex)
+            try:
+                len(child.user_data)
+            except (AttributeError, TypeError):
+                child.user_data = {}
+            child.user_data['linkAnchor'] = \
+                LinkAnchor(node=child, hypertext=self.__hypertext,
+                           linkIndex=linkIndex, anchorIndex=anchorIndex)
+            self.__anchors[index] = child
+        return self.__anchors[index]
+
+    def __len__(self):
+        self.__readLinks()
+        return len(self.__positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        else:
+            self.__readLinks(index + 1)
+        if not 0 <= index < len(self.__positions):
+            raise IndexError(index)
+        return self.__anchor(index)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            self.__readLinks(index + 1)
+            if index >= len(self.__positions):
+                return
+            yield self.__anchor(index)
+            index += 1
+
+    def __nonzero__(self):
+        self.__readLinks(1)
+        return bool(self.__positions)
+
+    def __repr__(self):
+        return '<LinkAnchors of %s>' % self.node
+
+
 class Root (Node):
 
     """
@@ -1143,8 +2064,7 @@ class Application (Node):
         result = self.findChild(
             predicate.IsAWindowNamed(windowName=windowName), recursive)
         # FIXME: activate the WnckWindow ?
-        # if gotWnck:
-        #       result.activate()
+        # result.activate()
         return result
 
     def getWnckApplication(self):  # pragma: no cover
@@ -1170,6 +2090,8 @@ class Window (Node):
         """
         Get the wnck.Window instance for this window, or None
         """
+        # The bindings for libWnck are optional, and slow to import:
+        from gi.repository import Wnck
         # FIXME: this probably needs rewriting:
         screen = Wnck.screen_get_default()
 
@@ -1269,6 +2191,31 @@ class Wizard (Window):
 
         # FIXME: debug logging?
 
+"""
+The number of nodes below which fetchMany() does not dispatch them to the
+thread pool, which costs more than the round trips it saves.
+"""
+fetchManySerialLimit = 4
+
+
+def fetchMany(nodes, names, threads=8):
+    """
+    Fetches the given properties (see Node.fetch()) of all the nodes,
+    returning a list of Properties records in the same order.
+
+    The properties of each node are read one after the other, as by
+    Node.fetch(), but the nodes are read concurrently through
+    _concurrently(), by up to the given number of threads of the pool
+    shared by all the concurrent reads, since each call mostly waits for an
+    application to answer. Fewer than fetchManySerialLimit nodes are read
+    in the calling thread instead.
+    """
+    fetchers = _fetchers(names)
+    nodes = list(nodes)
+    if len(nodes) < fetchManySerialLimit:
+        threads = 1
+    return _concurrently(lambda node: _fetch(node, fetchers), nodes, threads)
+
 Accessibility.Accessible.__bases__ = (
     Application, Root, Node,) + Accessibility.Accessible.__bases__
 
@@ -1280,26 +2227,13 @@ except Exception:  # pragma: no cover
     logger.log(
         "Error: AT-SPI's desktop is not visible. Do you have accessibility enabled?")
 
-# Check that there are applications running. Warn if none are.
-children = root.children
-if not children:  # pragma: no cover
+# Check that there are applications running, if asked to. Warn if none are.
+if config.checkForApplications and not root.childCount:  # pragma: no cover
     logger.log(
         "Warning: AT-SPI's desktop is visible but it has no children. Are you running any AT-SPI-aware applications?")
-del children
-
-import os
-# sniff also imports from tree and we don't want to run this code from
-# sniff itself
-if not os.path.exists('/tmp/sniff_running.lock'):
-    if not os.path.exists('/tmp/sniff_refresh.lock'):  # may have already been locked by dogtail.procedural
-        # tell sniff not to use auto-refresh while script using this module is
-        # running
-        sniff_lock = Lock(lockname='sniff_refresh.lock', randomize=False)
-        try:
-            sniff_lock.lock()
-        except OSError:  # pragma: no cover
-            pass  # lock was already present from other script instance or leftover from killed instance
-        # lock should unlock automatically on script exit.
+
+# sniff is told not to auto-refresh (see utils.lockSniffRefresh()) on the
+# first search or action rather than here.
 
 # Convenient place to set some debug variables:
 #config.debugSearching = True
@@ -12,18 +12,14 @@ David Malcolm <dmalcolm@redhat.com>
 
 import os
 import sys
+import atexit
 import subprocess
-import cairo
 import predicate
 import errno
+import weakref
 
-import gi
-gi.require_version('Gtk', '3.0')
-gi.require_version('Gdk', '3.0')
-
-from gi.repository import Gtk
-from gi.repository import GObject
 from config import config
+from backend import RemoteError
 from time import sleep
 from logging import debugLogger as logger
 from logging import TimeStamp
@@ -59,6 +55,7 @@ def screenshot(file='screenshot.png', timeStamp=True):
         newFile = baseName + '.' + fileExt
         path = config.scratchDir + newFile
 
+    requireGtk()
     from gi.repository import Gdk
     from gi.repository import GObject
     from gi.repository import GdkPixbuf
@@ -84,11 +81,123 @@ def screenshot(file='screenshot.png', timeStamp=True):
     return path
 
 
+"""
+The applications run() found, by process id and by name. The entry for a
+process id is used again, as long as its application is still there with
+the process id it had.
+"""
+applications = {}
+
+# The process ids of the applications seen on the desktop, for as long as
+# their nodes are in use and not found defunct
+_processIds = weakref.WeakKeyDictionary()
+
+
+def _processId(application):
+    # Failures are not kept, the application may answer next time
+    if application not in _processIds:
+        try:
+            _processIds[application] = application.get_process_id()
+        except Exception:
+            return None
+    return _processIds[application]
+
+
+def _forgetApplication(application):
+    """
+    Drops what is known of an application found defunct or changed.
+    """
+    _processIds.pop(application, None)
+    for key, value in applications.items():
+        if value is application:
+            del applications[key]
+
+
+def _knownApplication(pid):
+    """
+    The application found before for process pid, if it still answers with
+    the process id it had then; or None.
+    """
+    application = applications.get(pid)
+    if application is None:
+        return None
+    try:
+        unchanged = application.get_process_id() == _processId(application)
+    except RemoteError:
+        unchanged = False
+    if not unchanged:
+        _forgetApplication(application)
+        return None
+    return application
+
+
+def _hasFrame(application):
+    try:
+        childCount = application.childCount
+    except RemoteError:
+        _forgetApplication(application)
+        return False
+    for index in range(childCount):
+        try:
+            if application[index].roleName == 'frame':
+                return True
+        except (RemoteError, LookupError):
+            continue
+    return False
+
+
+def _findApplication(desktop, pid, appName, started=None):
+    """
+    The application started as process pid, or else the last one named
+    appName (as for applications started by a wrapper script), once it has
+    a frame; or None. The one found before for pid is checked first. started
+    is what _startedApplications() gives, if it was called already.
+    """
+    application = _knownApplication(pid)
+    if application is not None:
+        return application
+    if started is None:
+        started = _startedApplications(desktop, pid, appName)
+    for application in started:
+        if _hasFrame(application):
+            applications[pid] = applications[appName] = application
+            return application
+
+
+def _startedApplications(desktop, pid, appName):
+    """
+    The applications on the desktop which may be the one started as process
+    pid: those with that process id, or else the last one named appName.
+    """
+    started = []
+    for index in reversed(range(desktop.childCount)):
+        try:
+            child = desktop[index]
+        except (RemoteError, LookupError):
+            continue
+        if child is not None and _processId(child) == pid:
+            started.append(child)
+    if not started:
+        for index in reversed(range(desktop.childCount)):
+            try:
+                child = desktop[index]
+                if child is not None and child.name == appName:
+                    started.append(child)
+                    break
+            except (RemoteError, LookupError):
+                continue
+    return started
+
+
 def run(string, timeout=config.runTimeout, interval=config.runInterval, desktop=None, dumb=False, appName=''):
     """
     Runs an application. [For simple command execution such as 'rm *', use os.popen() or os.system()]
-    If dumb is omitted or is False, polls at interval seconds until the application is finished starting, or until timeout is reached.
+    If dumb is omitted or is False, waits until the application is finished starting - it has a frame -, or until timeout is reached.
     If dumb is True, returns when timeout is reached.
+
+    The application is recognized by its process id, or else by its name
+    (appName, by default the command run). It is looked for again each time
+    an application registers or opens a window, and every interval seconds.
     """
     if not desktop:
         from tree import root as desktop
@@ -105,22 +214,36 @@ def run(string, timeout=config.runTimeout, interval=config.runInterval, desktop=
         doDelay(timeout)
     else:
         # Startup detection code
-        # The timing here is not totally precise, but it's good enough for now.
-        time = 0
-        while time < timeout:
-            time = time + interval
-            try:
-                for child in desktop.children[::-1]:
-                    if child.name == appName:
-                        for grandchild in child.children:
-                            if grandchild.roleName == 'frame':
-                                from procedural import focus
-                                focus.application.node = child
-                                doDelay(interval)
-                                return pid
-            except AttributeError:  # pragma: no cover
-                pass
-            doDelay(interval)
+        checkForA11yOnce()
+        import events
+        found = []
+        candidates = []
+
+        def started():
+            application = _knownApplication(pid)
+            if application is None:
+                candidates[:] = _startedApplications(desktop, pid, appName)
+                application = _findApplication(desktop, pid, appName,
+                                               candidates)
+            if application is not None:
+                found.append(application)
+            return found
+
+        def relevant(event):
+            # Applications registering change the children of the desktop,
+            # and the started one its own when it adds its frame; the
+            # children of other nodes do not matter.
+            if not event.type.startswith('object:children-changed') or \
+                    event.source == desktop:
+                return True
+            return event.source in candidates
+
+        if events.waitUntil(started, ('object:children-changed',
+                                      'window:create', 'window:activate'),
+                            timeout=timeout, interval=interval,
+                            accept=relevant):
+            from procedural import focus
+            focus.application.node = found[0]
     return pid
 
 
@@ -136,38 +259,61 @@ def doDelay(delay=None):
     sleep(delay)
 
 
-class Highlight (Gtk.Window):  # pragma: no cover
+def requireGtk():
+    """
+    Declares the GTK and GDK versions dogtail uses. GTK is only imported by
+    the functions that need it, as importing it is slow; they call this first.
+    """
+    import gi
+    gi.require_version('Gtk', '3.0')
+    gi.require_version('Gdk', '3.0')
+
+
+class Highlight (object):  # pragma: no cover
+
+    """
+    A transparent window with a red frame around the given rectangle.
+    """
 
     def __init__(self, x, y, w, h):  # pragma: no cover
-        super(Highlight, self).__init__()
-        self.set_decorated(False)
-        self.set_has_resize_grip(False)
-        self.set_default_size(w, h)
-        self.screen = self.get_screen()
+        requireGtk()
+        from gi.repository import Gtk
+        self.window = Gtk.Window()
+        self.window.set_decorated(False)
+        self.window.set_has_resize_grip(False)
+        self.window.set_default_size(w, h)
+        self.screen = self.window.get_screen()
         self.visual = self.screen.get_rgba_visual()
         if self.visual is not None and self.screen.is_composited():
-            self.set_visual(self.visual)
-        self.set_app_paintable(True)
-        self.connect("draw", self.area_draw)
-        self.show_all()
-        self.move(x, y)
+            self.window.set_visual(self.visual)
+        self.window.set_app_paintable(True)
+        self.window.connect("draw", self.area_draw)
+        self.window.show_all()
+        self.window.move(x, y)
+
+    def destroy(self):  # pragma: no cover
+        self.window.destroy()
 
     def area_draw(self, widget, cr):  # pragma: no cover
+        import cairo
         cr.set_source_rgba(.0, .0, .0, 0.0)
         cr.set_operator(cairo.OPERATOR_SOURCE)
         cr.paint()
         cr.set_operator(cairo.OPERATOR_OVER)
         cr.set_source_rgb(0.9, 0.1, 0.1)
         cr.set_line_width(6)
-        cr.rectangle(0, 0, self.get_size()[0], self.get_size()[1])
+        cr.rectangle(0, 0, widget.get_size()[0], widget.get_size()[1])
         cr.stroke()
 
 
 class Blinker(object):  # pragma: no cover
     INTERVAL_MS = 1000
-    main_loop = GObject.MainLoop()
+    main_loop = None
 
     def __init__(self, x, y, w, h):  # pragma: no cover
+        from gi.repository import GObject
+        if Blinker.main_loop is None:
+            Blinker.main_loop = GObject.MainLoop()
         self.highlight_window = Highlight(x, y, w, h)
         if self.highlight_window.screen.is_composited() is not False:
             self.timeout_handler_id = GObject.timeout_add(
@@ -245,6 +391,42 @@ class Lock(object):
         return ''.join(random.choice(string.letters + string.digits) for x in range(5))
 
 
+sniffRefreshLock = None
+
+
+def lockSniffRefresh():
+    """
+    Tells sniff not to use auto-refresh while the script is running, by
+    creating the sniff_refresh lock. This is done on the first search or
+    action rather than at import time; later calls do nothing. The lock is
+    removed automatically on script exit.
+    """
+    global sniffRefreshLock
+    if sniffRefreshLock is not None:
+        return
+    sniffRefreshLock = False
+    # sniff also uses the tree and we don't want to lock from sniff itself.
+    # The lock may also be present from another script instance or be a
+    # leftover from a killed one.
+    if os.path.exists('/tmp/sniff_running.lock') or \
+            os.path.exists('/tmp/sniff_refresh.lock'):
+        return
+    lock = Lock(lockname='sniff_refresh.lock', randomize=False)
+    try:
+        lock.lock()
+        sniffRefreshLock = lock
+        atexit.register(_unlockSniffRefresh)
+    except OSError:  # pragma: no cover
+        pass
+
+
+def _unlockSniffRefresh():
+    # Dropping the lock removes it through Lock.__del__, while the modules it
+    # needs are still around.
+    global sniffRefreshLock
+    sniffRefreshLock = False
+
+
 a11yDConfKey = 'org.gnome.desktop.interface'
 
 
@@ -252,14 +434,12 @@ def isA11yEnabled():
     """
     Checks if accessibility is enabled via DConf.
     """
+    if os.environ.get('GTK_MODULES', '').find('gail:atk-bridge') != -1:
+        # Enabled through the environment; no need to read DConf
+        return True  # pragma: no cover
     from gi.repository.Gio import Settings
     InterfaceSettings = Settings(a11yDConfKey)
-    dconfEnabled = InterfaceSettings.get_boolean('toolkit-accessibility')
-    if os.environ.get('GTK_MODULES', '').find('gail:atk-bridge') == -1:
-        envEnabled = False
-    else:
-        envEnabled = True  # pragma: no cover
-    return (dconfEnabled or envEnabled)
+    return InterfaceSettings.get_boolean('toolkit-accessibility')
 
 
 def bailBecauseA11yIsDisabled():
@@ -293,6 +473,23 @@ def checkForA11y():
         bailBecauseA11yIsDisabled()
 
 
+a11yChecked = False
+
+
+def checkForA11yOnce():
+    """
+    Checks if accessibility is enabled (see checkForA11y()), if
+    config.checkForA11y is set and AT-SPI is used. This is done on the first
+    search or action rather than at import time; later calls do nothing.
+    """
+    global a11yChecked
+    if a11yChecked:
+        return
+    a11yChecked = True
+    if config.checkForA11y and config.backend == 'atspi':
+        checkForA11y()
+
+
 def checkForA11yInteractively():  # pragma: no cover
     """
     Checks if accessibility is enabled, and presents a dialog prompting the
@@ -300,6 +497,7 @@ def checkForA11yInteractively():  # pragma: no cover
     """
     if isA11yEnabled():
         return
+    requireGtk()
     from gi.repository import Gtk
     dialog = Gtk.Dialog('Enable Assistive Technology Support?',
                         None,
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the caching of dogtail.distro's package databases
+"""
+
+import os
+import tempfile
+import unittest
+from dogtail import distro
+from dogtail.distro import PackageDb, PackageNotFoundError
+from dogtail.i18n import getMoFilesForPackage
+from dogtail.version import Version
+
+
+class CountingPackageDb(PackageDb):
+
+    """
+    A package database knowing a few packages, which counts its lookups.
+    """
+
+    packages = {'gedit': ('3.10.4', ['/usr/bin/gedit',
+                                     '/usr/share/locale/ja/LC_MESSAGES/gedit.mo'],
+                          ['gtk3']),
+                'gtk3': ('3.10.9', ['/usr/lib/libgtk-3.so.0',
+                                    '/usr/share/locale/ja/LC_MESSAGES/gtk30.mo'],
+                         []),
+                'broken': ('1.0', [], ['gtk3', 'nosuch'])}
+
+    def __init__(self, databasePath):
+        PackageDb.__init__(self)
+        self.databasePaths = [databasePath]
+        self.lookups = 0
+
+    def _lookup(self, packageName):
+        self.lookups += 1
+        try:
+            return self.packages[packageName]
+        except KeyError:
+            raise PackageNotFoundError(packageName)
+
+    def _getVersion(self, packageName):
+        return Version.fromString(self._lookup(packageName)[0])
+
+    def _getFiles(self, packageName):
+        return self._lookup(packageName)[1]
+
+    def _getDependencies(self, packageName):
+        return self._lookup(packageName)[2]
+
+
+class TestPackageDbCache(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.databasePath = tempfile.mkstemp(prefix='dogtail-test-pkgdb-')
+        os.close(fd)
+        os.utime(self.databasePath, (1000, 1000))
+        self.db = CountingPackageDb(self.databasePath)
+
+    def tearDown(self):
+        os.remove(self.databasePath)
+
+    def test_answers_are_cached(self):
+        self.assertEquals(self.db.getVersion('gedit'), Version([3, 10, 4]))
+        self.assertEquals(self.db.getVersion('gedit'), Version([3, 10, 4]))
+        self.assertEquals(self.db.getFiles('gedit')[0], '/usr/bin/gedit')
+        self.assertEquals(self.db.lookups, 2)
+
+    def test_answers_are_copies(self):
+        self.db.getFiles('gedit').append('/tmp/changed')
+        self.assertEquals(len(self.db.getFiles('gedit')), 2)
+
+    def test_missing_packages_are_cached(self):
+        self.assertRaises(PackageNotFoundError, self.db.getVersion, 'nosuch')
+        self.assertRaises(PackageNotFoundError, self.db.getVersion, 'nosuch')
+        self.assertEquals(self.db.lookups, 1)
+
+    def test_database_change_invalidates(self):
+        self.db.getVersion('gedit')
+        os.utime(self.databasePath, (2000, 2000))
+        self.db.getVersion('gedit')
+        self.assertEquals(self.db.lookups, 2)
+
+    def test_batch_queries(self):
+        versions = self.db.getVersions(['gedit', 'nosuch', 'gtk3'])
+        self.assertEquals(sorted(versions.keys()), ['gedit', 'gtk3'])
+        self.assertEquals(versions['gtk3'], Version([3, 10, 9]))
+        fileLists = self.db.getFileLists(['gtk3', 'nosuch'])
+        self.assertEquals(fileLists.keys(), ['gtk3'])
+        self.assertEquals(self.db.lookups, 5)
+
+
+class TestMoFilesForPackage(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.databasePath = tempfile.mkstemp(prefix='dogtail-test-pkgdb-')
+        os.close(fd)
+        self.packageDb = distro.packageDb
+        distro.packageDb = CountingPackageDb(self.databasePath)
+
+    def tearDown(self):
+        distro.packageDb = self.packageDb
+        os.remove(self.databasePath)
+
+    def test_dependencies(self):
+        self.assertEquals(getMoFilesForPackage('gedit', 'ja'),
+                          ['/usr/share/locale/ja/LC_MESSAGES/gedit.mo',
+                           '/usr/share/locale/ja/LC_MESSAGES/gtk30.mo'])
+
+    def test_missing_dependency(self):
+        self.assertRaises(PackageNotFoundError,
+                          getMoFilesForPackage, 'broken', 'ja')
+
@@ -0,0 +1,821 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the dogtail.fakeatspi backend
+
+The tests of the Node API on top of the fake desktop only run when the fake
+backend is selected, e.g. with:
+
+DOGTAIL_BACKEND=fake python -m unittest test_fakeatspi
+"""
+
+import time
+import threading
+import unittest
+import tempfile
+import dogtail.config
+from dogtail import fakeatspi, stats
+
+fakeBackend = dogtail.config.config.backend == 'fake'
+if fakeBackend:
+    import dogtail.tree
+
+sampleApp = {
+    'name': 'fake-editor', 'roleName': 'application', 'children': [
+        {'name': 'Untitled', 'roleName': 'frame', 'children': [
+            {'name': 'Name', 'roleName': 'label', 'id': 'label',
+             'relations': {'label for': ['entry']}},
+            {'roleName': 'text', 'id': 'entry', 'text': 'hello',
+             'states': ['editable', 'sensitive', 'showing', 'focusable'],
+             'relations': {'labelled by': ['label']}},
+            {'name': 'Save', 'roleName': 'push button',
+             'actions': ['click'], 'extents': (10, 20, 80, 30)}]}]}
+
+
+class TestFakeAccessible(unittest.TestCase):
+
+    def setUp(self):
+        fakeatspi.reset()
+        self.app = fakeatspi.buildTree(sampleApp)
+
+    def test_structure(self):
+        frame = self.app[0]
+        self.assertEquals(str(frame), '[frame | Untitled]')
+        self.assertEquals(frame.parent, self.app)
+        self.assertEquals(len(frame), 3)
+        self.assertEquals(frame[-1].name, 'Save')
+        self.assertEquals(frame[2].getIndexInParent(), 2)
+        self.assertRaises(IndexError, frame.__getitem__, 3)
+        self.assertEquals(frame.getRole(), fakeatspi.ROLE_FRAME)
+
+    def test_interfaces(self):
+        button = self.app[0][2]
+        self.assertEquals(button.queryAction().getName(0), 'click')
+        self.assertEquals(button.queryComponent().getSize(), (80, 30))
+        self.assertRaises(NotImplementedError, button.queryText)
+        entry = self.app[0][1]
+        self.assertEquals(entry.queryText().getText(0, -1), 'hello')
+        entry.queryEditableText().setTextContents('bye')
+        self.assertEquals(entry.queryText().getText(0, -1), 'bye')
+
+    def test_states_and_relations(self):
+        entry = self.app[0][1]
+        self.assertTrue(entry.getState().contains(fakeatspi.STATE_EDITABLE))
+        self.assertFalse(entry.getState().contains(fakeatspi.STATE_FOCUSED))
+        relation = entry.getRelationSet()[0]
+        self.assertEquals(relation.getRelationType(),
+                          fakeatspi.RELATION_LABELLED_BY)
+        self.assertEquals(relation.getTarget(0).name, 'Name')
+
+    def test_call_count_and_defunct(self):
+        fakeatspi.resetCallCount()
+        self.app.name
+        self.app.childCount
+        self.assertEquals(fakeatspi.callCount, 2)
+        frame = self.app[0]
+        self.app.kill()
+        self.assertRaises(fakeatspi.GError, getattr, frame, 'name')
+
+    def test_load_dump(self):
+        dumpFile = tempfile.NamedTemporaryFile()
+        dumpFile.write("[application | fake-editor]\n"
+                       " [frame | Untitled]\n"
+                       "  [push button | Save]\n"
+                       "   [action | click | <Control>s ]\n"
+                       "  [label | [x]]\n")
+        dumpFile.flush()
+        app = fakeatspi.loadDump(dumpFile.name)
+        frame = app[0]
+        self.assertEquals(len(frame), 2)
+        self.assertEquals(frame[0].queryAction().getKeyBinding(0),
+                          '<Control>s')
+        self.assertEquals(frame[1].name, '[x]')
+
+
+@unittest.skipUnless(fakeBackend, "needs DOGTAIL_BACKEND=fake")
+class TestNodeOnFakeDesktop(unittest.TestCase):
+
+    def setUp(self):
+        dogtail.config.config.actionDelay = 0
+        dogtail.config.config.searchBackoffDuration = 0
+        fakeatspi.reset()
+        fakeatspi.addApplication(fakeatspi.buildTree(sampleApp))
+        self.app = dogtail.tree.root.application('fake-editor')
+
+    def test_search(self):
+        self.assertEquals(self.app.button('Save').name, 'Save')
+        self.assertEquals(self.app.child(label='Name').text, 'hello')
+        self.assertRaises(dogtail.tree.SearchError, self.app.child,
+                          'Nothing', retry=False)
+
+    def test_search_predicate_errors(self):
+        from dogtail import predicate
+
+        def broken(node):
+            return node.nmae == 'Save'
+        # A bug in the predicate is not taken for no match
+        self.assertRaises(AttributeError, self.app.findChildren, broken)
+        self.assertRaises(AttributeError, self.app.findChildren, broken,
+                          recursive=False)
+        pred = predicate.GenericPredicate('Save')
+        pred.satisfiedByNode = broken
+        self.assertRaises(AttributeError, self.app.findChild, pred,
+                          retry=False)
+
+        def defunctFrame(node):
+            if node.roleName == 'frame':
+                raise fakeatspi.GError("The application no longer exists")
+            return node.name == 'Save'
+        # But a node that cannot be read does not match
+        self.assertEquals(self.app.findChildren(defunctFrame),
+                          [self.app[0][2]])
+
+    def test_action(self):
+        button = self.app.button('Save')
+        button.doActionNamed('click')
+        self.assertEquals(button.performedActions, ['click'])
+
+    def test_action_cache(self):
+        button = self.app.button('Save')
+        button.doActionNamed('click')
+        fakeatspi.resetCallCount()
+        button.doActionNamed('click')
+        # The role name and name logged, the states and the action itself
+        self.assertEquals(fakeatspi.callCount, 4)
+        button.addAction('press')
+        button.doActionNamed('press')
+        self.assertEquals(button.performedActions, ['click', 'click', 'press'])
+        self.assertEquals(sorted(button.actions), ['click', 'press'])
+        self.assertRaises(dogtail.tree.ActionNotSupported,
+                          button.doActionNamed, 'jump')
+        button.kill()
+        self.assertRaises(fakeatspi.GError, button.doActionNamed, 'click')
+        self.assertFalse('actionIndexes' in button.user_data)
+
+    def test_states(self):
+        from dogtail import predicate
+        entry = self.app[0][1]
+        fakeatspi.resetCallCount()
+        states = entry.states
+        self.assertEquals(fakeatspi.callCount, 1)
+        self.assertTrue(isinstance(states, frozenset))
+        self.assertTrue('editable' in states)
+        self.assertTrue(states.focusable and not states.focused)
+        # Each flag is one fetch of the state set, as Node.states
+        fakeatspi.resetCallCount()
+        self.assertEquals((entry.sensitive, entry.showing, entry.focusable,
+                           entry.focused, entry.checked),
+                          (True, True, True, False, False))
+        self.assertEquals(fakeatspi.callCount, 5)
+        self.assertEquals(self.app.findChild(predicate.GenericPredicate(
+            states=['editable', 'focusable'])), entry)
+        self.assertEquals(self.app.findChildren(predicate.GenericPredicate(
+            roleName='text', states=['focused'])), [])
+
+    def test_fetch(self):
+        frame = self.app[0]
+        button = frame[2]
+        fakeatspi.resetCallCount()
+        properties = button.fetch('name', 'roleName', 'states', 'extents',
+                                  'actions')
+        # extents and actions query their interfaces first
+        self.assertEquals(fakeatspi.callCount, 9)
+        self.assertEquals(properties.name, 'Save')
+        self.assertEquals(properties['roleName'], 'push button')
+        self.assertTrue(properties.states.sensitive)
+        self.assertEquals(properties.extents, (10, 20, 80, 30))
+        self.assertEquals(properties.actions, {'click': ''})
+        self.assertRaises(ValueError, frame.fetch, 'nosuch')
+        # So few nodes are not given to the thread pool
+        chunks = []
+        runChunk = dogtail.tree._runChunk
+        dogtail.tree._runChunk = lambda function, chunk: \
+            chunks.append(chunk) or runChunk(function, chunk)
+        try:
+            fetched = dogtail.tree.fetchMany(frame.children, ('name', 'text'))
+        finally:
+            dogtail.tree._runChunk = runChunk
+        self.assertEquals([(p.name, p.text) for p in fetched],
+                          [('Name', None), ('', 'hello'), ('Save', None)])
+        self.assertEquals(chunks, [])
+
+    def test_table(self):
+        cells = []
+        for row in range(100):
+            cells.append({'name': 'File %i' % row, 'roleName': 'table cell'})
+            cells.append({'roleName': 'table cell', 'text': '%i kB' % row})
+        table = self.app.appendChild(fakeatspi.buildTree(
+            {'roleName': 'table', 'columns': 2,
+             'columnHeaders': ['Name', 'Size'], 'children': cells}))
+        self.assertEquals(table.columnIndex('Size'), 1)
+        self.assertRaises(dogtail.tree.SearchError, table.columnIndex, 'Date')
+        self.assertEquals(table.cellAt(3, 'Name').name, 'File 3')
+        self.assertEquals(table.readRows(98), [['File 98', '98 kB'],
+                                               ['File 99', '99 kB']])
+        self.assertEquals(table.readRows(10, 2, columns=['Size']),
+                          [['10 kB'], ['11 kB']])
+        fakeatspi.resetCallCount()
+        self.assertEquals(table.rowWhere('Name', 'File 70'), 70)
+        self.assertTrue(fakeatspi.callCount < 300)
+        self.assertEquals(table.rowWhere(0, 'File 100'), None)
+
+    def test_shared_thread_pool(self):
+        concurrently = dogtail.tree._concurrently
+        self.assertEquals(concurrently(lambda x: x * 2, range(50), 8),
+                          range(0, 100, 2))
+        pool = dogtail.tree._threadPool()
+        # Work given by the pool's threads is done by them right away
+        self.assertEquals(
+            concurrently(lambda x: concurrently(lambda y: x + y, range(3), 8),
+                         range(40), 40),
+            [[x, x + 1, x + 2] for x in range(40)])
+        self.assertTrue(dogtail.tree._threadPool() is pool)
+
+    def test_children_view(self):
+        dogtail.config.config.childrenLimit = 10
+        try:
+            panel = self.app.appendChild(fakeatspi.buildTree(
+                {'roleName': 'panel', 'children': [
+                    {'name': str(i), 'roleName': 'push button'}
+                    for i in range(250)]}))
+            view = panel.childrenView
+            fakeatspi.resetCallCount()
+            self.assertEquals(len(view), 250)
+            self.assertEquals(view[-1].name, '249')
+            # Only the last page was fetched
+            self.assertEquals(fakeatspi.callCount, 1 + 2 * 50 + 1)
+            self.assertEquals([c.name for c in view[98:102]],
+                              ['98', '99', '100', '101'])
+            # The pages are read by the same threads
+            threads = threading.activeCount()
+            self.assertEquals(len(list(view)), 250)
+            self.assertEquals(threading.activeCount(), threads)
+            self.assertRaises(IndexError, view.__getitem__, 250)
+        finally:
+            dogtail.config.config.childrenLimit = 100
+
+    def test_link_anchors(self):
+        paragraph = self.app.appendChild(fakeatspi.buildTree(
+            {'roleName': 'paragraph', 'links': [
+                {'uri': 'help:%i' % i,
+                 'anchor': {'name': 'Link %i' % i, 'roleName': 'link'}}
+                for i in range(20)]}))
+        # The anchors follow the children, unless they are left out
+        self.assertEquals([a.name for a in paragraph.children],
+                          ['Link %i' % i for i in range(20)])
+        self.assertEquals(
+            [values['name'] for depth, values in dogtail.dump.walk(
+                paragraph, properties=['name'])][1:],
+            ['Link %i' % i for i in range(20)])
+        dogtail.config.config.includeLinkAnchors = False
+        try:
+            self.assertEquals(paragraph.children, [])
+            self.assertEquals(
+                len(list(dogtail.dump.walk(paragraph, properties=['name']))),
+                1)
+        finally:
+            dogtail.config.config.includeLinkAnchors = True
+        fakeatspi.resetCallCount()
+        anchors = paragraph.linkAnchors
+        self.assertEquals(anchors[1].name, 'Link 1')
+        self.assertEquals(anchors[1].URI, 'help:1')
+        # Only the first two links were read
+        self.assertEquals(fakeatspi.callCount, 10)
+        self.assertEquals(len(anchors), 20)
+        self.assertEquals([a.name for a in anchors][-1], 'Link 19')
+        self.assertEquals(anchors[-1].URI, 'help:19')
+        self.assertEquals(len(self.app.button('Save').linkAnchors), 0)
+
+    def test_search_path_scope(self):
+        frame = self.app[0]
+        button = self.app.button('Save')
+        self.assertEquals(str(button.getAbsoluteSearchPath()),
+                          '{/("fake-editor" application,False)'
+                          '/("Untitled" window,False)/("Save" button,False)}')
+        fakeatspi.resetCallCount()
+        frame.getAbsoluteSearchPath()
+        alone = fakeatspi.callCount
+        with dogtail.tree.searchPathScope():
+            button.getAbsoluteSearchPath()
+            fakeatspi.resetCallCount()
+            frame.getAbsoluteSearchPath()
+            self.assertEquals(fakeatspi.callCount, 0)
+            self.assertEquals(button.getAbsoluteSearchPath(),
+                              button.getAbsoluteSearchPath())
+        self.assertTrue(alone > 0)
+
+    def test_search_path_pickle_and_resolver(self):
+        import pickle
+        from dogtail.path import PathResolver
+        frame = self.app[0]
+        paths = [node.getAbsoluteSearchPath() for node in frame.children]
+        # Computed again, the paths are equal, with the same hashes
+        self.assertEquals(paths[2], frame[2].getAbsoluteSearchPath())
+        self.assertEquals(len(set(paths + [frame[2].getAbsoluteSearchPath()])),
+                          len(paths))
+        loaded = pickle.loads(pickle.dumps(paths))
+        self.assertEquals(loaded, paths)
+        self.assertEquals(str(loaded[2]), str(paths[2]))
+        resolver = PathResolver(cache=True)
+        fakeatspi.resetCallCount()
+        nodes = resolver.resolve(loaded)
+        self.assertEquals([nodes[p] for p in loaded], frame.children)
+        resolved = fakeatspi.callCount
+        fakeatspi.resetCallCount()
+        self.assertEquals(resolver.resolve(loaded[2:]), {loaded[2]: frame[2]})
+        self.assertTrue(fakeatspi.callCount < resolved)
+        frame[2].kill()
+        self.assertEquals(resolver.resolve(loaded[2:]), {loaded[2]: None})
+
+    def test_node_key_and_interning(self):
+        button = self.app.button('Save')
+        fakeatspi.resetCallCount()
+        key = button.key
+        self.assertEquals(fakeatspi.callCount, 0)
+        self.assertEquals(key, (self.app.key[0], button.path))
+        self.assertNotEquals(key, self.app[0].key)
+        # Another proxy of the same accessible
+        proxy = fakeatspi.Accessible('Save', 'push button')
+        proxy._id = button._id
+        proxy._parent = button._parent
+        self.assertEquals(proxy, button)
+        self.assertEquals(len(set([proxy, button, self.app[0][2]])), 1)
+        self.assertTrue(dogtail.tree.internNode(proxy) is button)
+        self.assertEquals(proxy.debugName, None)
+        self.assertEquals(dogtail.tree.internNode(proxy).debugName,
+                          button.debugName)
+
+    def test_user_visible_strings(self):
+        self.assertEquals(self.app.getUserVisibleStrings(),
+                          ['fake-editor', 'Untitled', 'Name', 'Save'])
+        hidden = self.app.appendChild(fakeatspi.buildTree(
+            {'name': 'Preferences', 'roleName': 'dialog', 'children': [
+                {'name': 'Save', 'roleName': 'push button',
+                 'description': 'Save the preferences'}]}))
+        strings = list(self.app.iterUserVisibleStrings())
+        self.assertEquals([s for k, s, kind in strings],
+                          ['fake-editor', 'Untitled', 'Name', 'Save',
+                           'Preferences', 'Save the preferences'])
+        self.assertEquals(strings[-1], (hidden[0].key, 'Save the preferences',
+                                        'description'))
+        hidden.setState('showing', False)
+        self.assertEquals(
+            [s for k, s, kind in self.app.iterUserVisibleStrings(
+                showingOnly=True)],
+            ['fake-editor', 'Untitled', 'Name', 'Save'])
+        dogtail.tree._threadPool()
+        threadCount = threading.active_count()
+        self.assertEquals(
+            sorted(self.app.iterUserVisibleStrings(unique=False, threads=4)),
+            sorted(self.app.iterUserVisibleStrings(unique=False)))
+        # The walkers are the shared pool's threads
+        self.assertEquals(threading.active_count(), threadCount)
+        self.assertEquals(
+            dogtail.tree._concurrently(
+                lambda node: len(list(node.iterUserVisibleStrings(
+                    unique=False, threads=4))), [self.app, self.app], 2),
+            [len(list(self.app.iterUserVisibleStrings(unique=False)))] * 2)
+
+    def test_spatial_index(self):
+        from dogtail.spatial import SpatialIndex
+        frame = self.app[0]
+        frame.setExtents((0, 0, 400, 300))
+        button = frame[2]
+        index = SpatialIndex(frame, cellSize=32)
+        try:
+            fakeatspi.resetCallCount()
+            self.assertEquals(index.at(15, 25), button)
+            self.assertEquals(index.nodesAt(15, 25), [button, frame])
+            self.assertEquals(index.at(200, 200), frame)
+            self.assertEquals(index.at(500, 500), None)
+            self.assertEquals(index.overlapping(0, 0, 20, 30), [frame, button])
+            self.assertEquals(index.overlapping(100, 0, 10, 10), [frame])
+            self.assertEquals(fakeatspi.callCount, 0)
+            self.assertEquals(frame.getChildAtPoint(15, 25), button)
+            # Another proxy of the frame finds the index too
+            proxy = fakeatspi.Accessible('Untitled', 'frame')
+            proxy._id = frame._id
+            proxy._parent = frame._parent
+            self.assertTrue(dogtail.spatial.lookup(proxy) is index)
+            self.assertEquals(fakeatspi.callCount, 0)
+            self.assertEquals(index.nearest(500, 25), frame)
+            self.assertEquals(index.nearest(500, 25, maxDistance=50), None)
+            button.setExtents((300, 200, 20, 20))
+            self.assertEquals(index.at(15, 25), frame)
+            self.assertEquals(index.at(305, 205), button)
+            frame.removeChild(button)
+            self.assertEquals(index.at(305, 205), frame)
+        finally:
+            index.close()
+
+    def test_spatial_index_scrolled_extents(self):
+        from dogtail.spatial import SpatialIndex
+        frame = self.app[0]
+        frame.setExtents((0, 0, 400, 300))
+        # The contents of a viewport scrolled far down, and a row of them
+        contents = frame[0]
+        contents.setExtents((0, -1000000, 400, 2000000))
+        row = frame[2]
+        row.setExtents((0, 1000000, 400, 20))
+        start = time.time()
+        index = SpatialIndex(frame, cellSize=32, start=False)
+        self.assertTrue(len(index.cells) < 200)
+        self.assertEquals(index.oversized, set([index.entries[contents]]))
+        self.assertEquals(index.at(15, 25), contents)
+        self.assertEquals(index.at(15, 1000005), row)
+        self.assertEquals(index.nearest(15, 1000100), row)
+        self.assertEquals(index.nearest(15, -2000000), contents)
+        self.assertEquals(index.overlapping(0, 999990, 10, 100),
+                          [contents, row])
+        self.assertEquals(len(index.overlapping(-10 ** 9, -10 ** 9,
+                                                2 * 10 ** 9, 2 * 10 ** 9)), 3)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_waits(self):
+        import threading
+        from dogtail import events
+        frame = self.app[0]
+        button = self.app.button('Save')
+        entry = frame[1]
+
+        def later(function, *args):
+            timer = threading.Timer(0.05, function, args)
+            timer.start()
+            return timer
+
+        button.setState('sensitive', False)
+        later(button.setState, 'sensitive')
+        # Woken by the event, not by the periodic check
+        dogtail.config.config.waitInterval = 10
+        try:
+            start = time.time()
+            self.assertTrue(button.waitFor('sensitive', timeout=5))
+            self.assertTrue(time.time() - start < 0.4)
+        finally:
+            dogtail.config.config.waitInterval = 0.5
+        self.assertFalse(button.waitFor('focused', timeout=0.1))
+        self.assertTrue(button.waitFor('focused', present=False))
+        later(button.setName, 'Save As')
+        self.assertTrue(button.waitForName('Save As', timeout=5))
+        later(entry.queryEditableText().setTextContents, 'done')
+        self.assertTrue(entry.waitForText('done', timeout=5))
+        later(frame.removeChild, button)
+        self.assertTrue(button.waitUntilGone(timeout=5))
+        self.assertEquals(events.waiters, [])
+        self.assertEquals(fakeatspi.Registry.listeners, [])
+
+    def test_run_detects_startup(self):
+        import threading
+        from dogtail import utils
+        app = fakeatspi.buildTree({'name': 'sleep', 'roleName': 'application',
+                                   'pid': 4242})
+        fakeatspi.addApplication(app)
+        # Matched by process id rather than by name, once it has a frame
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4242, 'other'), None)
+        app.appendChild(fakeatspi.buildTree({'roleName': 'frame'}))
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4242, 'other'), app)
+        self.assertEquals(utils.applications[4242], app)
+        # Found again from the index, then forgotten once it is defunct
+        fakeatspi.resetCallCount()
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4242, 'other'), app)
+        self.assertEquals(fakeatspi.callCount, 1)
+        app.kill()
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4242, 'other'), None)
+        self.assertFalse(4242 in utils.applications)
+        self.assertFalse(app in utils._processIds)
+        # Nor are the process ids of the nodes no longer in use kept
+        gone = fakeatspi.buildTree({'roleName': 'application', 'pid': 4444})
+        self.assertEquals(utils._processId(gone), 4444)
+        count = len(utils._processIds)
+        del gone
+        self.assertEquals(len(utils._processIds), count - 1)
+        starting = fakeatspi.buildTree(
+            {'name': 'true', 'roleName': 'application', 'children': [
+                {'name': 'True', 'roleName': 'frame'}]})
+        timer = threading.Timer(0.1, fakeatspi.addApplication, [starting])
+        timer.start()
+        start = time.time()
+        utils.run('true', timeout=5, interval=2, desktop=dogtail.tree.root)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(utils.applications['true'], starting)
+        # A process id that could not be read is asked for again
+        late = fakeatspi.addApplication(fakeatspi.buildTree(
+            {'name': 'late', 'roleName': 'application', 'children': [
+                {'roleName': 'frame'}]}))
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4343, 'other'), None)
+        late._processId = 4343
+        self.assertEquals(
+            utils._findApplication(dogtail.tree.root, 4343, 'other'), late)
+
+    def test_run_ignores_other_applications(self):
+        import threading
+        from dogtail import utils
+        frame = self.app[0]
+        busy = fakeatspi.buildTree({'name': 'busy', 'roleName': 'application'})
+
+        def work():
+            for i in range(20):
+                frame.appendChild(fakeatspi.Accessible(str(i), 'label'))
+            fakeatspi.addApplication(busy)
+            busy.appendChild(fakeatspi.Accessible('Busy', 'frame'))
+
+        scans = []
+        startedApplications = utils._startedApplications
+        utils._startedApplications = lambda *args: \
+            scans.append(args) or startedApplications(*args)
+        timer = threading.Timer(0.1, work)
+        timer.start()
+        try:
+            start = time.time()
+            utils.run('true', timeout=5, interval=10, appName='busy',
+                      desktop=dogtail.tree.root)
+        finally:
+            utils._startedApplications = startedApplications
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals(utils.applications['busy'], busy)
+        # Twice before any event, then at most for the application and for
+        # its frame, but not for the labels
+        self.assertTrue(len(scans) <= 4)
+
+    def test_dump(self):
+        from gtkdemotest import trap_stdout
+        output = trap_stdout(self.app.button('Save').dump)
+        self.assertEquals(output, "[push button | Save]\n"
+                                  " [action | click |  ]")
+
+    def test_dump_json_and_xml(self):
+        import json
+        from xml.dom.minidom import parseString
+        from gtkdemotest import trap_stdout
+        frame = self.app[0]
+        lines = trap_stdout(frame.dump, 'json').split('\n')
+        self.assertEquals(len(lines), 4)
+        button = json.loads(lines[-1])
+        self.assertEquals(button['depth'], 1)
+        self.assertEquals(button['name'], 'Save')
+        self.assertEquals(button['actions'],
+                          [{'name': 'click', 'keyBinding': ''}])
+        document = parseString(trap_stdout(frame.dump, 'xml'))
+        nodes = document.getElementsByTagName('node')
+        self.assertEquals([n.getAttribute('roleName') for n in nodes],
+                          ['frame', 'label', 'text', 'push button'])
+        self.assertEquals(nodes[-1].parentNode, nodes[0])
+
+    def test_dump_depth_roles_and_properties(self):
+        from gtkdemotest import trap_stdout
+        output = trap_stdout(self.app.dump, {'maxDepth': 1})
+        self.assertEquals(output, "[application | fake-editor]\n"
+                                  " [frame | Untitled]")
+        output = trap_stdout(self.app.dump,
+                             {'roleNames': ['push button'],
+                              'properties': ['extents']})
+        self.assertEquals(output, "[push button | Save | extents: "
+                                  "10, 20, 80, 30]")
+
+    def test_dump_deep_tree(self):
+        node = spec = {'name': 'deep', 'roleName': 'panel'}
+        for i in range(3000):
+            child = {'roleName': 'panel'}
+            node['children'] = [child]
+            node = child
+        fakeatspi.reset()
+        fakeatspi.addApplication(fakeatspi.buildTree(
+            {'name': 'deep', 'roleName': 'application', 'children': [spec]}))
+        dumpFile = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.application('deep').dump(fileName=dumpFile.name)
+        self.assertEquals(len(open(dumpFile.name).readlines()), 3002)
+
+    def test_dump_desktop(self):
+        from StringIO import StringIO
+        from dogtail import dump
+        fakeatspi.addApplication(fakeatspi.buildTree(
+            dict(sampleApp, name='other-editor')))
+        for type in ('plain', 'json', 'xml'):
+            sequential = StringIO()
+            dump.dumpers[type](dogtail.tree.root, sequential)
+            concurrent = StringIO()
+            self.assertEquals(dump.desktop(type, concurrent), [])
+            self.assertEquals(concurrent.getvalue(), sequential.getvalue())
+        output = StringIO()
+        self.assertEquals(dump.desktop('plain', output, appTimeout=0),
+                          ['fake-editor', 'other-editor'])
+        self.assertEquals(output.getvalue(), "[desktop frame | main]\n")
+
+    def test_dump_desktop_snapshot(self):
+        from StringIO import StringIO
+        from dogtail import dump, snapshot
+        snapshotFile = tempfile.NamedTemporaryFile()
+        self.assertEquals(dump.desktop('snapshot', snapshotFile.name), [])
+        shot = snapshot.Snapshot(snapshotFile.name)
+        try:
+            self.assertEquals(len(shot), 6)
+            self.assertEquals(shot.root.roleName, 'desktop frame')
+        finally:
+            shot.close()
+        self.assertRaises(ValueError, dump.desktop, 'snapshot', StringIO())
+
+    def test_labelled_search(self):
+        from dogtail import mirror, predicate
+        frame = self.app[0]
+        entry = self.app.findChild(predicate.IsLabelledAs('Name'))
+        self.assertEquals(entry, frame[1])
+        # Only the entry labelled Name is tried
+        self.assertEquals(entry.searchStats.predicateEvaluations, 1)
+        self.assertEquals(frame.child(label='Name', recursive=False), entry)
+        # A label outside of the node searched
+        outside = self.app.appendChild(fakeatspi.Accessible('Outside',
+                                                            'label'))
+        outside.addRelation('label for', frame[2])
+        self.assertEquals(frame.child(label='Outside'), frame[2])
+        with mirror.LiveMirror(self.app):
+            self.assertEquals(frame.child(label='Outside'), frame[2])
+            self.assertEquals(self.app.findChildren(
+                predicate.GenericPredicate(label='Name')), [entry])
+
+    def test_labelled_search_falls_back(self):
+        from dogtail import mirror, predicate
+        frame = self.app[0]
+
+        class IsButtonLabelledAs(predicate.IsLabelledAs):
+
+            def _genCompareFunc(self):
+                labelled = predicate.IsLabelledAs._genCompareFunc(self)
+                return lambda node: node.roleName == 'push button' and \
+                    labelled(node)
+
+        # The label Name is for the entry, but a button is wanted, which
+        # says it is labelled by Name through its own relations only
+        button = frame.appendChild(fakeatspi.Accessible('', 'push button'))
+        button._relations[fakeatspi.relationByName['labelled by']] = \
+            [frame[0]]
+        pred = IsButtonLabelledAs('Name')
+        self.assertEquals(frame.findChild(pred, retry=False), button)
+        self.assertEquals(frame.findChild(pred, recursive=False,
+                                          retry=False), button)
+        self.assertEquals(frame.findChildren(pred), [button])
+        with mirror.LiveMirror(self.app):
+            self.assertEquals(frame.findChild(pred, retry=False), button)
+        # Only the children are read when the search is not recursive
+        try:
+            self.app.findChild(predicate.IsLabelledAs('Name'),
+                               recursive=False, retry=False)
+        except dogtail.tree.SearchError as error:
+            self.assertEquals(error.stats.maxDepth, 1)
+        else:
+            self.fail("The entry is not a child of the application")
+
+    def test_live_mirror(self):
+        from dogtail import mirror, predicate
+        frame = self.app[0]
+        with mirror.LiveMirror(self.app) as liveMirror:
+            self.assertEquals(len(liveMirror), 5)
+            fakeatspi.resetCallCount()
+            button = self.app.child('Save', roleName='push button')
+            self.assertEquals(button, frame[2])
+            # Only the button found is read from the application
+            self.assertEquals(fakeatspi.callCount, 4)
+            frame.appendChild(fakeatspi.Accessible('Open', 'push button'))
+            frame[2].setName('Save As')
+            self.assertEquals(liveMirror.eventCount, 2)
+            self.assertEquals(
+                [str(node) for node in self.app.findChildren(
+                    predicate.GenericPredicate(roleName='push button'))],
+                ['[push button | Save As]', '[push button | Open]'])
+            frame.removeChild(frame[3])
+            self.assertFalse(self.app.isChild('Open'))
+            # A change the mirror was not told about
+            frame[0]._name = 'Title'
+            self.assertFalse(self.app.isChild('Name', roleName='label'))
+            self.assertTrue(self.app.isChild('Title', roleName='label'))
+        self.assertEquals(mirror.mirrors, [])
+
+    def test_live_mirror_index(self):
+        from dogtail import mirror, predicate
+        frame = self.app[0]
+        with mirror.LiveMirror(self.app) as liveMirror:
+            self.assertEquals(len(liveMirror.byRoleName['push button']), 1)
+            frame.appendChild(fakeatspi.Accessible('Save', 'menu item'))
+            frame[2].setName('Save As')
+            self.assertEquals(liveMirror.byName[u'Save As'],
+                              set([liveMirror.nodes[frame[2]]]))
+            search = stats.SearchStatistics('Save menu item')
+            self.assertEquals(liveMirror.findChild(
+                self.app, predicate.IsAMenuItemNamed('Save'), stats=search),
+                frame[3])
+            # Only the nodes named Save are tried
+            self.assertEquals(search.nodesVisited, 1)
+            self.assertEquals(self.app.button('Save As'), frame[2])
+            # Patterns cannot be looked up in the index
+            self.assertEquals(
+                predicate.IsAButtonNamed('Save.*').indexKeys(),
+                (('push button',), None))
+            self.assertEquals(self.app.button('Save.*'), frame[2])
+            self.assertEquals(frame.findChildren(
+                predicate.GenericPredicate(roleName='push button'),
+                recursive=False), [frame[2]])
+
+    def test_snapshot(self):
+        from dogtail import snapshot, predicate
+        snapshotFile = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.dump('snapshot', snapshotFile.name)
+        shot = snapshot.Snapshot(snapshotFile.name)
+        self.assertEquals(len(shot), 6)
+        self.assertEquals(str(shot.root), '[desktop frame | main]')
+        button = shot.root.findChild(predicate.IsAButtonNamed('Save'))
+        self.assertEquals(button.actions, {'click': ''})
+        self.assertEquals(button.extents, (10, 20, 80, 30))
+        self.assertEquals(button.parent.name, 'Untitled')
+        self.assertEquals(button.indexInParent, 2)
+        entry = shot.root.findChild(predicate.IsLabelledAs('Name'))
+        self.assertEquals(entry.roleName, 'text')
+        self.assertTrue('editable' in entry.states)
+        self.assertEquals(entry.labeller.name, 'Name')
+        self.assertEquals(
+            len(shot.root.findChildren(predicate.GenericPredicate())), 5)
+        self.assertEquals(shot.root[0].findChildren(
+            predicate.GenericPredicate(), recursive=False), [shot.root[0][0]])
+        fake = shot.toFake()
+        self.assertEquals(str(fake[0][0][1].getRelationSet()[0].getTarget(0)),
+                          '[label | Name]')
+        shot.close()
+
+    def test_diff(self):
+        from dogtail import diff
+        before = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.dump('snapshot', before.name)
+        frame = dogtail.tree.root[0][0]
+        frame[0].setName('Title')
+        frame[2].setState('checked')
+        frame.removeChild(frame[1])
+        frame.appendChild(fakeatspi.Accessible('Open', 'push button'))
+        after = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.dump('snapshot', after.name)
+        differences = diff.diff(before.name, after.name)
+        self.assertEquals(differences.matched, 5)
+        self.assertEquals(
+            [(d.kind, d.property, str(d.node)) for d in differences],
+            [('removed', None, '[text | ]'),
+             ('added', None, '[push button | Open]'),
+             ('changed', 'name', '[label | Title]'),
+             ('changed', 'states', '[push button | Save]')])
+        self.assertEquals(differences.byKind('added')[0].path,
+                          '[desktop frame | main]/[application | fake-editor]'
+                          '/[frame | Untitled]/[push button | Open]')
+        self.assertFalse(diff.diff(after.name, after.name))
+
+    def test_diff_dumps(self):
+        from dogtail import diff
+        properties = ('roleName', 'name', 'actions', 'states')
+        for type in ('plain', 'json'):
+            before = tempfile.NamedTemporaryFile()
+            dogtail.tree.root.dump(type, before.name, properties=properties)
+            dogtail.tree.root[0][0][2].addAction('activate-' + type)
+            after = tempfile.NamedTemporaryFile()
+            dogtail.tree.root.dump(type, after.name, properties=properties)
+            differences = diff.diff(before.name, after.name)
+            self.assertEquals(len(differences), 1)
+            self.assertEquals(differences.differences[0].property, 'actions')
+            self.assertEquals(str(differences).count('\n'), 0)
+
+    def test_diff_empty_tree(self):
+        from dogtail import diff
+        empty = tempfile.NamedTemporaryFile()
+        self.assertEquals(diff.load(empty.name), None)
+        full = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.dump('plain', full.name)
+        size = diff._size(diff.load(full.name))
+        added = diff.diff(empty.name, full.name)
+        self.assertEquals([(d.kind, d.size) for d in added], [('added', size)])
+        removed = diff.diff(full.name, empty.name)
+        self.assertEquals([(d.kind, d.size) for d in removed],
+                          [('removed', size)])
+        self.assertFalse(diff.diff(empty.name, empty.name))
+
+    def test_snapshot_rejects_other_files(self):
+        from dogtail import snapshot
+        otherFile = tempfile.NamedTemporaryFile()
+        otherFile.write('[application | fake-editor]\n')
+        otherFile.flush()
+        self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot,
+                          otherFile.name)
+
+    def test_snapshot_rejects_empty_and_truncated_files(self):
+        from dogtail import snapshot
+        emptyFile = tempfile.NamedTemporaryFile()
+        self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot,
+                          emptyFile.name)
+        snapshotFile = tempfile.NamedTemporaryFile()
+        dogtail.tree.root.dump('snapshot', snapshotFile.name)
+        data = open(snapshotFile.name, 'rb').read()
+        for length in (snapshot._header.size - 1, snapshot._header.size,
+                       len(data) // 2):
+            truncatedFile = tempfile.NamedTemporaryFile()
+            truncatedFile.write(data[:length])
+            truncatedFile.flush()
+            self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot,
+                              truncatedFile.name)
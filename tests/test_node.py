@@ -585,6 +585,36 @@ class TestSearching(GtkDemoTest):
         direct_cells = filter(lambda cell: cell.roleName == 'table cell', table.children)
         self.assertEquals(len(cells), len(direct_cells))
 
+    def test_search_stats(self):
+        builder = self.app.child("Builder")
+        stats = builder.searchStats
+        self.assertTrue(stats.found)
+        self.assertTrue(stats.firstAttemptHit)
+        self.assertTrue(stats.maxDepth > 1)
+        self.assertTrue(stats.nodesVisited >= stats.maxDepth)
+        self.assertEquals(stats.predicateEvaluations, stats.nodesVisited)
+
+    def test_search_stats_on_failure(self):
+        try:
+            self.app.child("This does not exist", retry=False)
+        except dogtail.tree.SearchError as e:
+            self.assertFalse(e.stats.found)
+            self.assertEquals(e.stats.attempts, 1)
+            self.assertEquals(e.stats.sleepTime, 0.0)
+            self.assertTrue(e.stats.nodesVisited > 0)
+        else:
+            self.fail("SearchError not raised")
+
+    def test_search_report(self):
+        from dogtail.stats import searchReport
+        searchReport.reset()
+        self.app.child("Builder")
+        self.app.child("Builder")
+        totals = searchReport.totals['child with name="Builder"']
+        self.assertEquals(totals.searches, 2)
+        self.assertEquals(totals.firstAttemptHits, 2)
+        self.assertIn('child with name="Builder"', str(searchReport))
+
     def test_find_by_shortcut(self):
         self.runDemo("Application window")
         wnd = self.app.window("Application Window")
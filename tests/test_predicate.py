@@ -47,6 +47,21 @@ class TestPredicate(unittest.TestCase):
         predicate = dogtail.predicate.Predicate()
         self.assertNotEquals(predicate, self)
 
+    def test_equality_and_hash_by_data(self):
+        import pickle
+        button1 = dogtail.predicate.IsAButtonNamed('OK')
+        button2 = dogtail.predicate.IsAButtonNamed('OK')
+        self.assertEquals(button1, button2)
+        self.assertEquals(hash(button1), hash(button2))
+        self.assertNotEquals(button1, dogtail.predicate.IsAButtonNamed('No'))
+        self.assertNotEquals(button1, dogtail.predicate.IsATabNamed('OK'))
+        generic = dogtail.predicate.GenericPredicate(
+            name='OK', roleName='push button', description='Accept')
+        loaded = pickle.loads(pickle.dumps(generic))
+        self.assertEquals(loaded, generic)
+        self.assertTrue(loaded.satisfiedByNode(
+            self.DummyNode('OK', 'push button', 'Accept')))
+
     def test_predicates_application(self):
         dummyApp = self.DummyNode('dummy', 'application')
         appPredicate = dogtail.predicate.IsAnApplicationNamed(dummyApp.name)